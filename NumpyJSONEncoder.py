@@ -3,16 +3,14 @@ import numpy as np
 
 
 class NumpyJSONEncoder(json.JSONEncoder):
-    """Extended JSON encoder default method to handle numpy classes. This is incomplete - add more as needed."""
+    """Extended JSON encoder default method to handle numpy classes. Gets called once per numpy object, so for big
+    results convert to builtin types in bulk first (see ndjson.py)."""
     def default(self, obj):
 
-        if isinstance(obj, np.ndarray) and obj.ndim == 1:
+        if isinstance(obj, np.ndarray):
             return obj.tolist()
 
-        if isinstance(obj, np.int32):
-            return int(obj)
+        if isinstance(obj, (np.integer, np.floating, np.bool_)):
+            return obj.item()
 
-        if isinstance(obj, np.float64):
-            return float(obj)
-
-        return json.JSONEncoder.default(self, obj)
\ No newline at end of file
+        return json.JSONEncoder.default(self, obj)
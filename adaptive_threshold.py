@@ -0,0 +1,129 @@
+# Adaptive (local) thresholding with summed-area tables
+#   A single global threshold breaks when the stitched panels differ in contrast. Instead, threshold each px against the
+#   mean and standard deviation of the window around it. With a summed-area table (integral image) of the px and their
+#   squares, the sum over any window is a few lookups, so the cost doesn't depend on the window size.
+#
+#   The frame is processed in horizontal tiles, each with its own sums over just the rows its windows cover. That keeps
+#   the sums small (better precision for float images), memory bounded by the tile size instead of 2 full size tables,
+#   and lets the tiles run in parallel threads - numpy releases the GIL for the cumsums and arithmetic.
+#
+#   Windows are clipped at the image edges, i.e. edge px use the mean/std of the part of the window inside the image.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+TILE_ROWS = 512
+THRESHOLD_METHODS = ('niblack', 'sauvola')
+
+
+def window_sums(block, top, bottom, half):
+    """Sums of block over the windows [top[i]:bottom[i], c - half:c + half + 1] (clipped to the block) for every row i
+    and column c. Same as 4 lookups in a summed-area table, but done separably: a column-wise cumsum over the block, row
+    differences for just the rows needed (cheap whole row copies), then a row-wise cumsum of those. Columns use slices of
+    the row-wise cumsum padded by repeating its 1st and last columns, which is the same as clipping the windows."""
+    width = block.shape[1]
+    dtype = np.int64 if np.issubdtype(block.dtype, np.integer) else np.float64
+    # Row by row instead of np.cumsum(axis=0), which is several times slower on C-ordered arrays
+    col_sums = np.zeros((block.shape[0] + 1, width), dtype=dtype)
+    for i in range(block.shape[0]):
+        np.add(col_sums[i], block[i], out=col_sums[i + 1])
+    rows = col_sums[bottom] - col_sums[top]
+    del col_sums
+
+    sat = np.zeros((rows.shape[0], width + 1 + 2*half), dtype=dtype)
+    np.cumsum(rows, axis=1, out=sat[:, half + 1:half + 1 + width])
+    sat[:, half + 1 + width:] = sat[:, half + width:half + 1 + width]
+    return sat[:, 2*half + 1:2*half + 1 + width] - sat[:, :width]
+
+
+def tile_mean_std(img, window, r0, r1):
+    """Local mean and std of rows r0:r1 of img over window x window windows (clipped to the image)"""
+    height, width = img.shape
+    half = window // 2
+
+    # Only the rows the windows of this tile cover
+    a0 = max(r0 - half, 0)
+    a1 = min(r1 + half, height)
+    block = img[a0:a1]
+    if np.issubdtype(block.dtype, np.integer):
+        squares = block.astype(np.int64)**2
+    else:
+        squares = block.astype(np.float64)**2
+
+    rows = np.arange(r0, r1)
+    top = np.maximum(rows - half, 0) - a0
+    bottom = np.minimum(rows + half + 1, height) - a0
+    cols = np.arange(width)
+    count = np.outer(bottom - top, np.minimum(cols + half + 1, width) - np.maximum(cols - half, 0))
+
+    mean = window_sums(block, top, bottom, half) / count
+    var = window_sums(squares, top, bottom, half) / count - mean**2
+    return mean, np.sqrt(np.maximum(var, 0))
+
+
+def run_tiles(img, tile_fun, workers=1, tile_rows=TILE_ROWS):
+    """Call tile_fun(r0, r1) for each tile of rows r0:r1 of 2-D img, in workers threads"""
+    if img.ndim != 2:
+        raise ValueError('Adaptive thresholding needs a 2-D (greyscale) image, got shape {shape}'.format(shape=img.shape))
+
+    def do_tile(r0):
+        tile_fun(r0, min(r0 + tile_rows, img.shape[0]))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(do_tile, range(0, img.shape[0], tile_rows)))  # list to raise any exceptions
+
+
+def local_mean_std(img, window, workers=1, tile_rows=TILE_ROWS):
+    """Get (mean, std) images of the window x window neighbourhood of every px of 2-D img"""
+    mean = np.empty(img.shape)
+    std = np.empty(img.shape)
+
+    def tile_fun(r0, r1):
+        mean[r0:r1], std[r0:r1] = tile_mean_std(img, window, r0, r1)
+
+    run_tiles(img, tile_fun, workers, tile_rows)
+    return mean, std
+
+
+def threshold_map(img, window=201, method='niblack', k=0.5, offset=0, r=None, min_threshold=None, max_threshold=None,
+                  workers=1, tile_rows=TILE_ROWS):
+    """Get a threshold for every px of 2-D img from the mean m and std s of the window around it. Px > their threshold
+    are foreground.
+
+    Args:
+        window (int): Window size in px. Should be a few times bigger than a cell so windows over cells still see
+            background.
+        method (str): 'niblack' for m + k*s + offset (bright objects on a dark background), or 'sauvola' for
+            m*(1 + k*(s/r - 1)) + offset
+        k (float): Weight of the std
+        offset (float): Added to the threshold
+        r (float): Dynamic range of the std for sauvola. Defaults to half the range of img, like skimage.
+        min_threshold, max_threshold (float): Clip the threshold to these, e.g. to keep it near a known-good global
+            threshold
+        workers (int): Number of threads to process tiles with
+        tile_rows (int): Number of rows per tile
+
+    Returns:
+        float32 image of thresholds
+    """
+    if method not in THRESHOLD_METHODS:
+        raise ValueError('Unknown threshold method {method}. Options are {options}.'.format(
+            method=method, options=', '.join(THRESHOLD_METHODS)))
+    if method == 'sauvola' and r is None:
+        r = 0.5 * (float(img.max()) - float(img.min()))
+
+    threshold = np.empty(img.shape, dtype=np.float32)
+
+    def tile_threshold(r0, r1):
+        mean, std = tile_mean_std(img, window, r0, r1)
+        if method == 'niblack':
+            tile = mean + k * std + offset
+        else:
+            tile = mean * (1 + k * (std / r - 1)) + offset
+        if min_threshold is not None or max_threshold is not None:
+            np.clip(tile, min_threshold, max_threshold, out=tile)
+        threshold[r0:r1] = tile
+
+    run_tiles(img, tile_threshold, workers, tile_rows)
+    return threshold
@@ -0,0 +1,57 @@
+# Helpers for axis-aligned bounding boxes in images
+#   Boxes are tuples (min_row, min_col, max_row, max_col) with the max exclusive, same as regionprops' bbox, so
+#   img[box_slices(box)] is the region inside the box.
+
+
+def slices_box(slices):
+    """Convert a pair of slices (like the ones from scipy.ndimage.find_objects) to a box"""
+    return (slices[0].start, slices[1].start, slices[0].stop, slices[1].stop)
+
+
+def box_slices(box):
+    """Convert a box to a pair of slices for indexing an image"""
+    return (slice(box[0], box[2]), slice(box[1], box[3]))
+
+
+def box_area(box):
+    return (box[2] - box[0]) * (box[3] - box[1])
+
+
+def scale_box(box, scale):
+    """Scale box from a downsampled image by an integer factor back to the full size image"""
+    return tuple(x * scale for x in box)
+
+
+def pad_box(box, pad, shape):
+    """Grow box by pad px on each side, clipped to an image of shape (rows, cols)"""
+    return (max(box[0] - pad, 0), max(box[1] - pad, 0),
+            min(box[2] + pad, shape[0]), min(box[3] + pad, shape[1]))
+
+
+def boxes_overlap(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def union_box(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def merge_boxes(boxes):
+    """Merge overlapping boxes until none overlap. Merging can make a box overlap one it didn't before, so repeat until
+    nothing changes."""
+    boxes = list(boxes)
+    changed = True
+    while changed:
+        changed = False
+        boxes.sort()
+        merged = []
+        for box in boxes:
+            for i in range(len(merged) - 1, -1, -1):
+                if boxes_overlap(merged[i], box):
+                    merged[i] = union_box(merged[i], box)
+                    changed = True
+                    break
+            else:
+                merged.append(box)
+        boxes = merged
+    return boxes
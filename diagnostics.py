@@ -0,0 +1,74 @@
+# Lazily rendered intermediate outputs for a single frame
+#   Segmentation functions describe the intermediates they can save and how to render them, and nothing is rendered
+#   (no RGB overlays, rescaled copies, etc.) unless something asked for it. Also keeps the step counter that keeps all
+#   intermediate outputs in order.
+
+from os.path import join as joinpath
+
+import tifffile as tiff
+
+from save_tiff import save_tiff
+import profiling
+
+
+def imsave(output, img):
+    """Save img uncompressed with tifffile. Works with images PIL can't handle, like 16-bit RGB."""
+    tiff.imsave(output, img)
+
+
+class Diagnostics:
+    """Intermediate outputs for frame `name`, saved to temp_dir as <name>_<step>_<suffix>.tif
+
+    Usage:
+        diag = Diagnostics(name, temp_dir, save_figs=save_figs)
+        diag.next_step('Thresholding...')
+        diag.save('thresholded', lambda: img_as_ubyte(img))  # only called if the output is wanted
+    """
+
+    def __init__(self, name, temp_dir='temp', save_figs=False, outputs=None, step=0, writer=save_tiff, verbose=True):
+        """
+        Args:
+            name (str): Frame name, used as the prefix of output filenames
+            temp_dir (str): Directory intermediates are saved to
+            save_figs (bool): Save every intermediate
+            outputs (iterable of str): Suffixes of intermediates to save even if save_figs is False
+            step (int): Starting step number
+            writer (function): Called as writer(filename, img) to save an image
+            verbose (bool): Print progress messages. Turn off when segmenting lots of small crops.
+        """
+        self.name = name
+        self.temp_dir = temp_dir
+        self.save_figs = save_figs
+        self.outputs = set(outputs) if outputs is not None else set()
+        self.step = step
+        self.writer = writer
+        self.verbose = verbose
+
+    def log(self, message):
+        """Print progress message if verbose. Also starts a new step for profiling (if on)."""
+        if self.verbose:
+            print(message)
+            profiling.checkpoint(self.name, message)
+
+    def next_step(self, message=None):
+        """Advance the step counter, printing message if given"""
+        self.step += 1
+        if message is not None:
+            self.log(message)
+        elif self.verbose:
+            profiling.checkpoint(self.name, 'Step %d' % (self.step,))
+
+    def wants(self, suffix):
+        """Whether the intermediate with suffix will be saved. Use to skip work only needed for outputs."""
+        return self.save_figs or suffix in self.outputs
+
+    def filename(self, suffix):
+        return joinpath(self.temp_dir, ''.join([self.name, '_', str(self.step), '_', suffix, '.tif']))
+
+    def save(self, suffix, render):
+        """Save intermediate image if it's wanted. render is either the image or a function with no args that returns
+        it, which is only called if the image will be saved."""
+        if not self.wants(suffix):
+            return
+        img = render() if callable(render) else render
+        self.writer(self.filename(suffix), img)
@@ -0,0 +1,237 @@
+# On-disk index of the frames in an input directory
+#   Built once by opening every TIFF and updated incrementally afterwards - only new or modified files get reopened.
+#   Each entry holds where the frame lives (file, page, byte offsets) and what it is (colony, time, size, shape, dtype)
+#   so frames can be ordered by time and loaded individually without scanning the whole directory again.
+#   Stored as JSON next to the images so it can be inspected by hand.
+
+import os
+from os.path import join as joinpath
+from os.path import isfile
+import re
+import json
+
+import tifffile as tiff
+
+INDEX_FILENAME = 'frame_index.json'
+INDEX_VERSION = 1
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+
+# Raw names look like "Colony_54_3x3a_Time0070" and compressed/renamed ones like "Colony_54_Time0070_3x3a"
+#   Parse each part separately so both orders work
+colony_format = re.compile(r'Colony_(\d+)')
+time_format = re.compile(r'Time(\d+)')
+size_format = re.compile(r'(?:^|_)(\d)x\da(?:_|$)')
+
+
+def parse_frame_name(name):
+    """Get dict of colony, time, and size (panels per side) from a frame name. Missing parts are None."""
+    colony = colony_format.search(name)
+    time = time_format.search(name)
+    size = size_format.search(name)
+    return {'colony': int(colony.group(1)) if colony else None,
+            'time': int(time.group(1)) if time else None,
+            'size': int(size.group(1)) if size else None}
+
+
+def list_tiff_files(input_dir):
+    """Get the TIFF files in input_dir, excluding directories and anything else (like the index itself)"""
+    return [f for f in os.listdir(input_dir)
+            if isfile(joinpath(input_dir, f)) and f.lower().endswith(TIFF_EXTENSIONS)]
+
+
+def frame_name(file, page, n_pages):
+    """Name of a frame, matching what image_loader has always returned"""
+    if n_pages == 1:  # Handle usual case of single-page TIFF w/o page number in name
+        return file.split('.')[0]
+    else:
+        return file.split('.')[0] + '_page_%d' % (page + 1,)
+
+
+def index_file_frames(input_dir, file):
+    """Read the headers of every page of a TIFF and return a list of frame entries. Pixel data isn't decoded."""
+    filename = joinpath(input_dir, file)
+    frames = []
+    with tiff.TiffFile(filename) as tif:
+        n_pages = len(tif.pages)
+        for i, page in enumerate(tif.pages):
+            name = frame_name(file, i, n_pages)
+            parts = parse_frame_name(name)
+
+            # Multi-page stacks w/o a time in the name are treated as time-lapses, 1 page per time
+            time = parts['time']
+            if time is None and n_pages > 1:
+                time = i + 1
+
+            frames.append({'name': name,
+                           'file': file,
+                           'page': i,
+                           'n_pages': n_pages,
+                           'colony': parts['colony'],
+                           'time': time,
+                           'size': parts['size'],
+                           'shape': list(page.shape),
+                           'dtype': str(page.dtype),
+                           'compression': int(page.compression),
+                           'ifd_offset': int(page.offset),
+                           'data_offsets': [int(x) for x in page.dataoffsets],
+                           'data_bytecounts': [int(x) for x in page.databytecounts]})
+    return frames
+
+
+def read_page(tif, frame):
+    """Get the page of an open TiffFile for a frame entry. Pages of a stack are read straight from their indexed IFD
+    offset instead of following the chain of IFDs from the 1st page, so page 500 costs the same as page 1."""
+    if frame.get('n_pages', 1) > 1 and 'ifd_offset' in frame:
+        try:
+            tif.filehandle.seek(frame['ifd_offset'])
+            page = tiff.TiffPage(tif, index=frame['page'])
+            if list(page.shape) == list(frame['shape']):
+                return page
+        except (AttributeError, TypeError, ValueError):  # older tifffile reads every page on open anyway
+            pass
+    return tif.pages[frame['page']]
+
+
+def read_frame(input_dir, frame, out=None):
+    """Decode the image for a frame entry. Only needs the entry, so it works in other processes. If out is given (an
+    array of the frame's shape and dtype, e.g. in shared memory), decodes into it and returns it."""
+    with tiff.TiffFile(joinpath(input_dir, frame['file'])) as tif:
+        page = read_page(tif, frame)
+        if out is None:
+            return page.asarray()
+        try:
+            return page.asarray(out=out)
+        except TypeError:  # older tifffile w/o out
+            out[...] = page.asarray()
+            return out
+
+
+def frame_sort_key(frame):
+    """Order frames by time, then colony, then position on disk. Frames w/o a time go last."""
+    time = frame['time']
+    colony = frame['colony']
+    return (time is None, time if time is not None else 0,
+            colony is None, colony if colony is not None else 0,
+            frame['file'], frame['page'])
+
+
+class FrameIndex:
+    """Time-ordered index of the frames in input_dir, persisted to index_file (default: input_dir/frame_index.json)
+
+    Usage:
+        index = FrameIndex(input_dir)  # loads the saved index and indexes any new/modified files
+        for frame in index.frames(start=10, stop=20):
+            img = index.read(frame)
+    """
+
+    def __init__(self, input_dir, index_file=None, update=True):
+        self.input_dir = input_dir
+        if index_file is None:
+            index_file = joinpath(input_dir, INDEX_FILENAME)
+        self.index_file = index_file
+        self.files = {}  # file -> {'mtime', 'file_size', 'frames'}
+        self._sorted = None  # cache of all frames in time order
+
+        self.load()
+        if update and self.update():
+            self.save()
+
+    def load(self):
+        """Load the saved index, if there is one and it's the current version"""
+        if not os.path.exists(self.index_file):
+            return
+        with open(self.index_file) as f:
+            saved = json.load(f)
+        if saved.get('version') != INDEX_VERSION:
+            return
+        self.files = saved['files']
+        self._sorted = None
+
+    def save(self):
+        """Write index to index_file"""
+        with open(self.index_file, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'files': self.files}, f, indent=4, sort_keys=True)
+
+    def update(self):
+        """Bring the index up to date with the files on disk. Only new or modified files are opened.
+        Returns True if anything changed."""
+        changed = False
+        files = list_tiff_files(self.input_dir)
+
+        for file in files:
+            st = os.stat(joinpath(self.input_dir, file))
+            known = self.files.get(file)
+            if known is not None and known['mtime'] == st.st_mtime and known['file_size'] == st.st_size:
+                continue
+            print('Indexing %s' % (file,))
+            self.files[file] = {'mtime': st.st_mtime,
+                                'file_size': st.st_size,
+                                'frames': index_file_frames(self.input_dir, file)}
+            changed = True
+
+        # Drop files that no longer exist
+        for file in set(self.files) - set(files):
+            del self.files[file]
+            changed = True
+
+        if changed:
+            self._sorted = None
+        return changed
+
+    def __len__(self):
+        return sum(len(info['frames']) for info in self.files.values())
+
+    def __iter__(self):
+        return iter(self.frames())
+
+    def frames(self, start=None, stop=None, colony=None):
+        """Get frame entries in time order. Optionally restrict to start <= time <= stop and a single colony."""
+        if self._sorted is None:
+            self._sorted = sorted((frame for info in self.files.values() for frame in info['frames']),
+                                  key=frame_sort_key)
+        frames = self._sorted
+        if colony is not None:
+            frames = [frame for frame in frames if frame['colony'] == colony]
+        if start is not None:
+            frames = [frame for frame in frames if frame['time'] is not None and frame['time'] >= start]
+        if stop is not None:
+            frames = [frame for frame in frames if frame['time'] is not None and frame['time'] <= stop]
+        return frames
+
+    def times(self, colony=None):
+        """Get sorted list of distinct times"""
+        return sorted(set(frame['time'] for frame in self.frames(colony=colony) if frame['time'] is not None))
+
+    def colonies(self):
+        """Get sorted list of distinct colonies"""
+        return sorted(set(frame['colony'] for frame in self.frames() if frame['colony'] is not None))
+
+    def frames_by_colony(self, start=None, stop=None):
+        """Get dict of colony -> its frame entries in time order. Frames w/o a colony in their name are under None."""
+        groups = {}
+        for frame in self.frames(start=start, stop=stop):
+            groups.setdefault(frame['colony'], []).append(frame)
+        return groups
+
+    def frame_at(self, time, colony=None):
+        """Get the entry for the frame at time. Raises KeyError if there isn't exactly 1 such frame."""
+        frames = self.frames(start=time, stop=time, colony=colony)
+        if len(frames) == 0:
+            raise KeyError('No frame at time {time}'.format(time=time))
+        if len(frames) > 1:
+            raise KeyError('{n} frames at time {time}. Specify a colony.'.format(n=len(frames), time=time))
+        return frames[0]
+
+    def page(self, file, page):
+        """Get the entry for page (from 0) of file"""
+        info = self.files.get(file)
+        if info is None:
+            raise KeyError('{file} is not in the index'.format(file=file))
+        frames = [frame for frame in info['frames'] if frame['page'] == page]
+        if len(frames) == 0:
+            raise KeyError('{file} has no page {page}'.format(file=file, page=page))
+        return frames[0]
+
+    def read(self, frame):
+        """Decode the image for a frame entry. Only the frame's own file is opened."""
+        return read_frame(self.input_dir, frame)
@@ -0,0 +1,114 @@
+# Second tracking pass that bridges gaps in tracks
+#   If segmentation misses a cell in a frame (e.g. a thresholding glitch), frame-to-frame tracking ends its track there
+#   and starts a new one when the cell comes back. Collect the track segments from frame-to-frame tracking and link
+#   segment ends to segment starts up to max_gap frames later, as 1 global assignment problem over all segments
+#   (Jaqaman et al. 2008, "Robust single-particle tracking in live-cell time-lapse sequences"). Each end is either
+#   linked to 1 start or left alone, and vice versa, minimizing the total cost.
+#
+#   Candidate links are found with a spatial hash of segment starts per frame, so only nearby starts in the next few
+#   frames are considered. The assignment problem is solved with a sparse solver, so cost grows with the number of
+#   candidates instead of (number of segments)^2.
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+from spatial_hash import SpatialHash
+
+
+def get_segments(tracked_stats):
+    """Get track segments from tracked frames (cells with prev_label's pointing to the previous frame). Returns list
+    of (start, end), each (frame index, cell). If several cells point to the same previous cell, only the 1st
+    continues its segment."""
+    segments = []
+    prev_segments = {}  # label in previous frame -> index of the segment it's at the end of
+    for i, frame in enumerate(tracked_stats):
+        frame_segments = {}
+        continued = set()
+        for cell in frame['cells']:
+            prev_label = cell.get('prev_label', 0)
+            seg = prev_segments.get(prev_label)
+            if prev_label != 0 and seg is not None and seg not in continued:
+                continued.add(seg)
+                segments[seg] = (segments[seg][0], (i, cell))
+            else:
+                seg = len(segments)
+                segments.append(((i, cell), (i, cell)))
+            frame_segments[cell['label']] = seg
+        prev_segments = frame_segments
+    return segments
+
+
+def gap_candidates(segments, max_gap, max_displacement):
+    """Get candidate links (index of segment whose end is linked, index of segment whose start is linked, cost).
+    Cells can move max_displacement px per frame, including the missed ones. Cost is squared distance."""
+
+    # Index segment starts by frame and position
+    #   Only cells that started new tracks - not ones that split off another track, like daughters of a division
+    starts = {}  # frame index -> spatial hash of the starts in it
+    for j, ((frame, cell), end) in enumerate(segments):
+        if cell.get('prev_label', 0) != 0:
+            continue
+        if frame not in starts:
+            starts[frame] = SpatialHash(max_displacement)
+        starts[frame].insert(cell['centroid'], j)
+
+    candidates = []
+    for i, (start, (frame, cell)) in enumerate(segments):
+        for gap in range(1, max_gap + 1):
+            grid = starts.get(frame + gap + 1)
+            if grid is None:
+                continue
+            for dist, j in grid.neighbours(cell['centroid'], max_displacement * (gap + 1)):
+                candidates.append((i, j, dist**2))
+    return candidates
+
+
+def close_gaps(tracked_stats, max_gap=2, max_displacement=50, no_link_cost=None):
+    """Link track segments across up to max_gap missed frames. Modifies and returns tracked_stats.
+
+    The 1st cell of a linked segment gets the label of the last cell of the segment it's linked to as its prev_label,
+    plus a prev_time with the time of that cell's frame (cells w/o a prev_time point to the previous frame).
+
+    Args:
+        tracked_stats (list of frames): Output of a frame-to-frame tracker
+        max_gap (int): Max number of missed frames to bridge
+        max_displacement (float): Max distance in px a cell can move per frame
+        no_link_cost (float): Cost of leaving a segment end or start unlinked. Defaults to 1.05x the most expensive
+            candidate link, like Jaqaman et al.
+
+    Returns:
+        tracked_stats
+    """
+    segments = get_segments(tracked_stats)
+    candidates = gap_candidates(segments, max_gap, max_displacement)
+    if len(candidates) == 0:
+        return tracked_stats
+
+    ends, starts, costs = (np.array(x) for x in zip(*candidates))
+    if no_link_cost is None:
+        no_link_cost = 1.05 * costs.max()
+
+    # Augmented cost matrix so every end and start can also go unlinked:
+    #   [ links          end not linked   ]   rows: ends, then starts (as dummies)
+    #   [ start not      transpose of     ]   cols: starts, then ends (as dummies)
+    #   [ linked         links' pattern   ]
+    # The bottom right block lets the dummies pair up for every link that isn't used. All weights must be nonzero for
+    # the sparse solver, so offset everything by 1.
+    n = len(segments)
+    diag = np.arange(n)
+    rows = np.concatenate((ends, diag, n + diag, n + starts))
+    cols = np.concatenate((starts, n + diag, diag, n + ends))
+    weights = np.concatenate((costs, np.full(n, no_link_cost), np.full(n, no_link_cost), np.full(len(costs), costs.min())))
+    graph = coo_matrix((weights + 1, (rows, cols)), shape=(2*n, 2*n)).tocsr()
+
+    row_ind, col_ind = min_weight_full_bipartite_matching(graph)
+
+    for i, j in zip(row_ind, col_ind):
+        if i < n and j < n:
+            (end_frame, end_cell) = segments[i][1]
+            (start_frame, start_cell) = segments[j][0]
+            start_cell['prev_label'] = end_cell['label']
+            start_cell['prev_time'] = tracked_stats[end_frame]['time']
+
+    return tracked_stats
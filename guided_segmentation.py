@@ -0,0 +1,167 @@
+# On-line segmentation guided by cell tracking
+#   A candidate region is much more likely to be a cell if it's close to where a cell was in the previous frame. Use the
+#   previous frame's tracked cells (and how they moved since the frame before) to predict where cells will be, and only
+#   segment windows around those positions. Cells that newly appear (or drift in from outside every window) are picked
+#   up by a full frame sweep every few frames.
+#   For a steady colony this limits the work per frame to the area the cells actually cover.
+
+from math import sqrt, pi as PI
+
+import numpy as np
+from skimage.measure import label
+
+from diagnostics import Diagnostics
+from labels import compact_labels, paste_labels
+from bounding_boxes import box_slices, pad_box, merge_boxes, boxes_overlap
+from segment_test import preprocess, segment_regions, save_label_outputs, cell_stats, segment_multiscale
+
+
+def predict_positions(prev_cells, prev_prev_cells):
+    """Predict where each cell in prev_cells will be in the next frame, assuming constant velocity since the frame
+    before. Cells w/o a (known) previous cell are assumed stationary. Returns list of (y, x) in the same order."""
+    prev_prev_centroids = {cell['label']: cell['centroid'] for cell in prev_prev_cells}
+    predicted = []
+    for cell in prev_cells:
+        y, x = cell['centroid']
+        before = prev_prev_centroids.get(cell.get('prev_label'))
+        if before is None:
+            predicted.append((y, x))
+        else:
+            predicted.append((2*y - before[0], 2*x - before[1]))
+    return predicted
+
+
+def cell_windows(prev_cells, predicted, shape, window_scale=2.0, window_pad=16):
+    """Get merged boxes around where each cell was and where it's predicted to be. Each window extends window_scale
+    times the cell's (equivalent circle) radius plus window_pad px past both positions."""
+    boxes = []
+    for cell, (py, px) in zip(prev_cells, predicted):
+        y, x = cell['centroid']
+        radius = window_scale * sqrt(cell['area'] / PI) + window_pad
+        box = (int(min(y, py) - radius), int(min(x, px) - radius),
+               int(max(y, py) + radius) + 1, int(max(x, px) + radius) + 1)
+        box = pad_box(box, 0, shape)  # clip to image
+        if box[0] < box[2] and box[1] < box[3]:
+            boxes.append(box)
+    return merge_boxes(boxes)
+
+
+def touches_edge(crop, box, shape):
+    """Whether any cell in the segmented crop touches an edge of box that isn't also the edge of the image. A cell that
+    does may be cut off by the window."""
+    return ((box[0] > 0 and crop[0, :].any()) or
+            (box[1] > 0 and crop[:, 0].any()) or
+            (box[2] < shape[0] and crop[-1, :].any()) or
+            (box[3] < shape[1] and crop[:, -1].any()))
+
+
+def segment_windows(img, boxes, grow=32, max_grow=3, artifact_filter=None):
+    """Segment preprocessed greyscale img only inside boxes. Windows with cells cut off by their edge are grown by grow
+    px (up to max_grow times) and redone. artifact_filter is passed to segment_regions. Returns label image."""
+    crop_diag = Diagnostics(None, verbose=False)
+
+    done = {}  # box -> segmented crop
+    todo = merge_boxes(boxes)
+    for attempt in range(max_grow + 1):
+        grown = []
+        for box in todo:
+            crop = segment_regions(img[box_slices(box)], crop_diag, artifact_filter)
+            if attempt < max_grow and touches_edge(crop, box, img.shape):
+                grown.append(pad_box(box, grow, img.shape))
+            else:
+                done[box] = crop
+        if len(grown) == 0:
+            break
+
+        # Grown windows may overlap finished ones. Redo those too so no cell is segmented twice.
+        todo = merge_boxes(grown)
+        overlapping = [box for box in done if any(boxes_overlap(box, other) for other in todo)]
+        while len(overlapping) > 0:
+            for box in overlapping:
+                del done[box]
+            todo = merge_boxes(todo + overlapping)
+            overlapping = [box for box in done if any(boxes_overlap(box, other) for other in todo)]
+
+    label_img = np.zeros(img.shape, dtype=np.uint32)
+    n_labels = 0
+    for box, crop in done.items():
+        n_labels = paste_labels(label_img, label(crop, connectivity=2), box_slices(box), n_labels)
+
+    return compact_labels(label_img, n_labels)
+
+
+class GuidedSegmenter:
+    """Segments frames in time order using the tracked cells of the previous frame.
+
+    Usage:
+        segmenter = GuidedSegmenter(full_sweep_every=10)
+        prev_cells = []
+        for img, name in indexed_image_loader(input_dir):
+            cells = segmenter.segment(img, name, prev_cells)
+            link_cells_basic(cells, prev_cells)  # or any other tracker that sets prev_label
+            prev_cells = cells
+    """
+
+    def __init__(self, full_sweep_every=10, window_scale=2.0, window_pad=16, grow=32, max_grow=3,
+                 artifact_filter=None, output_dir='output', temp_dir='temp', save_figs=False, outputs=None):
+        """
+        Args:
+            full_sweep_every (int): Segment the whole frame every this many frames to find new cells. At least 1.
+            window_scale (float): Window size around each cell, in cell radii
+            window_pad (int): Extra px around each window, to allow for unpredicted motion
+            grow (int): px to grow windows by when a cell is cut off by its edge
+            max_grow (int): Max number of times to grow a window
+            artifact_filter (dict): Passed to segment_regions, like segment_test.ARTIFACT_FILTER. None for no pre-filter.
+        """
+        if full_sweep_every < 1:
+            raise ValueError('full_sweep_every must be at least 1, got %d' % (full_sweep_every,))
+        self.full_sweep_every = full_sweep_every
+        self.window_scale = window_scale
+        self.window_pad = window_pad
+        self.grow = grow
+        self.max_grow = max_grow
+        self.artifact_filter = artifact_filter
+        self.output_dir = output_dir
+        self.temp_dir = temp_dir
+        self.save_figs = save_figs
+        self.outputs = outputs
+
+        self.n_frames = 0
+        self.prev_prev_cells = []  # prev_cells from the last call - used to get velocities
+
+    def segment(self, img, name, prev_cells, return_labels=False):
+        """Segment img given the tracked cells of the previous frame (which need prev_label's to predict motion).
+        Returns cell stats like segment_test, or (cells, label image) if return_labels."""
+        full_sweep = self.n_frames % self.full_sweep_every == 0 or len(prev_cells) == 0
+        self.n_frames += 1
+
+        if full_sweep:
+            cells, label_img = segment_multiscale(img, name, output_dir=self.output_dir, temp_dir=self.temp_dir,
+                                                  save_figs=self.save_figs, outputs=self.outputs, return_labels=True,
+                                                  artifact_filter=self.artifact_filter)
+        else:
+            # Keeps the step counter to make sure all intermediate outputs are in order
+            diag = Diagnostics(name, self.temp_dir, save_figs=self.save_figs, outputs=self.outputs)
+
+            img = preprocess(img, diag)
+
+            diag.next_step('Predicting windows around %d tracked cells...' % (len(prev_cells),))
+            predicted = predict_positions(prev_cells, self.prev_prev_cells)
+            boxes = cell_windows(prev_cells, predicted, img.shape, self.window_scale, self.window_pad)
+
+            diag.next_step('Segmenting %d windows...' % (len(boxes),))
+            label_img = segment_windows(img, boxes, self.grow, self.max_grow, self.artifact_filter)
+
+            save_label_outputs(label_img, diag)
+            cells = cell_stats(label_img)
+
+        self.prev_prev_cells = prev_cells
+        if return_labels:
+            return cells, label_img
+        return cells
+
+    def skip(self, prev_cells):
+        """Account for a frame that was segmented earlier (e.g. by a run being resumed) instead of by segment, so full
+        sweeps and velocities stay in step. prev_cells is the same as for segment."""
+        self.n_frames += 1
+        self.prev_prev_cells = prev_cells
@@ -1,11 +1,19 @@
-import os
 from os.path import join as joinpath
-from os.path import isfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
 import tifffile as tiff
 
+from frame_index import FrameIndex, list_tiff_files, frame_name, read_frame, read_page
+
+PREFETCH_DEPTH = 2
+DECODE_WORKERS = 4
+
 
 def image_loader(input_dir):
     """Generator that returns TIFF images in input_dir. Treats pages of multi-page TIFFs as individual images.
+    Files are returned in whatever order the OS lists them - use indexed_image_loader for time order.
     TODO: also return image metadata.
 
     Usage:
@@ -13,18 +21,112 @@ def image_loader(input_dir):
             <do something with img and name>
     """
 
-    files = [f for f in os.listdir(input_dir) if isfile(joinpath(input_dir, f))]  # get the files, excluding directories
+    files = list_tiff_files(input_dir)  # get the TIFF files, excluding directories and the frame index
     for file in files:
         filename = joinpath(input_dir, file)
         with tiff.TiffFile(filename) as tif:
-            i = 0
-            for page in tif:
-                i += 1
+            n_pages = len(tif.pages)
+            for i, page in enumerate(tif.pages):
+                yield (page.asarray(), frame_name(file, i, n_pages))
+
+
+def prefetch(items, load, depth=PREFETCH_DEPTH, workers=1):
+    """Generator of load(item) for each of items, in order. Loads up to depth items ahead in workers background threads
+    while the caller works on the current one, so at most depth + 1 loaded items are held at once. Decoding TIFFs
+    mostly releases the GIL (file reads, zlib), so it overlaps with the caller's compute. depth 0 loads each item only
+    when it's needed, like a plain loop."""
+    if depth <= 0:
+        for item in items:
+            yield load(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(load, item))
+            if len(pending) > depth:
+                yield pending.popleft().result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def prefetch_loader(input_dir, depth=PREFETCH_DEPTH, workers=1):
+    """Same as image_loader, but decodes the next depth images on workers background threads while the caller works on
+    the current one
+
+    Usage:
+        for img, name in prefetch_loader(input_dir, depth=2):
+            <do something with img and name>
+    """
+    # Only headers are read here, to get the pages and their names
+    pages = []
+    for file in list_tiff_files(input_dir):
+        with tiff.TiffFile(joinpath(input_dir, file)) as tif:
+            n_pages = len(tif.pages)
+        pages.extend({'file': file, 'page': i, 'name': frame_name(file, i, n_pages)} for i in range(n_pages))
+
+    return prefetch(pages, lambda page: (read_frame(input_dir, page), page['name']), depth, workers)
+
+
+def indexed_image_loader(input_dir, start=None, stop=None, colony=None, index=None):
+    """Generator that returns TIFF images in input_dir in time order, using (and updating) the frame index.
+    Optionally only returns frames with start <= time <= stop and/or from a single colony.
+
+    Usage:
+        for img, name in indexed_image_loader(input_dir, start=10, stop=20):
+            <do something with img and name>
+    """
+    if index is None:
+        index = FrameIndex(input_dir)
+    for frame in index.frames(start=start, stop=stop, colony=colony):
+        yield (index.read(frame), frame['name'])
+
+
+def load_frame_at(input_dir, time, colony=None, index=None):
+    """Load the (img, name) of the single frame at time"""
+    if index is None:
+        index = FrameIndex(input_dir)
+    frame = index.frame_at(time, colony=colony)
+    return index.read(frame), frame['name']
+
+
+def load_page(input_dir, file, page, index=None):
+    """Load the (img, name) of page (from 0) of a multi-page TIFF. Only that page is decoded."""
+    if index is None:
+        index = FrameIndex(input_dir)
+    frame = index.page(file, page)
+    return index.read(frame), frame['name']
+
+
+def stack_loader(input_dir, file, pages=None, workers=DECODE_WORKERS, index=None):
+    """Generator that returns the pages of a multi-page TIFF, or only the given page numbers (from 0), in order. Pages
+    are independent, so they're decoded in workers threads, each w/ its own TiffFile handle so reads don't fight over
+    the file position, and read straight from their indexed offsets.
+
+    Usage:
+        for img, name in stack_loader(input_dir, 'stack.tif', pages=range(500, 600)):
+            <do something with img and name>
+    """
+    if index is None:
+        index = FrameIndex(input_dir)
+    if pages is None:
+        frames = sorted(index.files[file]['frames'], key=lambda frame: frame['page'])
+    else:
+        frames = [index.page(file, page) for page in pages]
+
+    handles = threading.local()
+    opened = []
 
-                img = page.asarray()
-                if len(tif.pages) == 1: # Handle usual case of single-page TIFF w/o page number in name
-                    name = file.split('.')[0]
-                else:
-                    name = file.split('.')[0] + '_page_%d'%(i,)
+    def load(frame):
+        tif = getattr(handles, 'tif', None)
+        if tif is None:
+            tif = handles.tif = tiff.TiffFile(joinpath(input_dir, file))
+            opened.append(tif)
+        return read_page(tif, frame).asarray(), frame['name']
 
-                yield (img, name)
\ No newline at end of file
+    try:
+        for img, name in prefetch(frames, load, depth=workers, workers=workers):
+            yield img, name
+    finally:
+        for tif in opened:
+            tif.close()
@@ -0,0 +1,73 @@
+# Append-only journal of per-frame results, so a crashed run can be resumed
+#   Each finished frame is written as 1 line of JSON and flushed to disk (fsync) right away, so everything but the frame
+#   being worked on survives a crash or OOM kill. A crash in the middle of writing a line leaves a partial last line,
+#   which is dropped (and cut off the file) when the journal is reopened.
+
+import os
+import json
+
+from ndjson import dumps_frame
+
+
+def read_journal(filename):
+    """Get (entries, end) from a journal file: the list of complete entries and the byte offset just past the last one.
+    Stops at the 1st line that isn't complete JSON."""
+    entries = []
+    end = 0
+    if not os.path.exists(filename):
+        return entries, end
+    with open(filename, 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                entries.append(json.loads(line.decode('utf-8')))
+            except ValueError:
+                break
+            end += len(line)
+    return entries, end
+
+
+class Journal:
+    """Journal of finished frames in filename. Entries are dicts keyed by their 'name', written as NDJSON.
+
+    Usage:
+        journal = Journal('segmented_results.journal', resume=True)
+        for frame in frames:
+            if frame['name'] in journal.done:
+                continue
+            ...
+            journal.append({'name': frame['name'], 'time': frame['time'], 'cells': cells})
+        journal.close()
+    """
+
+    def __init__(self, filename, resume=False):
+        """Open journal. If resume, keeps the entries already in the file, otherwise starts a new one."""
+        self.filename = filename
+        self.done = {}
+
+        if resume:
+            entries, end = read_journal(filename)
+            for entry in entries:
+                self.done[entry['name']] = entry
+            mode = 'r+b' if os.path.exists(filename) else 'wb'
+            self.file = open(filename, mode)
+            self.file.truncate(end)  # drop a partly written last entry
+            self.file.seek(end)
+        else:
+            self.file = open(filename, 'wb')
+
+    def append(self, entry):
+        """Write entry and make sure it's on disk before returning"""
+        self.file.write(dumps_frame(entry).encode('utf-8'))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.done[entry['name']] = entry
+
+    def close(self):
+        self.file.close()
+
+    def remove(self):
+        """Close and delete the journal, e.g. once its results are in the final output"""
+        self.close()
+        os.remove(self.filename)
@@ -0,0 +1,62 @@
+# Helpers for label images
+#   skimage returns int64 labels by default, which is 8 bytes/px for images that rarely have more than a few thousand
+#   labels. Store them in the smallest unsigned type that fits instead.
+
+import numpy as np
+from skimage.measure import label
+
+LABEL_DTYPES = (np.uint8, np.uint16, np.uint32, np.uint64)
+
+
+def smallest_label_dtype(max_label):
+    """Get the smallest unsigned int dtype that can hold labels 0..max_label"""
+    for dtype in LABEL_DTYPES:
+        if max_label <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    raise ValueError('Label {max_label} too big for any label dtype'.format(max_label=max_label))
+
+
+def compact_labels(label_img, max_label=None):
+    """Convert label image to the smallest dtype that fits its labels. max_label is calculated if not given."""
+    if max_label is None:
+        max_label = int(label_img.max()) if label_img.size > 0 else 0
+    return label_img.astype(smallest_label_dtype(max_label), copy=False)
+
+
+def paste_labels(label_img, crop_labels, slices, offset):
+    """Write the labeled pixels of crop_labels into label_img[slices] in place, with offset added to their labels so
+    they don't collide with labels already there. Background pixels in the crop don't overwrite anything.
+    Returns the new max label."""
+    mask = crop_labels > 0
+    if not mask.any():
+        return offset
+    target = label_img[slices]
+    target[mask] = crop_labels[mask] + offset
+    return offset + int(crop_labels.max())
+
+
+def fill_label_holes(label_img):
+    """Get copy of label_img with the holes in each region filled with its label. Holes are 4-connected background
+    regions that don't touch the edge of the image, which is the same as binary_fill_holes for 8-connected regions.
+    Cheaper than binary_fill_holes since it's 1 labeling of the background instead of an iterative propagation."""
+    background = label(label_img == 0, connectivity=1, background=0)
+
+    # Background regions touching the edge aren't holes
+    edges = np.concatenate((background[0, :], background[-1, :], background[:, 0], background[:, -1]))
+    is_hole = np.ones(int(background.max()) + 1, dtype=bool)
+    is_hole[edges] = False
+    is_hole[0] = False
+
+    filled = label_img.copy()
+    flat_background = background.ravel()
+    hole_px = np.flatnonzero(is_hole[flat_background])
+    if len(hole_px) == 0:
+        return filled
+
+    # The px above a hole's 1st px (in raster order) can't be in the hole, so it's in the region around the hole
+    holes, first = np.unique(flat_background[hole_px], return_index=True)
+    region_of_hole = np.zeros(len(is_hole), dtype=label_img.dtype)
+    region_of_hole[holes] = label_img.ravel()[hole_px[first] - label_img.shape[1]]
+
+    filled.ravel()[hole_px] = region_of_hole[flat_background[hole_px]]
+    return filled
@@ -0,0 +1,142 @@
+# Cell division detection and lineage
+#   Frame-to-frame tracking only links 1 cell to each previous cell, so when a cell divides, 1 daughter continues its
+#   track and the other starts a new one. Find those splits: a previous cell (parent) with 2 nearby cells (daughters)
+#   whose areas add up to about the parent's area and whose combined centroid is close to the parent's. Both daughters
+#   get the parent's label as their prev_label.
+#
+#   Daughters are only looked for within max_displacement of the parent using a spatial hash, so there are only a few
+#   candidate pairs per parent and detection is linear in the number of cells per frame.
+#
+#   The lineage is a tree of tracks. A track ends when its cell divides and each daughter starts a new track that's a
+#   child of it.
+
+from itertools import combinations
+from math import sqrt
+
+from spatial_hash import SpatialHash
+
+
+def division_cost(parent, daughter1, daughter2, max_displacement, max_area_error):
+    """Cost of parent dividing into daughter1 and daughter2, or None if it can't have. Sum of the distance from the
+    parent to the area-weighted centroid of the daughters (relative to max_displacement) and the relative difference
+    between the parent's area and the daughters' total area (relative to max_area_error)."""
+    area = daughter1['area'] + daughter2['area']
+    area_error = abs(area - parent['area']) / parent['area']
+    if area_error > max_area_error:
+        return None
+
+    y = (daughter1['centroid'][0] * daughter1['area'] + daughter2['centroid'][0] * daughter2['area']) / area
+    x = (daughter1['centroid'][1] * daughter1['area'] + daughter2['centroid'][1] * daughter2['area']) / area
+    dist = sqrt((y - parent['centroid'][0])**2 + (x - parent['centroid'][1])**2)
+    if dist > max_displacement:
+        return None
+
+    return dist / max_displacement + area_error / max_area_error
+
+
+def detect_frame_divisions(cells, prev_cells, max_displacement, max_area_error=0.3):
+    """Find cells in prev_cells that divided into 2 cells in cells. Only cells continuing a previous cell's track or
+    starting a new track (prev_label of 0) can be daughters. Sets both daughters' prev_label to the parent's label and
+    marks them with 'division': True. Returns number of divisions found."""
+    # Cells that could be daughters, indexed by position
+    grid = SpatialHash(max_displacement)
+    for i, cell in enumerate(cells):
+        if 'prev_time' not in cell:  # cells linked across a gap aren't daughters
+            grid.insert(cell['centroid'], i)
+
+    candidates = []  # (cost, index of parent, index of daughter 1, index of daughter 2)
+    for j, parent in enumerate(prev_cells):
+        # A daughter has to be new or already the parent's continuation - not some other cell's
+        nearby = [i for dist, i in grid.neighbours(parent['centroid'], max_displacement)
+                  if cells[i].get('prev_label', 0) in (0, parent['label'])]
+        for i1, i2 in combinations(sorted(nearby), 2):
+            # At least 1 daughter has to be new, otherwise this is 2 tracks that were already there
+            if cells[i1].get('prev_label', 0) != 0 and cells[i2].get('prev_label', 0) != 0:
+                continue
+            cost = division_cost(parent, cells[i1], cells[i2], max_displacement, max_area_error)
+            if cost is not None:
+                candidates.append((cost, j, i1, i2))
+    candidates.sort()
+
+    # Cheapest divisions first. Each parent divides at most once and each cell has 1 parent.
+    divided = set()
+    daughters = set()
+    for cost, j, i1, i2 in candidates:
+        if j in divided or i1 in daughters or i2 in daughters:
+            continue
+        parent_label = prev_cells[j]['label']
+        divided.add(j)
+        daughters.update((i1, i2))
+        for i in (i1, i2):
+            cells[i]['prev_label'] = parent_label
+            cells[i]['division'] = True
+
+    return len(divided)
+
+
+def detect_divisions(tracked_stats, max_displacement=50, max_area_error=0.3):
+    """Find cell divisions in tracked frames (e.g. from track_cells_gated). Modifies and returns tracked_stats.
+
+    Args:
+        max_displacement (float): Max distance in px between a parent and the combined centroid of its daughters
+        max_area_error (float): Max relative difference between the area of the parent and the daughters' total area
+    """
+    prev_cells = []
+    for frame in tracked_stats:
+        detect_frame_divisions(frame['cells'], prev_cells, max_displacement, max_area_error)
+        prev_cells = frame['cells']
+    return tracked_stats
+
+
+def build_lineage(tracked_stats):
+    """Assign track ids and build the lineage tree. Sets a 'track' field on every cell. Cells that are the only cell
+    pointing to their previous cell continue its track, and cells that share a previous cell (i.e. daughters) each
+    start a new track whose parent is the previous cell's track. Follows prev_time links across gaps.
+
+    Returns:
+        List of root tracks, each a dict of track (id), parent (id of parent track or None), start_time, end_time,
+        start_label, end_label, and children (list of tracks of the same form)
+    """
+    tracks = []  # id -> track dict
+    cell_tracks = {}  # (time, label) -> track id, for every cell so far
+    prev_time = None
+
+    for frame in tracked_stats:
+        time = frame['time']
+
+        def parent_key(cell):
+            return (cell.get('prev_time', prev_time), cell.get('prev_label', 0))
+
+        # Count children of each previous cell to tell continuations from divisions
+        n_children = {}
+        for cell in frame['cells']:
+            key = parent_key(cell)
+            if key[1] != 0 and key in cell_tracks:
+                n_children[key] = n_children.get(key, 0) + 1
+
+        for cell in frame['cells']:
+            key = parent_key(cell)
+            parent_track = cell_tracks.get(key) if key[1] != 0 else None
+
+            if parent_track is not None and n_children[key] == 1:
+                track_id = parent_track
+                tracks[track_id]['end_time'] = time
+                tracks[track_id]['end_label'] = cell['label']
+            else:
+                track_id = len(tracks)
+                tracks.append({'track': track_id,
+                               'parent': parent_track,
+                               'start_time': time,
+                               'end_time': time,
+                               'start_label': cell['label'],
+                               'end_label': cell['label'],
+                               'children': []})
+                if parent_track is not None:
+                    tracks[parent_track]['children'].append(tracks[track_id])
+
+            cell['track'] = track_id
+            cell_tracks[(time, cell['label'])] = track_id
+
+        prev_time = time
+
+    return [track for track in tracks if track['parent'] is None]
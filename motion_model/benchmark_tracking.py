@@ -0,0 +1,171 @@
+# Tracking accuracy and throughput on ground truth movies at rising cell counts
+#   For each cell count, renders a movie with render_movie, runs run_pipeline.py over it, matches the segmented cells to
+#   the true cells, and scores the links between frames. Also times the tracker alone on the true centroids plus a bit of
+#   localization noise, which is cheap enough to go well past the counts that can be rendered and segmented, so tracker
+#   scaling can be seen on its own.
+#
+#   Scores:
+#   - detection recall/precision: true cells matched by a segmented cell (closest first, within the smallest cell radius),
+#     and segmented cells matched to a true cell
+#   - link recall: true links (the same cell matched in consecutive frames) the tracker made
+#   - link precision: links the tracker made that join the same true cell
+#
+#   Run from the main directory: python -m motion_model.benchmark_tracking --counts 100,1000,10000,100000
+
+import argparse
+import os
+import sys
+import shutil
+import subprocess
+import json
+from os.path import join as joinpath, dirname, abspath
+from time import perf_counter
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from motion_model.render_movie import render_movie, walk_cells, frame_shape, CELL_RADIUS
+from track_cells import track_cells_basic, track_cells_gated
+from ndjson import read_results
+
+RUN_PIPELINE = joinpath(dirname(dirname(abspath(__file__))), 'run_pipeline.py')
+MAX_RENDER_PX = 70e6  # bigger movies are only used for timing the tracker alone
+LOCALIZATION_NOISE = 1.0  # px std added to the true centroids for the tracker alone
+
+
+def match_cells(centroids, true_centroids, max_dist=CELL_RADIUS[0]):
+    """Get the index of the true cell each of centroids matches, or -1. Matches are 1 to 1, closest first, and at most
+    max_dist apart."""
+    matches = np.full(len(centroids), -1, dtype=np.int64)
+    if len(centroids) == 0 or len(true_centroids) == 0:
+        return matches
+    dists, nearest = cKDTree(true_centroids).query(centroids, distance_upper_bound=max_dist)
+    order = np.argsort(dists, kind='stable')
+    order = order[np.isfinite(dists[order])]
+    _, first = np.unique(nearest[order], return_index=True)
+    matches[order[first]] = nearest[order[first]]
+    return matches
+
+
+def score_tracking(frames, true_ids, n_true_cells):
+    """Get dict of detection and link scores of tracked frames, given the true cell id of each of their cells (list of
+    arrays like match_cells gives) and the number of true cells per frame"""
+    n_cells = sum(len(frame['cells']) for frame in frames)
+    n_matched = sum(int(np.sum(ids >= 0)) for ids in true_ids)
+    n_links = n_correct = n_true_links = 0
+    prev_ids = {}  # label -> true id in previous frame
+    for frame, ids in zip(frames, true_ids):
+        labels = [cell['label'] for cell in frame['cells']]
+        if len(prev_ids) > 0:
+            n_true_links += len(set(ids[ids >= 0].tolist()) & set(prev_ids.values()))
+            for cell, true_id in zip(frame['cells'], ids.tolist()):
+                prev_label = cell.get('prev_label', 0)
+                if prev_label == 0 or 'prev_time' in cell:
+                    continue
+                n_links += 1
+                n_correct += true_id >= 0 and prev_ids.get(prev_label, -1) == true_id
+        prev_ids = {label: true_id for label, true_id in zip(labels, ids.tolist()) if true_id >= 0}
+
+    def ratio(a, b):
+        return a / b if b > 0 else float('nan')
+
+    return {'detection_recall': ratio(n_matched, n_true_cells * len(frames)),
+            'detection_precision': ratio(n_matched, n_cells),
+            'link_recall': ratio(n_correct, n_true_links),
+            'link_precision': ratio(n_correct, n_links)}
+
+
+def benchmark_pipeline(movie_dir, output_dir, true_centroids, pipeline_args):
+    """Run run_pipeline.py over a rendered movie and get dict of scores and throughput"""
+    temp_dir = joinpath(output_dir, 'temp')
+    command = [sys.executable, RUN_PIPELINE, '-i', movie_dir, '-o', output_dir, '-t', temp_dir] + pipeline_args
+    start = perf_counter()
+    with open(joinpath(output_dir, 'pipeline.log'), 'w') as log:
+        subprocess.check_call(command, stdout=log, stderr=subprocess.STDOUT)
+    elapsed = perf_counter() - start
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+    frames = list(read_results(joinpath(output_dir, 'tracked_results.txt')))
+    true_ids = [match_cells([cell['centroid'] for cell in frame['cells']], true_centroids[t])
+                for t, frame in enumerate(frames)]
+    result = score_tracking(frames, true_ids, true_centroids.shape[1])
+    n_cells = sum(len(frame['cells']) for frame in frames)
+    result.update({'seconds': elapsed, 'frames_per_second': len(frames) / elapsed, 'cells_per_second': n_cells / elapsed})
+    return result
+
+
+def benchmark_tracker(true_centroids, tracker='gated', max_displacement=50.0, noise=LOCALIZATION_NOISE, seed=0):
+    """Time the tracker alone on the true centroids plus noise, in shuffled order, and get dict of scores and
+    throughput"""
+    rng = np.random.RandomState(seed)
+    frames = []
+    true_ids = []
+    for t, centroids in enumerate(true_centroids):
+        order = rng.permutation(len(centroids))
+        noisy = centroids[order] + rng.normal(0, noise, centroids.shape)
+        frames.append({'time': t + 1, 'cells': [{'label': i + 1, 'centroid': tuple(centroid), 'area': 1.0}
+                                                for i, centroid in enumerate(noisy.tolist())]})
+        true_ids.append(order)
+
+    start = perf_counter()
+    if tracker == 'gated':
+        track_cells_gated(frames, max_displacement)
+    else:
+        track_cells_basic(frames)
+    elapsed = perf_counter() - start
+
+    result = score_tracking(frames, true_ids, true_centroids.shape[1])
+    result.update({'seconds': elapsed, 'cells_per_second': true_centroids.shape[0] * true_centroids.shape[1] / elapsed})
+    return result
+
+
+def print_result(n_cells, stage, result):
+    print('%8d cells %-8s detection recall %.3f precision %.3f, link recall %.3f precision %.3f, %.1f s (%.0f cells/s)'
+          % (n_cells, stage, result['detection_recall'], result['detection_precision'], result['link_recall'],
+             result['link_precision'], result['seconds'], result['cells_per_second']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark segmentation and tracking on rendered ground truth movies')
+    parser.add_argument('-o', '--output', help='Output directory', required=False, default='benchmark')
+    parser.add_argument('--counts', help='Comma separated cell counts', required=False, default='100,1000,10000,100000')
+    parser.add_argument('--frames', help='Number of frames per movie', required=False, type=int, default=10)
+    parser.add_argument('--speed', help='Max cell speed in px per frame', required=False, type=float, default=10.0)
+    parser.add_argument('-m', '--method', help='Segmentation method for run_pipeline.py', required=False,
+                        default='watershed')
+    parser.add_argument('--tracker', help='Cell tracking method', required=False, choices=['basic', 'gated'],
+                        default='gated')
+    parser.add_argument('--max-displacement', help='Max distance in px a cell can move between frames for the gated tracker',
+                        required=False, type=float, default=50.0)
+    parser.add_argument('--max-render-px', help='Only render and segment movies with frames up to this many px. Bigger ones only time the tracker alone.',
+                        required=False, type=float, default=MAX_RENDER_PX)
+    parser.add_argument('--keep-movies', help='Include this flag to keep the rendered frames', action='store_true')
+    args = parser.parse_args()
+
+    pipeline_args = ['-m', args.method, '--tracker', args.tracker, '--max-displacement', str(args.max_displacement)]
+    results = []
+    for n_cells in [int(count) for count in args.counts.split(',')]:
+        count_dir = joinpath(args.output, 'cells_%d' % (n_cells,))
+        if not os.path.exists(count_dir):
+            os.makedirs(count_dir)
+        shape = frame_shape(n_cells)
+
+        if shape[0] * shape[1] <= args.max_render_px:
+            movie_dir = joinpath(count_dir, 'movie')
+            true_centroids = render_movie(movie_dir, n_cells, args.frames, speed=args.speed)
+            result = benchmark_pipeline(movie_dir, count_dir, true_centroids, pipeline_args)
+            print_result(n_cells, 'pipeline', result)
+            results.append(dict(result, cells=n_cells, stage='pipeline'))
+            if not args.keep_movies:
+                shutil.rmtree(movie_dir)
+        else:
+            true_centroids, _ = walk_cells(n_cells, args.frames, shape, args.speed)
+
+        result = benchmark_tracker(true_centroids, args.tracker, args.max_displacement)
+        print_result(n_cells, 'tracker', result)
+        results.append(dict(result, cells=n_cells, stage='tracker'))
+
+    with open(joinpath(args.output, 'benchmark_results.txt'), 'w') as f:
+        json.dump(results, f, indent=4, sort_keys=True)
+
+    print('done.')
@@ -1,6 +1,6 @@
 # Generate models and test them
 #   Start with the model, generate data and
-#   TODO: Generate images and process them to validate approach
+#   render_movie.py generates images from the model and benchmark_tracking.py processes them to validate approach
 
 from random import uniform as randuniform
 from numpy.random import normal as randnorm
@@ -0,0 +1,210 @@
+# Render ground truth time-lapse movies from the motion model
+#   Cells walk according to CellWalker's modes (stopped, constant velocity, stopped and turning) and are drawn as blobs
+#   into frames that look like the stitched microscope images: a noisy background, cells of varied shapes with a brighter
+#   core, and a grid of camera panels that each have their own gain and offset with dark seams between them. Frames are
+#   written as TIFFs named like the real ones so run_pipeline.py can process them, along with the true cell centroids.
+#
+#   Walkers are stepped for all cells at once with the same rules as CellWalker.advance, instead of 1 Python object per
+#   cell, so 100k cells are quick. Blobs are drawn from a bank of templates: every cell using a template is stamped with 1
+#   fancy index assignment.
+#
+#   Run from the main directory: python -m motion_model.render_movie -o movie -n 1000
+
+import argparse
+import os
+from os.path import join as joinpath
+from math import ceil, sqrt
+
+import numpy as np
+import tifffile as tiff
+
+from motion_model.generate_model import CellWalker
+
+PANELS = 5  # panels per side, like process_images.py
+CELL_RADIUS = (25, 32)  # px, so cells are well over segment_test's OBJECT_SIZE_THRESHOLD
+CELL_SPACING = 120  # px per cell along each side of the frame, i.e. the cell density
+CELL_INTENSITY = (2500, 3500)
+CORE_GAIN = 1.2  # brightness of the core relative to the rest of the cell
+BACKGROUND = 150
+NOISE = 40  # std of the background noise
+PANEL_GAIN_STD = 0.1
+PANEL_OFFSET_STD = 15
+SEAM_GAIN = 0.6
+N_TEMPLATES = 64
+STAMP_CHUNK = 4096  # cells stamped at once, to bound the index buffers
+
+
+def frame_shape(n_cells, spacing=CELL_SPACING, panels=PANELS):
+    """(height, width) of a square frame holding n_cells at the given spacing, rounded up to whole panels"""
+    side = int(ceil(sqrt(n_cells) * spacing / panels)) * panels
+    side = max(side, 4 * CELL_RADIUS[1] * panels)
+    return side, side
+
+
+def walk_cells(n_cells, n_frames, shape, speed=10.0, margin=2 * CELL_RADIUS[1], seed=0):
+    """Get (positions, modes) of n_cells CellWalkers over n_frames frames (1 step per frame). Speeds are scaled from
+    CellWalker's 0..1 to 0..speed px per frame. Cells bounce off walls margin px from the frame edges.
+
+    Returns:
+        positions: (frames, cells, 2) array of (y, x)
+        modes: (frames, cells) array of CellWalker modes
+    """
+    rng = np.random.RandomState(seed)
+    walker = CellWalker((0, 0, 0, 0))
+    cum_transitions = np.cumsum(walker.Tij, axis=1)
+    lo = np.array([margin, margin], dtype=np.float64)
+    hi = np.array(shape, dtype=np.float64) - margin
+
+    # Random starting position and velocity, like generate_model's __main__. Cells start stationary (mode 0).
+    #   Positions are jittered points of a grid, so cells don't start on top of each other.
+    side = int(ceil(sqrt(n_cells)))
+    step = (hi - lo) / side
+    jitter = np.maximum(step / 2 - 1.2 * CELL_RADIUS[1], 0)
+    grid = rng.choice(side * side, n_cells, replace=False)
+    pos = lo + (np.column_stack([grid // side, grid % side]) + 0.5) * step + rng.uniform(-jitter, jitter, (n_cells, 2))
+    vel = random_velocities(rng, n_cells, speed)
+    mode = np.zeros(n_cells, dtype=np.int64)
+
+    positions = np.empty((n_frames, n_cells, 2))
+    modes = np.empty((n_frames, n_cells), dtype=np.int64)
+    positions[0] = pos
+    modes[0] = mode
+    for t in range(1, n_frames):
+        # Same as CellWalker.next_mode and next_state
+        mode = np.argmax(rng.uniform(size=(n_cells, 1)) < cum_transitions[mode], axis=1)
+        vel[mode == 0] = 0
+        moving = mode == 1
+        pos[moving] += vel[moving] * walker.dt
+        turning = mode == 2
+        vel[turning] = random_velocities(rng, np.sum(turning), speed)
+
+        # Bounce
+        for limit, outside in ((lo, pos < lo), (hi, pos > hi)):
+            pos = np.where(outside, 2 * limit - pos, pos)
+            vel = np.where(outside, -vel, vel)
+
+        positions[t] = pos
+        modes[t] = mode
+    return positions, modes
+
+
+def random_velocities(rng, n, speed):
+    """(y, x) velocities with uniform random speeds (0..speed) and bearings"""
+    speeds = rng.uniform(0, speed, n)
+    bearings = rng.uniform(0, 2 * np.pi, n)
+    return np.column_stack([speeds * np.sin(bearings), speeds * np.cos(bearings)])
+
+
+def blob_templates(n_templates=N_TEMPLATES, seed=0):
+    """Get list of cell templates (offsets, values, centroid): flat (dy, dx) offsets of the blob's px from the top left
+    of its box, their intensities, and the (y, x) centroid of the blob in its box. Blobs are ellipses with wobbly
+    outlines (a few random harmonics), a brighter off-center core, and a soft edge."""
+    rng = np.random.RandomState(seed)
+    templates = []
+    size = 2 * int(ceil(CELL_RADIUS[1] * 1.3)) + 3
+    yy, xx = np.mgrid[:size, :size] - (size - 1) / 2.0
+    angle = np.arctan2(yy, xx)
+    for i in range(n_templates):
+        radius = rng.uniform(*CELL_RADIUS)
+        aspect = rng.uniform(0.75, 1.0)
+        rotation = rng.uniform(0, np.pi)
+        outline = 1 + sum(rng.uniform(0, 0.06) * np.cos(k * (angle - rng.uniform(0, 2 * np.pi))) for k in (2, 3, 4))
+        u = (xx * np.cos(rotation) + yy * np.sin(rotation)) / radius
+        v = (-xx * np.sin(rotation) + yy * np.cos(rotation)) / (radius * aspect)
+        r = np.hypot(u, v) / outline  # 1 at the outline
+
+        core_y, core_x = rng.uniform(-0.25, 0.25, 2) * radius
+        core = np.hypot(yy - core_y, xx - core_x) < 0.4 * radius
+        intensity = rng.uniform(*CELL_INTENSITY)
+        edge = np.clip((1 - r) * radius / 2, 0, 1)  # ~2 px ramp inside the outline
+        values = intensity * edge * np.where(core, CORE_GAIN, 1)
+
+        inside = values > 0
+        dy, dx = np.nonzero(inside)
+        templates.append((np.column_stack([dy, dx]), values[inside], (dy.mean(), dx.mean())))
+    return templates
+
+
+def panel_variation(panels=PANELS, seed=0):
+    """Random (gain, offset) of each of the panels x panels camera panels"""
+    rng = np.random.RandomState(seed)
+    gain = np.clip(rng.normal(1, PANEL_GAIN_STD, (panels, panels)), 0.5, 1.5)
+    offset = rng.normal(0, PANEL_OFFSET_STD, (panels, panels))
+    return gain, offset
+
+
+def render_frame(shape, positions, template_ids, templates, gain, offset, rng):
+    """Get uint16 image of cells with their template centroids at positions. Returns (image, rendered centroids),
+    which differ from positions by the rounding to whole px. Later cells cover earlier ones where they overlap."""
+    height, width = shape
+    img = rng.normal(BACKGROUND, NOISE, shape).astype(np.float32)
+    flat = img.reshape(-1)
+    centroids = np.empty(positions.shape)
+    for k, (offsets, values, centroid) in enumerate(templates):
+        cells = np.flatnonzero(template_ids == k)
+        top_left = np.rint(positions[cells] - centroid).astype(np.int64)
+        centroids[cells] = top_left + centroid
+        px = offsets[:, 0] * width + offsets[:, 1]
+        for i in range(0, len(cells), STAMP_CHUNK):
+            corners = top_left[i:i + STAMP_CHUNK, 0] * width + top_left[i:i + STAMP_CHUNK, 1]
+            flat[(corners[:, np.newaxis] + px).ravel()] = np.tile(values, len(corners))
+
+    # Panels: own gain and offset, and dark seams where they meet
+    panels = gain.shape[0]
+    panel_rows = np.arange(height) * panels // height
+    panel_cols = np.arange(width) * panels // width
+    for i in range(panels):
+        rows = slice(np.searchsorted(panel_rows, i), np.searchsorted(panel_rows, i + 1))
+        for j in range(panels):
+            cols = slice(np.searchsorted(panel_cols, j), np.searchsorted(panel_cols, j + 1))
+            img[rows, cols] *= gain[i, j]
+            img[rows, cols] += offset[i, j]
+    seam_rows = np.flatnonzero(np.diff(panel_rows)) + 1
+    seam_cols = np.flatnonzero(np.diff(panel_cols)) + 1
+    img[seam_rows] *= SEAM_GAIN
+    img[:, seam_cols] *= SEAM_GAIN
+
+    return np.clip(np.rint(img), 0, np.iinfo(np.uint16).max).astype(np.uint16), centroids
+
+
+def render_movie(output_dir, n_cells, n_frames, speed=10.0, spacing=CELL_SPACING, colony=1, seed=0):
+    """Render a movie of n_cells walking cells to TIFFs in output_dir, named like Colony_1_Time0001_3x3a.tif, and save
+    the true centroids of every cell in every frame to ground_truth.npz there.
+
+    Returns:
+        (frames, cells, 2) array of the true (y, x) centroids
+    """
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    shape = frame_shape(n_cells, spacing)
+    print('Rendering %d frames of %d cells at %dx%d px' % (n_frames, n_cells, shape[1], shape[0]))
+    positions, modes = walk_cells(n_cells, n_frames, shape, speed, seed=seed)
+    templates = blob_templates(seed=seed)
+    template_ids = np.random.RandomState(seed).randint(0, len(templates), n_cells)
+    gain, offset = panel_variation(seed=seed)
+
+    rng = np.random.RandomState(seed + 1)
+    centroids = np.empty(positions.shape)
+    for t in range(n_frames):
+        img, centroids[t] = render_frame(shape, positions[t], template_ids, templates, gain, offset, rng)
+        tiff.imsave(joinpath(output_dir, 'Colony_%d_Time%04d_3x3a.tif' % (colony, t + 1)), img)
+
+    np.savez(joinpath(output_dir, 'ground_truth.npz'), centroids=centroids, modes=modes, template_ids=template_ids,
+             times=np.arange(1, n_frames + 1))
+    return centroids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Render a ground truth movie of walking cells')
+    parser.add_argument('-o', '--output', help='Output directory for the frames', required=False, default='movie')
+    parser.add_argument('-n', '--cells', help='Number of cells', required=False, type=int, default=100)
+    parser.add_argument('--frames', help='Number of frames', required=False, type=int, default=10)
+    parser.add_argument('--speed', help='Max cell speed in px per frame', required=False, type=float, default=10.0)
+    parser.add_argument('--spacing', help='Frame size in px per cell along each side', required=False, type=float,
+                        default=CELL_SPACING)
+    parser.add_argument('--seed', help='Random seed', required=False, type=int, default=0)
+    args = parser.parse_args()
+
+    render_movie(args.output, args.cells, args.frames, speed=args.speed, spacing=args.spacing, seed=args.seed)
+    print('done.')
@@ -0,0 +1,153 @@
+# Streaming results as newline-delimited JSON (1 frame per line)
+#   json.dump of all the results at once builds and pretty-prints the whole document in 1 go, and calls the encoder's
+#   default method once for every numpy number in it. Instead, write each frame as its own line as soon as it's done,
+#   after converting its numpy data to builtin types in bulk - 1 tolist per column of the frame's cells - so the C encoder
+#   never has to call back into Python. Columns mixing kinds of numbers (like ints and floats) are converted a value at a
+#   time, so each keeps its type. Reading is a generator over lines, so results never have to be in memory at once.
+
+import json
+import itertools
+
+import numpy as np
+
+NDJSON_EXTENSION = '.ndjson'
+
+
+def to_builtin(obj):
+    """Convert obj to builtin types, recursing into dicts, lists, and tuples. Slow path for odd values."""
+    if isinstance(obj, dict):
+        return {key: to_builtin(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [to_builtin(value) for value in obj]
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    return obj
+
+
+def number_kind(value_type):
+    """Get the numpy dtype kind ('b', 'i', 'u', or 'f') of a builtin or numpy number type, or None for anything else"""
+    if issubclass(value_type, np.generic):
+        kind = np.dtype(value_type).kind
+        return kind if kind in 'biuf' else None
+    return {bool: 'b', int: 'i', float: 'f'}.get(value_type)
+
+
+def column_kind(values):
+    """Get the kind (see number_kind) shared by every number in values, a list of numbers, arrays, or tuples/lists of
+    numbers. None if they're of different kinds (np.asarray would convert some of them, like ints to floats) or not
+    all numbers."""
+    types = set(map(type, values))
+    if types == {np.ndarray}:
+        kinds = {value.dtype.kind for value in values}
+    else:
+        if types <= {tuple, list}:
+            types = set(map(type, itertools.chain.from_iterable(values)))
+        kinds = {number_kind(value_type) for value_type in types}
+    if len(kinds) == 1 and kinds <= set('biuf'):
+        return kinds.pop()
+    return None
+
+
+def column_to_builtin(values):
+    """Convert a list of values to builtin types. Numbers and equal length sequences of numbers (like centroids) that
+    are all of the same kind are converted with 1 tolist."""
+    kind = column_kind(values)
+    if kind is not None:
+        try:
+            column = np.asarray(values)
+        except ValueError:  # ragged
+            column = None
+        # Python ints too big for int64 end up as floats or objects
+        if column is not None and column.dtype.kind == kind:
+            return column.tolist()
+    return [to_builtin(value) for value in values]
+
+
+def records_to_builtin(records):
+    """Convert a list of dicts (e.g. cells) to builtin types, a column (key) at a time. Keys that only some records have
+    (like 'division') are fine."""
+    if len(records) == 0:
+        return []
+    converted = [{} for record in records]
+    keys = set()
+    for record in records:
+        keys.update(record)
+    for key in keys:
+        if all(key in record for record in records):
+            column = column_to_builtin([record[key] for record in records])
+            for record, value in zip(converted, column):
+                record[key] = value
+        else:
+            have = [i for i, record in enumerate(records) if key in record]
+            column = column_to_builtin([records[i][key] for i in have])
+            for i, value in zip(have, column):
+                converted[i][key] = value
+    return converted
+
+
+def frame_to_builtin(frame):
+    """Convert a frame of results ({'time': ..., 'cells': [...], ...}) to builtin types"""
+    converted = {key: to_builtin(value) for key, value in frame.items() if key != 'cells'}
+    if 'cells' in frame:
+        converted['cells'] = records_to_builtin(frame['cells'])
+    return converted
+
+
+def dumps_frame(frame):
+    """Get frame as 1 line of JSON, including the newline"""
+    return json.dumps(frame_to_builtin(frame), sort_keys=True, separators=(',', ':')) + '\n'
+
+
+class NDJSONWriter:
+    """Writes frames to filename 1 line at a time as they're done
+
+    Usage:
+        with NDJSONWriter('segmented_results.ndjson') as writer:
+            for frame in frames:
+                writer.write(frame)
+    """
+
+    def __init__(self, filename):
+        self.file = open(filename, 'w')
+
+    def write(self, frame):
+        """Append frame as the next line. Flushed, so readers of the file see every frame written so far."""
+        self.file.write(dumps_frame(frame))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_ndjson(filename):
+    """Generator of the frames in an NDJSON file, 1 line at a time"""
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def write_results(filename, frames):
+    """Write frames to filename: NDJSON if it ends with .ndjson, otherwise the original pretty-printed JSON document"""
+    if filename.endswith(NDJSON_EXTENSION):
+        with NDJSONWriter(filename) as writer:
+            for frame in frames:
+                writer.write(frame)
+    else:
+        with open(filename, 'w') as f:
+            json.dump([frame_to_builtin(frame) for frame in frames], f, indent=4, sort_keys=True)
+
+
+def read_results(filename):
+    """Get iterable of the frames in filename. NDJSON files (.ndjson) are read incrementally, and JSON documents are
+    loaded whole."""
+    if filename.endswith(NDJSON_EXTENSION):
+        return read_ndjson(filename)
+    with open(filename) as f:
+        return json.load(f)
@@ -0,0 +1,106 @@
+# Per-panel intensity normalization for stitched images
+#   The frames are a grid of camera panels stitched together, and each panel can have its own brightness and contrast,
+#   which shows up as seams. A single rescale_intensity over the whole frame can't fix that. Instead, match every panel
+#   to the typical panel: map its background level (a low percentile) and bright level (a high percentile) to the medians
+#   of those levels over all the panels.
+#
+#   Stats: the cropped frame is viewed as a (panel rows, panel height, panel cols, panel width) array (no copy), and
+#   the histograms of all panels come from 1 bincount per row of panels, with each panel's values offset into its own
+#   range of bins. Percentiles are then read off the cumulative histograms.
+#   Applying: each panel gets a lookup table of its gain and offset, applied in place with np.take a few rows at a time,
+#   so there's no copy of any panel - only small index buffers.
+
+import numpy as np
+
+LUT_CHUNK_ROWS = 64
+
+
+def panel_view(img, panel_height, panel_width):
+    """Get view of img as a (panel rows, panel height, panel cols, panel width, ...) array. Px past the last whole panel
+    are left out."""
+    n_rows = img.shape[0] // panel_height
+    n_cols = img.shape[1] // panel_width
+    view = img[:n_rows * panel_height, :n_cols * panel_width].view()
+    view.shape = (n_rows, panel_height, n_cols, panel_width) + img.shape[2:]  # raises instead of copying
+    return view
+
+
+def panel_histograms(img, panel_height, panel_width):
+    """Get (panel rows, panel cols, n values) array of the histogram of each panel of unsigned int img. Channels of
+    color images are counted together."""
+    if not np.issubdtype(img.dtype, np.unsignedinteger):
+        raise ValueError('Panel normalization needs an unsigned int image, got {dtype}'.format(dtype=img.dtype))
+    view = panel_view(img, panel_height, panel_width)
+    n_rows, n_cols = view.shape[0], view.shape[2]
+    n_values = int(np.iinfo(img.dtype).max) + 1
+
+    # Bin of each px is its value + n_values * its panel col
+    bin_dtype = np.int32 if n_cols * n_values <= np.iinfo(np.int32).max else np.int64
+    offsets = (np.arange(n_cols, dtype=bin_dtype) * n_values).reshape((1, n_cols, 1) + (1,) * (img.ndim - 2))
+    hists = np.empty((n_rows, n_cols, n_values), dtype=np.int64)
+    for i in range(n_rows):
+        bins = view[i] + offsets
+        hists[i] = np.bincount(bins.ravel(), minlength=n_cols * n_values).reshape(n_cols, n_values)
+    return hists
+
+
+def histogram_percentiles(hists, percentiles):
+    """Get the given percentiles (0-100) of each histogram along the last axis of hists. Returns array of shape
+    hists.shape[:-1] + (len(percentiles),). Percentiles of empty histograms are 0."""
+    cdf = np.cumsum(hists, axis=-1)
+    total = cdf[..., -1:]
+    values = [np.argmax(cdf >= np.ceil(total * p / 100.0).clip(min=1), axis=-1) for p in percentiles]
+    return np.stack(values, axis=-1)
+
+
+def panel_gains(lo, hi, max_gain=4.0):
+    """Get (gain, offset, ref_lo, ref_hi) to map each panel's lo..hi levels to the medians over the panels. Blank panels
+    (hi == lo, like blanked noisy panels) are left alone and don't count towards the medians. Gains are limited to
+    1/max_gain..max_gain so panels w/o cells don't get their noise blown up."""
+    valid = hi > lo
+    if not valid.any():
+        return np.ones(lo.shape), np.zeros(lo.shape), 0, 0
+    ref_lo = float(np.median(lo[valid]))
+    ref_hi = float(np.median(hi[valid]))
+
+    gain = np.ones(lo.shape)
+    gain[valid] = (ref_hi - ref_lo) / (hi[valid] - lo[valid])
+    np.clip(gain, 1 / max_gain, max_gain, out=gain)
+    offset = np.where(valid, ref_lo - lo * gain, 0)
+    return gain, offset, ref_lo, ref_hi
+
+
+def apply_panel_luts(img, panel_height, panel_width, gain, offset):
+    """Map px v of each panel to gain*v + offset (rounded and clipped to the dtype), in place"""
+    view = panel_view(img, panel_height, panel_width)
+    max_value = int(np.iinfo(img.dtype).max)
+    values = np.arange(max_value + 1, dtype=np.float64)
+    for i in range(view.shape[0]):
+        for j in range(view.shape[2]):
+            if gain[i, j] == 1 and offset[i, j] == 0:
+                continue
+            lut = np.clip(np.rint(values * gain[i, j] + offset[i, j]), 0, max_value).astype(img.dtype)
+            for r in range(0, panel_height, LUT_CHUNK_ROWS):
+                chunk = view[i, r:r + LUT_CHUNK_ROWS, j]
+                np.take(lut, chunk, out=chunk, mode='clip')
+
+
+def normalize_panels(img, panel_height, panel_width, lo_percentile=50, hi_percentile=99.9, max_gain=4.0):
+    """Match the intensities of the panels of stitched unsigned int img to each other, in place.
+
+    Args:
+        panel_height, panel_width (int): Size of each panel in px. img should be cropped to whole panels.
+        lo_percentile (float): Percentile of each panel's px taken as its background level. The median works since
+            most of a panel is background.
+        hi_percentile (float): Percentile taken as its bright (cell) level
+        max_gain (float): Max factor to stretch or squeeze a panel's contrast by
+
+    Returns:
+        img
+    """
+    hists = panel_histograms(img, panel_height, panel_width)
+    levels = histogram_percentiles(hists, (lo_percentile, hi_percentile)).astype(np.float64)
+    gain, offset, ref_lo, ref_hi = panel_gains(levels[..., 0], levels[..., 1], max_gain)
+    print('Normalizing %d panels to levels %g - %g' % (gain.size, ref_lo, ref_hi))
+    apply_panel_luts(img, panel_height, panel_width, gain, offset)
+    return img
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+# Sweep segmentation thresholds over a grid of values, reusing everything that doesn't depend on the swept parameters
+#   Segmentation runs as a graph of stages (build_stages). Each stage is a function of its input stages' results and its
+#   own parameters, so its result only depends on the parameters of it and the stages upstream of it. Results are cached
+#   per frame under just those parameter values: decoding, cropping, and greyscale conversion are done once per frame
+#   for the whole sweep, the candidate regions and their Sobel edges once per lo_threshold, the watershed once per
+#   (lo_threshold, hi_threshold), etc. The cache is an LRU bounded by the bytes of the arrays it holds.
+#
+#   The size cutoffs (region_area_cutoff, object_size) are the last step, so the stage before them keeps the area and
+#   centroid of every region/component and the cells for a cutoff are picked from those w/o touching the full frame
+#   (see cell_components). A sweep of only the cutoffs costs about 1 segmentation per frame.
+#
+#   Parameter sets are run in an order where the parameters of the earliest stages change slowest, so the intermediates
+#   needed next are the most recently used ones and a cache of a few frame-sized images is enough.
+#
+#   With the artifact filter on (--artifact-filter), the filtered regions (and so their edges and the watershed) also
+#   depend on hi_threshold (require_marker) and on object_size below ARTIFACT_FILTER's min_area (see
+#   segment_test.cap_min_area).
+#
+#   Usage: python param_sweep.py -i images -m watershed --grid lo_threshold=55,65,75 --grid object_size=500,1000
+
+import argparse
+import os
+import itertools
+from collections import OrderedDict, Counter
+from functools import partial
+from os.path import join as joinpath
+from time import perf_counter
+
+import json
+from NumpyJSONEncoder import NumpyJSONEncoder
+
+import numpy as np
+from scipy.ndimage import binary_fill_holes, find_objects, label as ndimage_label
+from skimage.util import img_as_ubyte
+from skimage.color import rgb2gray
+from skimage.measure import label
+from skimage.morphology import watershed
+from skimage.filters import sobel
+
+from segment_cells import crop_frame, THRESHOLD, REGION_AREA_CUTOFF
+from segment_test import preprocess, get_markers, get_candidate_regions, filter_artifacts, cap_min_area, \
+    ARTIFACT_FILTER, MARKER_LO_THRESHOLD, MARKER_HI_THRESHOLD, OBJECT_SIZE_THRESHOLD
+from diagnostics import Diagnostics
+from frame_index import FrameIndex
+from ndjson import write_results
+
+CACHE_BYTES = 2 * 1024**3
+
+# Segmentation parameters of each method and their defaults
+METHOD_PARAMS = {'basic': {'threshold': THRESHOLD,
+                           'region_area_cutoff': REGION_AREA_CUTOFF},
+                 'watershed': {'lo_threshold': MARKER_LO_THRESHOLD,
+                               'hi_threshold': MARKER_HI_THRESHOLD,
+                               'object_size': OBJECT_SIZE_THRESHOLD}}
+
+
+def parse_param(text):
+    """Parse 'name=value1,value2,...' into (name, [values]). Values are ints if they look like ints, else floats."""
+    name, sep, values = text.partition('=')
+    if not sep or not values:
+        raise ValueError('Expected name=value1,value2,... but got %s' % (text,))
+    parsed = []
+    for value in values.split(','):
+        try:
+            parsed.append(int(value))
+        except ValueError:
+            parsed.append(float(value))
+    return name.strip(), parsed
+
+
+def check_params(method, names):
+    """Raise ValueError if any of names isn't a parameter of segmentation method"""
+    if method not in METHOD_PARAMS:
+        raise ValueError('Segmentation method %s has no parameters to set. Use one of %s.' % (
+            method, ', '.join(sorted(METHOD_PARAMS))))
+    unknown = sorted(set(names) - set(METHOD_PARAMS[method]))
+    if len(unknown) > 0:
+        raise ValueError('Unknown parameters %s for method %s. Use %s.' % (
+            ', '.join(unknown), method, ', '.join(METHOD_PARAMS[method])))
+
+
+def nbytes(value):
+    """Bytes of the arrays in value, an array or tuple/list/dict of them"""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(nbytes(item) for item in value.values())
+    return 0
+
+
+class ArrayCache:
+    """Least recently used cache of arrays, bounded by their total bytes. Values must not be modified after they're put.
+
+    Usage:
+        cache = ArrayCache(2 * 1024**3)
+        cache.put(key, img)
+        img = cache.get(key)  # None if it was never put or has been evicted
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()  # key -> (value, bytes), least recently used first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.items.move_to_end(key)
+        return item[0]
+
+    def put(self, key, value):
+        """Add value, evicting the least recently used values until it fits. Values bigger than the whole cache aren't
+        kept."""
+        size = nbytes(value)
+        if key in self.items:
+            self.bytes -= self.items.pop(key)[1]
+        if size > self.max_bytes:
+            return
+        self.items[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self.items.popitem(last=False)
+            self.bytes -= evicted
+
+
+# Stage functions. Inputs come from the cache, so they're copied before anything is done in place.
+
+def greyscale_basic(img):
+    return img_as_ubyte(rgb2gray(img))
+
+
+def greyscale_watershed(img):
+    return preprocess(img, Diagnostics('sweep', verbose=False))
+
+
+def label_stats(label_img, n_labels, offset=(0, 0)):
+    """(area, centroid) of labels 1..n_labels, like regionprops: (n,) px counts and (n, 2) mean (y, x) + offset"""
+    ys, xs = np.nonzero(label_img)
+    labels = label_img[ys, xs]
+    area = np.bincount(labels, minlength=n_labels + 1)[1:]
+    centroid = np.column_stack([np.bincount(labels, ys, minlength=n_labels + 1)[1:],
+                                np.bincount(labels, xs, minlength=n_labels + 1)[1:]]) / area[:, np.newaxis]
+    return area, centroid + offset
+
+
+def first_px(label_img, boxes, width, offset=(0, 0)):
+    """Flat index in an image width px wide of the 1st px (in raster order) of each label, given their boxes from
+    find_objects. label_img is at offset (y, x) in the image. Labels from label() are numbered in this order."""
+    first = np.empty(len(boxes), dtype=np.int64)
+    for i, (rows, cols) in enumerate(boxes):
+        col = cols.start + np.argmax(label_img[rows.start, cols] == i + 1)
+        first[i] = (rows.start + offset[0]) * width + col + offset[1]
+    return first
+
+
+def cell_list(area, centroid):
+    """Cells like segment_test.cell_stats, labeled 1, 2, ... in order"""
+    return [{'label': i + 1, 'centroid': tuple(c), 'area': a}
+            for i, (a, c) in enumerate(zip(area.tolist(), centroid.tolist()))]
+
+
+def threshold_regions(img, threshold):
+    """(area, centroid) of every region of img > threshold"""
+    label_img, n_labels = label(img > threshold, connectivity=2, return_num=True)
+    return label_stats(label_img, n_labels)
+
+
+def large_region_cells(regions, region_area_cutoff):
+    area, centroid = regions
+    keep = area > region_area_cutoff
+    return cell_list(area[keep], centroid[keep])
+
+
+def filter_regions(img, candidate_regions, markers, artifact_min_area, artifact_filter):
+    """(candidate regions, markers) with the artifacts removed"""
+    candidate_regions = candidate_regions.copy()
+    markers = markers.copy()
+    filter_artifacts(img, candidate_regions, markers, dict(artifact_filter, min_area=artifact_min_area))
+    return candidate_regions, markers
+
+
+def filtered_edges(filtered):
+    return sobel(filtered[0])
+
+
+def filtered_watershed(elevation_map, filtered):
+    return watershed(elevation_map, filtered[1]) == 2
+
+
+def flood(elevation_map, markers):
+    return watershed(elevation_map, markers) == 2
+
+
+def cell_components(img):
+    """Everything about the cells in watershed result img that doesn't depend on object_size.
+
+    segment_test's cells are the 8-connected components of the objects (4-connected, like remove_small_objects) of at
+    least object_size px, with their holes filled. Filling holes only adds px, so each cell is inside 1 component of img
+    with its holes filled. A component whose objects are all kept is exactly 1 cell, and one whose objects are all
+    removed is none. Only the ones with both big and small objects are redone for each object_size, in their box.
+    """
+    components, n_components = label(binary_fill_holes(img), connectivity=2, return_num=True)
+    objects, n_objects = ndimage_label(img)
+    object_area = np.bincount(objects.ravel(), minlength=n_objects + 1)
+    object_area[0] = 0
+
+    # Smallest and largest object in each component
+    owner = np.zeros(n_objects + 1, dtype=np.int64)
+    owner[objects[img]] = components[img]
+    smallest = np.full(n_components + 1, np.iinfo(np.int64).max)
+    np.minimum.at(smallest, owner[1:], object_area[1:])
+    largest = np.zeros(n_components + 1, dtype=np.int64)
+    np.maximum.at(largest, owner[1:], object_area[1:])
+
+    area, centroid = label_stats(components, n_components)
+    boxes = find_objects(components)
+    return {'components': components, 'objects': objects, 'object_area': object_area, 'boxes': boxes,
+            'smallest': smallest[1:], 'largest': largest[1:], 'area': area, 'centroid': centroid,
+            'first': first_px(components, boxes, img.shape[1])}
+
+
+def object_size_cells(components, object_size):
+    """Cells (like segment_test.cell_stats) of the watershed result in components (from cell_components), with the
+    objects smaller than object_size removed"""
+    whole = components['smallest'] >= object_size
+    first, area, centroid = [components['first'][whole]], [components['area'][whole]], [components['centroid'][whole]]
+
+    width = components['components'].shape[1]
+    for i in np.flatnonzero(~whole & (components['largest'] >= object_size)):
+        rows, cols = components['boxes'][i]
+        objects = components['objects'][rows, cols]
+        kept = (components['components'][rows, cols] == i + 1) & (objects > 0) & \
+               (components['object_area'][objects] >= object_size)
+        cell_labels, n_cells = label(binary_fill_holes(kept), connectivity=2, return_num=True)
+        cells_area, cells_centroid = label_stats(cell_labels, n_cells, (rows.start, cols.start))
+        first.append(first_px(cell_labels, find_objects(cell_labels), width, (rows.start, cols.start)))
+        area.append(cells_area)
+        centroid.append(cells_centroid)
+
+    order = np.argsort(np.concatenate(first), kind='stable')
+    return cell_list(np.concatenate(area)[order], np.concatenate(centroid)[order])
+
+
+def build_stages(method, artifact_filter=None):
+    """Get the stage graph of segmentation method, the same steps as segment_basic or segment_test (w/o adaptive
+    thresholds). An ordered dict of stage name -> (function, input stage names, parameter names), in the order they
+    run. The function is called with the inputs' results as args and the parameters as keyword args. The 1st input is
+    the decoded frame, 'frame'. The last stage gives the cells, like segment_basic/segment_test."""
+    if method == 'basic':
+        return OrderedDict([('cropped', (crop_frame, ('frame',), ())),
+                            ('greyscale', (greyscale_basic, ('cropped',), ())),
+                            ('regions', (threshold_regions, ('greyscale',), ('threshold',))),
+                            ('cells', (large_region_cells, ('regions',), ('region_area_cutoff',)))])
+    if method == 'watershed':
+        stages = OrderedDict([('greyscale', (greyscale_watershed, ('frame',), ())),
+                              ('candidate_regions', (get_candidate_regions, ('greyscale',), ('lo_threshold',))),
+                              ('markers', (get_markers, ('greyscale',), ('lo_threshold', 'hi_threshold')))])
+        if artifact_filter is None:
+            stages['elevation_map'] = (sobel, ('candidate_regions',), ())
+            stages['watershed'] = (flood, ('elevation_map', 'markers'), ())
+        else:
+            stages['filtered'] = (partial(filter_regions, artifact_filter=artifact_filter),
+                                  ('greyscale', 'candidate_regions', 'markers'), ('artifact_min_area',))
+            stages['elevation_map'] = (filtered_edges, ('filtered',), ())
+            stages['watershed'] = (filtered_watershed, ('elevation_map', 'filtered'), ())
+        stages['components'] = (cell_components, ('watershed',), ())
+        stages['cells'] = (object_size_cells, ('components',), ('object_size',))
+        return stages
+    raise ValueError('Can only sweep the parameters of methods %s, not %s' % (', '.join(sorted(METHOD_PARAMS)), method))
+
+
+def derived_params(method, artifact_filter=None):
+    """Get dict of name -> function(params) of the parameters stages of method use that are derived from the swept
+    ones. The artifact filter's min_area only depends on object_size while it's below ARTIFACT_FILTER's (see
+    segment_test.cap_min_area), so the filtered regions are shared by all the bigger object_sizes."""
+    if method == 'watershed' and artifact_filter is not None:
+        return {'artifact_min_area': lambda params: cap_min_area(artifact_filter, params['object_size'])['min_area']}
+    return {}
+
+
+class StageGraph:
+    """Runs the stages of a segmentation (from build_stages) for 1 set of parameters at a time, caching the results of
+    all but the last stage in an ArrayCache under the frame and the parameters they depend on
+
+    Usage:
+        graph = StageGraph(build_stages('watershed'), ArrayCache(), index.read, derived_params('watershed'))
+        cells = graph.run(frame, {'lo_threshold': 65, 'hi_threshold': 150, 'object_size': 1000})
+    """
+
+    def __init__(self, stages, cache, read, derived=None):
+        self.stages = stages
+        self.cache = cache
+        self.read = read
+        self.derived = derived if derived is not None else {}
+        self.output = next(reversed(stages))
+        self.computed = Counter()  # times each stage was run
+
+        # Parameters each stage's result depends on: its own and its inputs'
+        self.depends = {'frame': ()}
+        for name, (_, inputs, params) in stages.items():
+            depends = set(params)
+            for stage in inputs:
+                depends.update(self.depends[stage])
+            self.depends[name] = tuple(sorted(depends))
+
+    def params(self):
+        """Swept parameter names in the order of the first stage using them"""
+        names = []
+        for _, _, params in self.stages.values():
+            names.extend(param for param in params if param not in names and param not in self.derived)
+        return names
+
+    def run(self, frame, params, stage=None):
+        """Get the result of stage (default: the last, the cells) for frame and dict of parameter values"""
+        params = dict(params, **{name: derive(params) for name, derive in self.derived.items()})
+        return self.evaluate(frame, params, stage if stage is not None else self.output)
+
+    def evaluate(self, frame, params, stage):
+        key = (frame['name'], stage) + tuple(params[param] for param in self.depends[stage])
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        self.computed[stage] += 1
+        if stage == 'frame':
+            result = self.read(frame)
+        else:
+            function, inputs, own_params = self.stages[stage]
+            args = [self.evaluate(frame, params, input_stage) for input_stage in inputs]
+            result = function(*args, **{param: params[param] for param in own_params})
+        if stage != self.output:  # Each final result is only used once
+            self.cache.put(key, result)
+        return result
+
+
+def grid_points(grid, order):
+    """Get list of dicts of every combination of the values in grid (dict of parameter name -> list of values). The
+    parameters earlier in order change slowest."""
+    names = sorted(grid, key=lambda name: order.index(name) if name in order else len(order))
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def sweep(frames, read, method, grid, artifact_filter=None, cache_bytes=CACHE_BYTES, output_dir=None):
+    """Segment frames (frame index entries) with every combination of parameter values in grid (dict of parameter
+    name -> list of values). Parameters not in grid keep their defaults (METHOD_PARAMS). read(frame) gets the decoded
+    frame. If output_dir is given, also writes segmented_results_<point>.ndjson there for each parameter set.
+
+    Returns:
+        list of dicts per parameter set: params, n_cells (per frame), mean_area (per frame)
+        StageGraph that was run, with its cache and counts of the stages that were run
+    """
+    check_params(method, grid)
+    graph = StageGraph(build_stages(method, artifact_filter), ArrayCache(cache_bytes), read,
+                       derived_params(method, artifact_filter))
+    points = [dict(METHOD_PARAMS[method], **point) for point in grid_points(grid, graph.params())]
+
+    results = [{'params': point, 'n_cells': [], 'mean_area': []} for point in points]
+    segmented = [[] for _ in points]
+    for frame in frames:
+        print('Sweeping %d parameter sets over %s' % (len(points), frame['name']))
+        for i, point in enumerate(points):
+            cells = graph.run(frame, point)
+            results[i]['n_cells'].append(len(cells))
+            results[i]['mean_area'].append(float(np.mean([cell['area'] for cell in cells])) if len(cells) > 0 else 0.0)
+            if output_dir is not None:
+                segmented[i].append({'time': frame['time'], 'cells': cells})
+
+    if output_dir is not None:
+        for i, frames_results in enumerate(segmented):
+            write_results(joinpath(output_dir, 'segmented_results_%d.ndjson' % (i,)), frames_results)
+    return results, graph
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Segment frames with every combination of a grid of parameter values')
+    parser.add_argument('-i', '--input', help='Input images directory', required=False, default='images')
+    parser.add_argument('-o', '--output', help='Output directory', required=False, default='sweep')
+    parser.add_argument('-m', '--method', help='Segmentation method', required=False, default='watershed',
+                        choices=sorted(METHOD_PARAMS))
+    parser.add_argument('--grid', help='Values of a parameter to sweep, like lo_threshold=55,65,75. Can be repeated. basic: %s. watershed: %s.' % (
+                        ', '.join(METHOD_PARAMS['basic']), ', '.join(METHOD_PARAMS['watershed'])),
+                        action='append', default=[])
+    parser.add_argument('--start', help='Only process frames at or after this time', required=False, type=int, default=None)
+    parser.add_argument('--stop', help='Only process frames at or before this time', required=False, type=int, default=None)
+    parser.add_argument('--colony', help='Only process frames of this colony', required=False, type=int, default=None)
+    parser.add_argument('--artifact-filter', help='Include this flag to remove obvious artifacts (small, marker-less, or ring-shaped regions) before the watershed',
+                        action='store_true')
+    parser.add_argument('--cache-mb', help='Max MB of intermediate images kept for reuse', required=False, type=float,
+                        default=CACHE_BYTES / 1024**2)
+    parser.add_argument('--save-results', help='Include this flag to also write the segmented cells of every parameter set to segmented_results_<n>.ndjson in the output directory',
+                        action='store_true')
+    args = parser.parse_args()
+
+    grid = dict(parse_param(text) for text in args.grid)
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+
+    index = FrameIndex(args.input)
+    frames = index.frames(start=args.start, stop=args.stop, colony=args.colony)
+    start_time = perf_counter()
+    results, graph = sweep(frames, index.read, args.method, grid,
+                           artifact_filter=ARTIFACT_FILTER if args.artifact_filter else None,
+                           cache_bytes=int(args.cache_mb * 1024**2),
+                           output_dir=args.output if args.save_results else None)
+    print('Swept %d parameter sets over %d frames in %.1f s' % (len(results), len(frames), perf_counter() - start_time))
+    print('Stages run: %s' % (', '.join('%s %d' % (stage, graph.computed[stage])
+                                        for stage in ['frame'] + list(graph.stages)),))
+    print('Cache: %d hits, %d misses' % (graph.cache.hits, graph.cache.misses))
+
+    for i, result in enumerate(results):
+        print('%3d %s: %d cells' % (i, ', '.join('%s=%s' % item for item in sorted(result['params'].items())),
+                                    sum(result['n_cells'])))
+
+    with open(joinpath(args.output, 'sweep_results.txt'), 'w') as f:
+        json.dump(results, f, cls=NumpyJSONEncoder, indent=4)
+    print('done.')
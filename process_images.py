@@ -8,6 +8,7 @@ import ast
 
 from image_loader import image_loader
 from save_tiff import save_tiff
+from panel_normalize import normalize_panels
 
 from skimage.draw import polygon
 
@@ -127,5 +128,13 @@ for img, name in image_loader(input_dir):
     if save_figs:
         save_tiff(joinpath(output_dir, ''.join([name, '_', str(step), '_noisy_panels_blanked.tif'])), img)
 
+    # Match the brightness/contrast of the panels to each other to get rid of the seams between them
+    #   Blanked noisy panels are left alone
+    normalize_panels(img, PANEL_HEIGHT, PANEL_WIDTH)
+
+    step += 1
+    if save_figs:
+        save_tiff(joinpath(output_dir, ''.join([name, '_', str(step), '_panels_normalized.tif'])), img)
+
 
     1
\ No newline at end of file
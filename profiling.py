@@ -0,0 +1,174 @@
+# Per-step time and memory profiling, to find the step that blows up memory on big frames
+#   Steps are marked by checkpoints: each one ends the previous step and starts a new one. Diagnostics.next_step and
+#   Diagnostics.log add a checkpoint for every progress message of the segmentation functions, so their steps get
+#   profiled w/o any changes, and run_pipeline.py adds ones for reading frames, tracking, and outputs.
+#
+#   For each step, records:
+#   - wall time
+#   - tracemalloc peak: the most memory traced at once during the step. NumPy reports its array buffers to tracemalloc,
+#     so this includes the frame-sized intermediates, not just Python objects.
+#   - peak RSS: the process high-water mark (ru_maxrss) at the end of the step, and how much the step raised it. Also
+#     counts memory tracemalloc can't see (e.g. allocated by C libraries).
+#
+#   tracemalloc slows down allocation heavy Python code, so times are a bit inflated while profiling.
+#   Needs Python 3.9+ for per-step tracemalloc peaks. On older versions, the peak is the highest so far in the run.
+
+import re
+import sys
+import json
+import tracemalloc
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+MB = 1024 * 1024
+
+# Active profiler. Set by start_profiling. Checkpoints do nothing when it's None.
+profiler = None
+
+
+def max_rss():
+    """Peak resident set size of the process so far in bytes, or None if unavailable"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024  # Linux reports KB
+
+
+def step_key(step):
+    """Step name w/o numbers, so steps like 'Segmenting 12 candidate regions' group together across frames"""
+    return re.sub(r'\d+', 'N', step).rstrip('.')
+
+
+class MemoryProfiler:
+    """Records time and memory of each step between checkpoints
+
+    Usage:
+        profiler = MemoryProfiler()
+        profiler.checkpoint('frame1', 'Thresholding...')
+        ...
+        profiler.checkpoint('frame1', 'Labeling...')
+        ...
+        profiler.stop()
+        profiler.report()
+    """
+
+    def __init__(self):
+        self.records = []  # dicts of frame, step, seconds, traced_peak, traced_end, rss_peak, rss_growth (bytes)
+        self.current = None
+        tracemalloc.start()
+
+    def checkpoint(self, frame, step):
+        """End the current step and start step of frame (None for steps that aren't of 1 frame)"""
+        self.end_step()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self.current = {'frame': frame, 'step': step, 'start': perf_counter(), 'rss_start': max_rss()}
+
+    def end_step(self):
+        if self.current is None:
+            return
+        traced_end, traced_peak = tracemalloc.get_traced_memory()
+        rss = max_rss()
+        record = {'frame': self.current['frame'],
+                  'step': self.current['step'],
+                  'seconds': perf_counter() - self.current['start'],
+                  'traced_peak': traced_peak,
+                  'traced_end': traced_end,
+                  'rss_peak': rss,
+                  'rss_growth': rss - self.current['rss_start'] if rss is not None else None}
+        self.records.append(record)
+        self.current = None
+
+    def stop(self):
+        self.end_step()
+        tracemalloc.stop()
+
+    def summary(self):
+        """Get list of dicts per step (grouped by step_key in order of 1st appearance): step, count, seconds (total),
+        traced_peak, rss_peak (max over frames), rss_growth (total), and frame (where traced_peak was hit)"""
+        steps = {}
+        for record in self.records:
+            key = step_key(record['step'])
+            if key not in steps:
+                steps[key] = {'step': key, 'count': 0, 'seconds': 0.0, 'traced_peak': -1, 'frame': None,
+                              'rss_peak': record['rss_peak'], 'rss_growth': 0 if record['rss_growth'] is not None else None}
+            summary = steps[key]
+            summary['count'] += 1
+            summary['seconds'] += record['seconds']
+            if record['traced_peak'] > summary['traced_peak']:
+                summary['traced_peak'] = record['traced_peak']
+                summary['frame'] = record['frame']
+            if record['rss_peak'] is not None:
+                summary['rss_peak'] = max(summary['rss_peak'], record['rss_peak'])
+                summary['rss_growth'] += record['rss_growth']
+        return list(steps.values())
+
+    def frame_summary(self):
+        """Get dict of frame -> {'seconds': total, 'traced_peak': max over its steps, 'rss_peak': at its last step}"""
+        frames = {}
+        for record in self.records:
+            if record['frame'] is None:
+                continue
+            summary = frames.setdefault(record['frame'], {'seconds': 0.0, 'traced_peak': 0, 'rss_peak': None})
+            summary['seconds'] += record['seconds']
+            summary['traced_peak'] = max(summary['traced_peak'], record['traced_peak'])
+            summary['rss_peak'] = record['rss_peak']
+        return frames
+
+    def report(self):
+        """Print the time and memory of each step, flagging the one with the largest footprint (tracemalloc peak)"""
+        summary = self.summary()
+        if len(summary) == 0:
+            return
+        largest = max(summary, key=lambda step: step['traced_peak'])
+
+        print('%-50s %6s %10s %14s %12s %14s' % ('Step', 'Count', 'Time (s)', 'Peak traced MB', 'Peak RSS MB',
+                                                 'RSS growth MB'))
+        for step in summary:
+            rss_peak = '%.1f' % (step['rss_peak'] / MB,) if step['rss_peak'] is not None else '-'
+            rss_growth = '%.1f' % (step['rss_growth'] / MB,) if step['rss_growth'] is not None else '-'
+            flag = '  <-- largest' if step is largest else ''
+            print('%-50s %6d %10.2f %14.1f %12s %14s%s' % (step['step'][:50], step['count'], step['seconds'],
+                                                           step['traced_peak'] / MB, rss_peak, rss_growth, flag))
+        print('Largest memory footprint: %s (%.1f MB traced%s)' % (
+            largest['step'], largest['traced_peak'] / MB,
+            ', frame %s' % (largest['frame'],) if largest['frame'] is not None else ''))
+
+        frames = self.frame_summary()
+        if len(frames) > 0:
+            frame = max(frames, key=lambda name: frames[name]['traced_peak'])
+            print('Largest frame: %s (%.1f MB traced, %.2f s)' % (frame, frames[frame]['traced_peak'] / MB,
+                                                                    frames[frame]['seconds']))
+
+    def save(self, filename):
+        """Write the per-step records and summary as JSON"""
+        with open(filename, 'w') as f:
+            json.dump({'records': self.records, 'summary': self.summary(), 'frames': self.frame_summary()}, f, indent=4,
+                      sort_keys=True)
+
+
+def start_profiling():
+    """Start profiling steps of this process. Returns the profiler."""
+    global profiler
+    profiler = MemoryProfiler()
+    return profiler
+
+
+def stop_profiling():
+    """Stop profiling. Returns the profiler, with everything recorded."""
+    global profiler
+    stopped = profiler
+    if stopped is not None:
+        stopped.stop()
+    profiler = None
+    return stopped
+
+
+def checkpoint(frame, step):
+    """End the current step and start step of frame, if profiling"""
+    if profiler is not None:
+        profiler.checkpoint(frame, step)
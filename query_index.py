@@ -0,0 +1,208 @@
+# Spatio-temporal index of tracked cells for analysis queries
+#   e.g. "which cells were inside this rectangle between times T1 and T2" or "the k nearest cells to this point at time
+#   T" w/o scanning every cell dict of tracked_results.
+#
+#   Every cell observation becomes a row of a set of columns (numpy arrays): time, label, y, x, area, prev_label,
+#   prev_time, track.
+#   Rows are sorted by frame, then by the square grid bucket (cell_size px) their centroid is in, then by position, so:
+#   - each frame's rows are 1 contiguous slice, found from the sorted frame times by binary search (time index)
+#   - inside a frame, each row of grid buckets covered by a query rectangle is 1 contiguous slice too, so a region query
+#     is 2 binary searches per bucket row - vectorised over all the frames in the time range at once - plus an exact
+#     check of the few rows in edge buckets
+#   Saved as .npz next to the results, so it loads in no time and doesn't need the results file again.
+
+import numpy as np
+
+from ndjson import read_results
+
+QUERY_INDEX_VERSION = 2
+COLUMNS = ('time', 'label', 'y', 'x', 'area', 'prev_label', 'prev_time', 'track')
+
+
+def frames_to_columns(frames):
+    """Get dict of column name -> array of every cell in frames (e.g. tracked results), plus a 'frame' column with the
+    index of each cell's frame in frames. Cells w/o a prev_label, prev_time, or track get -1. Frames w/o a time get time
+    -1."""
+    parts = {name: [] for name in COLUMNS + ('frame',)}
+    for i, frame in enumerate(frames):
+        cells = frame['cells']
+        n = len(cells)
+        time = frame['time'] if frame['time'] is not None else -1
+        centroids = np.array([cell['centroid'] for cell in cells], dtype=np.float64).reshape(n, 2)
+        parts['time'].append(np.full(n, time, dtype=np.int64))
+        parts['label'].append(np.array([cell['label'] for cell in cells], dtype=np.int64))
+        parts['y'].append(centroids[:, 0])
+        parts['x'].append(centroids[:, 1])
+        parts['area'].append(np.array([cell['area'] for cell in cells], dtype=np.float64))
+        parts['prev_label'].append(np.array([cell.get('prev_label', -1) for cell in cells], dtype=np.int64))
+        parts['prev_time'].append(np.array([cell.get('prev_time', -1) for cell in cells], dtype=np.int64))
+        parts['track'].append(np.array([cell.get('track', -1) for cell in cells], dtype=np.int64))
+        parts['frame'].append(np.full(n, i, dtype=np.int64))
+
+    dtypes = {'y': np.float64, 'x': np.float64, 'area': np.float64}
+    return {name: np.concatenate(arrays) if len(arrays) > 0 else np.zeros(0, dtype=dtypes.get(name, np.int64))
+            for name, arrays in parts.items()}
+
+
+def ranges_to_indices(starts, stops):
+    """Concatenation of np.arange(start, stop) for each start, stop, w/o a Python loop"""
+    lengths = stops - starts
+    keep = lengths > 0
+    starts, lengths = starts[keep], lengths[keep]
+    if len(starts) == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(lengths.sum())
+
+
+class QueryIndex:
+    """Index over the cells of tracked results
+
+    Usage:
+        index = QueryIndex.from_results('output/tracked_results.txt')
+        index.save('output/tracked_results_index.npz')
+        index = QueryIndex.load('output/tracked_results_index.npz')
+        rows = index.in_region(1000, 2000, 1500, 2600, t0=10, t1=20)  # row indices
+        cells = index.cells(rows)  # as dicts
+        rows, dists = index.nearest(1200, 2300, time=15, k=5)
+    """
+
+    def __init__(self, columns, cell_size=64.0):
+        """Build index from dict of column name -> array (like frames_to_columns gives), in any order"""
+        self.cell_size = float(cell_size)
+        n = len(columns['time'])
+
+        # Grid covering every centroid
+        if n > 0:
+            self.origin = (float(columns['y'].min()), float(columns['x'].min()))
+            self.n_grid_cols = int((columns['x'].max() - self.origin[1]) // self.cell_size) + 1
+        else:
+            self.origin = (0.0, 0.0)
+            self.n_grid_cols = 1
+
+        # Sort rows by frame, bucket, then position
+        self.frame_times, frame = np.unique(columns['time'], return_inverse=True)
+        grid_rows, grid_cols = self.grid_coords(columns['y'], columns['x'])
+        self.n_buckets = (int(grid_rows.max()) + 1 if n > 0 else 1) * self.n_grid_cols
+        keys = frame.astype(np.int64) * self.n_buckets + grid_rows * self.n_grid_cols + grid_cols
+        order = np.lexsort((columns['x'], columns['y'], keys))
+        self.keys = keys[order]
+        self.columns = {name: np.asarray(columns[name])[order] for name in COLUMNS}
+        self.frame_starts = np.searchsorted(self.keys, np.arange(len(self.frame_times) + 1) * self.n_buckets)
+
+    @classmethod
+    def from_frames(cls, frames, cell_size=64.0):
+        return cls(frames_to_columns(frames), cell_size)
+
+    @classmethod
+    def from_results(cls, filename, cell_size=64.0):
+        """Build from a results file (JSON document or NDJSON, read a frame at a time)"""
+        return cls.from_frames(read_results(filename), cell_size)
+
+    def save(self, filename):
+        """Save columns along with the sorted keys and grid, so loading doesn't have to sort again"""
+        np.savez(filename, version=QUERY_INDEX_VERSION, cell_size=self.cell_size, origin=self.origin,
+                 n_grid_cols=self.n_grid_cols, n_buckets=self.n_buckets, keys=self.keys, frame_times=self.frame_times,
+                 frame_starts=self.frame_starts, **self.columns)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as saved:
+            if int(saved['version']) != QUERY_INDEX_VERSION:
+                raise ValueError('Query index {filename} is version {version}, expected {expected}'.format(
+                    filename=filename, version=int(saved['version']), expected=QUERY_INDEX_VERSION))
+            index = cls.__new__(cls)
+            index.cell_size = float(saved['cell_size'])
+            index.origin = tuple(saved['origin'].tolist())
+            index.n_grid_cols = int(saved['n_grid_cols'])
+            index.n_buckets = int(saved['n_buckets'])
+            index.keys = saved['keys']
+            index.frame_times = saved['frame_times']
+            index.frame_starts = saved['frame_starts']
+            index.columns = {name: saved[name] for name in COLUMNS}
+        return index
+
+    def __len__(self):
+        return len(self.keys)
+
+    def grid_coords(self, y, x):
+        """Grid (row, col) of the bucket positions y, x are in"""
+        grid_rows = np.floor((np.asarray(y) - self.origin[0]) / self.cell_size).astype(np.int64)
+        grid_cols = np.floor((np.asarray(x) - self.origin[1]) / self.cell_size).astype(np.int64)
+        return grid_rows, grid_cols
+
+    def frames_between(self, t0=None, t1=None):
+        """Indices of the frames with t0 <= time <= t1 (either can be None for no limit)"""
+        first = 0 if t0 is None else np.searchsorted(self.frame_times, t0, 'left')
+        last = len(self.frame_times) if t1 is None else np.searchsorted(self.frame_times, t1, 'right')
+        return np.arange(first, last)
+
+    def in_time_range(self, t0=None, t1=None):
+        """Row indices of the cells with t0 <= time <= t1"""
+        frames = self.frames_between(t0, t1)
+        if len(frames) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.arange(self.frame_starts[frames[0]], self.frame_starts[frames[-1] + 1])
+
+    def in_region(self, y0, x0, y1, x1, t0=None, t1=None):
+        """Row indices of the cells with y0 <= y < y1 and x0 <= x < x1 and t0 <= time <= t1, in (frame, position)
+        order"""
+        frames = self.frames_between(t0, t1)
+        if len(frames) == 0 or len(self) == 0 or y1 <= y0 or x1 <= x0:
+            return np.zeros(0, dtype=np.int64)
+
+        # Clip the rectangle's buckets to the grid
+        (gy0, gy1), (gx0, gx1) = self.grid_coords([y0, y1], [x0, x1])
+        gy0, gx0 = max(gy0, 0), max(gx0, 0)
+        gy1 = min(gy1, self.n_buckets // self.n_grid_cols - 1)
+        gx1 = min(gx1, self.n_grid_cols - 1)
+        if gy1 < gy0 or gx1 < gx0:
+            return np.zeros(0, dtype=np.int64)
+
+        # 1 slice per (bucket row, frame)
+        frame_keys = frames.astype(np.int64) * self.n_buckets
+        starts, stops = [], []
+        for gy in range(gy0, gy1 + 1):
+            starts.append(np.searchsorted(self.keys, frame_keys + gy * self.n_grid_cols + gx0, 'left'))
+            stops.append(np.searchsorted(self.keys, frame_keys + gy * self.n_grid_cols + gx1, 'right'))
+        candidates = ranges_to_indices(np.stack(starts, axis=1).ravel(), np.stack(stops, axis=1).ravel())
+
+        y = self.columns['y'][candidates]
+        x = self.columns['x'][candidates]
+        return candidates[(y >= y0) & (y < y1) & (x >= x0) & (x < x1)]
+
+    def nearest(self, y, x, time, k=1):
+        """Get (row indices, distances) of the k cells closest to y, x at time, closest first. Fewer if the frame has
+        fewer cells."""
+        frames = self.frames_between(time, time)
+        if len(frames) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        n_frame_cells = self.frame_starts[frames[0] + 1] - self.frame_starts[frames[0]]
+        k = min(k, n_frame_cells)
+        if k == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+
+        # Grow a square around the point until it holds k cells. The kth closest of those is at most the square's
+        #   half-width away only if nothing outside could be closer, so check once more with a square that big.
+        radius = self.cell_size
+        while True:
+            rows = self.in_region(y - radius, x - radius, y + radius, x + radius, time, time)
+            if len(rows) >= k:
+                dists = np.hypot(self.columns['y'][rows] - y, self.columns['x'][rows] - x)
+                kth = np.partition(dists, k - 1)[k - 1]
+                if kth < radius:
+                    break
+                radius = kth * (1 + 1e-9)
+            else:
+                radius *= 2
+
+        order = np.argsort(dists, kind='stable')[:k]
+        return rows[order], dists[order]
+
+    def cells(self, rows):
+        """Get list of cell dicts (time, label, centroid, area, prev_label, prev_time, track) for row indices"""
+        columns = {name: self.columns[name][rows].tolist() for name in COLUMNS}
+        return [{'time': time, 'label': label, 'centroid': (y, x), 'area': area, 'prev_label': prev_label,
+                 'prev_time': prev_time, 'track': track}
+                for time, label, y, x, area, prev_label, prev_time, track
+                in zip(*(columns[name] for name in COLUMNS))]
@@ -0,0 +1,163 @@
+# Shape and intensity features for every region in a label image at once
+#   regionprops makes an object per region and computes each property region by region in Python, which gets slow with
+#   10^4 regions per frame. Instead, compute everything with np.bincount over the labeled px (weighted sums per label)
+#   plus a few whole image comparisons, so the cost is a handful of passes over the image regardless of the number of
+#   regions. Features are returned as a columnar table - a dict of feature name -> array with 1 entry per region.
+#
+# Matches regionprops for area, centroid, moments, axis lengths, eccentricity, orientation, perimeter, and mean intensity.
+#   Convex area is the area of the convex hull of the region's px squares, approximated by the circumscribed polygon
+#   with N_HULL_DIRECTIONS sides (overestimates a circle's hull by ~0.3% with 32), instead of regionprops' count of the
+#   px inside the hull.
+
+from math import sqrt
+
+import numpy as np
+
+N_HULL_DIRECTIONS = 32
+
+# Weights of each border px configuration for the perimeter, same as skimage.measure.perimeter. Index is 1 for the px
+#   itself + 2 for each edge neighbour + 10 for each corner neighbour that's also on the border of the same region.
+PERIMETER_WEIGHTS = np.zeros(50, dtype=np.float64)
+PERIMETER_WEIGHTS[[5, 7, 15, 17, 25, 27]] = 1
+PERIMETER_WEIGHTS[[21, 33]] = sqrt(2)
+PERIMETER_WEIGHTS[[13, 23]] = (1 + sqrt(2)) / 2
+
+EDGE_OFFSETS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+CORNER_OFFSETS = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+def shifted(padded, dr, dc):
+    """View of padded (the image padded by 1 px) shifted by (dr, dc), the same size as the unpadded image"""
+    rows, cols = padded.shape
+    return padded[1 + dr:rows - 1 + dr, 1 + dc:cols - 1 + dc]
+
+
+def border_px(label_img):
+    """Get boolean image of px on the border of their region: labeled px with any edge neighbour in another region or
+    outside the image"""
+    padded = np.pad(label_img, 1, mode='constant')
+    border = np.zeros(label_img.shape, dtype=bool)
+    for dr, dc in EDGE_OFFSETS:
+        border |= shifted(padded, dr, dc) != label_img
+    border &= label_img != 0
+    return border
+
+
+def perimeters(label_img, border, n_bins):
+    """Perimeter of each label like skimage.measure.perimeter (4-connectivity) applied to each region on its own"""
+    padded_labels = np.pad(label_img, 1, mode='constant')
+    padded_border = np.pad(border, 1, mode='constant')
+
+    # Border neighbours of the same region, only needed at border px
+    rows, cols = np.nonzero(border)
+    labels = label_img[rows, cols].astype(np.int64)
+    config = np.ones(len(rows), dtype=np.int64)
+    for offsets, weight in ((EDGE_OFFSETS, 2), (CORNER_OFFSETS, 10)):
+        for dr, dc in offsets:
+            same = padded_border[rows + 1 + dr, cols + 1 + dc] & (padded_labels[rows + 1 + dr, cols + 1 + dc] == labels)
+            config += weight * same
+
+    return np.bincount(labels, weights=PERIMETER_WEIGHTS[config], minlength=n_bins), rows, cols, labels
+
+
+def convex_areas(rows, cols, labels, n_directions=N_HULL_DIRECTIONS):
+    """Area of the convex hull of the px squares of each label, given the px on their borders (the hull only depends on
+    those). Uses the polygon formed by the support lines of the region in n_directions evenly spaced directions.
+    Returns array with 1 entry per distinct label, in increasing label order."""
+    theta = 2 * np.pi * np.arange(n_directions) / n_directions
+    cos, sin = np.cos(theta), np.sin(theta)
+
+    # Group px by label so each label's max is a reduceat over a contiguous run
+    order = np.argsort(labels, kind='stable')
+    rows, cols, labels = rows[order], cols[order], labels[order]
+    starts = np.flatnonzero(np.diff(labels, prepend=-1))
+
+    # Support function: max projection of each region onto each direction. A px square sticks out of its center by
+    #   half its projected width.
+    support = np.empty((len(starts), n_directions))
+    for k in range(n_directions):
+        support[:, k] = np.maximum.reduceat(rows * cos[k] + cols * sin[k], starts)
+    support += 0.5 * (np.abs(cos) + np.abs(sin))
+
+    # Vertex between the support lines of consecutive directions, then the shoelace formula
+    h1, h2 = support, np.roll(support, -1, axis=1)
+    cos2, sin2 = np.roll(cos, -1), np.roll(sin, -1)
+    det = cos * sin2 - sin * cos2
+    vr = (h1 * sin2 - h2 * sin) / det
+    vc = (h2 * cos - h1 * cos2) / det
+    return 0.5 * np.abs(np.sum(vr * np.roll(vc, -1, axis=1) - np.roll(vr, -1, axis=1) * vc, axis=1))
+
+
+def region_features(label_img, intensity_img=None, convex=True):
+    """Compute features of every region in label_img.
+
+    Args:
+        label_img (2-D array of ints): Label image, 0 is background. Labels don't need to be sequential.
+        intensity_img (2-D array): Optional image the same size as label_img to get mean_intensity from
+        convex (bool): Whether to compute convex_area and solidity
+
+    Returns:
+        Dict of feature name -> array with 1 entry per label present, in increasing label order:
+            label, area, centroid_row, centroid_col, mu20, mu11, mu02 (central moments - row power first),
+            major_axis_length, minor_axis_length, eccentricity, orientation (angle between the rows axis and the major
+            axis, like regionprops), perimeter, convex_area, solidity, and mean_intensity (if intensity_img given)
+    """
+    flat = label_img.ravel()
+    idx = np.flatnonzero(flat)
+    labels = flat[idx].astype(np.int64)
+    rows, cols = np.divmod(idx, label_img.shape[1])
+    n_bins = int(labels.max()) + 1 if len(labels) > 0 else 1
+
+    def sums(weights=None):
+        return np.bincount(labels, weights=weights, minlength=n_bins)
+
+    area = sums()
+    present = np.flatnonzero(area)
+    present = present[present > 0]
+    area_p = area[present]
+
+    # Moments
+    rows_f = rows.astype(np.float64)
+    cols_f = cols.astype(np.float64)
+    centroid_row = sums(rows_f)[present] / area_p
+    centroid_col = sums(cols_f)[present] / area_p
+    var_row = sums(rows_f**2)[present] / area_p - centroid_row**2
+    var_col = sums(cols_f**2)[present] / area_p - centroid_col**2
+    cov = sums(rows_f * cols_f)[present] / area_p - centroid_row * centroid_col
+
+    # Ellipse with the same second moments
+    common = np.sqrt(((var_row - var_col) / 2)**2 + cov**2)
+    l1 = np.maximum((var_row + var_col) / 2 + common, 0)
+    l2 = np.maximum((var_row + var_col) / 2 - common, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eccentricity = np.where(l1 > 0, np.sqrt(1 - l2 / l1), 0)
+    orientation = 0.5 * np.arctan2(2 * cov, var_row - var_col)
+    orientation = np.where((var_row == var_col) & (cov == 0), np.pi / 4, orientation)
+
+    features = {'label': present,
+                'area': area_p,
+                'centroid_row': centroid_row,
+                'centroid_col': centroid_col,
+                'mu20': var_row * area_p,
+                'mu11': cov * area_p,
+                'mu02': var_col * area_p,
+                'major_axis_length': 4 * np.sqrt(l1),
+                'minor_axis_length': 4 * np.sqrt(l2),
+                'eccentricity': eccentricity,
+                'orientation': orientation}
+
+    border = border_px(label_img)
+    perimeter, border_rows, border_cols, border_labels = perimeters(label_img, border, n_bins)
+    features['perimeter'] = perimeter[present]
+
+    if convex:
+        # Every region has border px, so this has the same labels as present
+        convex_area = convex_areas(border_rows, border_cols, border_labels)
+        features['convex_area'] = convex_area
+        features['solidity'] = area_p / convex_area
+
+    if intensity_img is not None:
+        intensity = intensity_img.ravel()[idx].astype(np.float64)
+        features['mean_intensity'] = sums(intensity)[present] / area_p
+
+    return features
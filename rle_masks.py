@@ -0,0 +1,161 @@
+# Sparse per-cell masks stored as run-length encoded rows
+#   Keeping every frame's full label image costs rows x cols px per frame even though cells cover a small part of it.
+#   Instead store each cell as the runs of consecutive px it covers in each row, plus its bounding box. Any single cell
+#   can be decoded on its own, the whole label image can be rebuilt, and area/centroid come straight from the runs.
+#
+# Format (dict of numpy arrays, saved as a compressed .npz per frame):
+#   shape: (rows, cols) of the label image
+#   labels: (n,) label of each cell, ascending
+#   bboxes: (n, 4) (min_row, min_col, max_row, max_col) of each cell, max exclusive like regionprops
+#   run_offsets: (n+1,) runs of cell i are runs[run_offsets[i]:run_offsets[i+1]]
+#   runs: (m, 3) (row, start_col, length) of each run, ordered by row then column within a cell
+
+import os
+from os.path import join as joinpath
+
+import numpy as np
+
+from labels import smallest_label_dtype
+
+
+def encode_labels(label_img):
+    """Run-length encode every labeled cell in label_img in 1 vectorised pass"""
+    # A run starts where a labeled px differs from the px to its left and ends where it differs from the px to its right
+    labeled = label_img != 0
+    starts = labeled.copy()
+    starts[:, 1:] &= label_img[:, 1:] != label_img[:, :-1]
+    ends = labeled
+    ends[:, :-1] &= label_img[:, :-1] != label_img[:, 1:]
+
+    # np.nonzero goes in row-major order, so the nth start and nth end belong to the same run
+    start_rows, start_cols = np.nonzero(starts)
+    _, end_cols = np.nonzero(ends)
+    lengths = end_cols - start_cols + 1
+    run_labels = label_img[start_rows, start_cols]
+
+    # Group runs by cell. A stable sort keeps them in row-major order within each cell.
+    order = np.argsort(run_labels, kind='mergesort')
+    run_labels = run_labels[order]
+    coord_dtype = smallest_label_dtype(max(label_img.shape))
+    runs = np.column_stack((start_rows[order], start_cols[order], lengths[order])).astype(coord_dtype)
+
+    labels, counts = np.unique(run_labels, return_counts=True)
+    run_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+    if len(labels) > 0:
+        firsts = run_offsets[:-1]
+        rows = runs[:, 0]
+        cols = runs[:, 1].astype(np.int64)
+        bboxes = np.column_stack((np.minimum.reduceat(rows, firsts),
+                                  np.minimum.reduceat(cols, firsts),
+                                  np.maximum.reduceat(rows, firsts) + 1,
+                                  np.maximum.reduceat(cols + runs[:, 2], firsts))).astype(coord_dtype)
+    else:
+        bboxes = np.zeros((0, 4), dtype=coord_dtype)
+
+    return {'shape': np.array(label_img.shape, dtype=np.int64),
+            'labels': labels,
+            'bboxes': bboxes,
+            'run_offsets': run_offsets,
+            'runs': runs}
+
+
+def cell_index(masks, cell_label):
+    """Get the position of the cell with cell_label in masks. Raises KeyError if it isn't there."""
+    i = np.searchsorted(masks['labels'], cell_label)
+    if i >= len(masks['labels']) or masks['labels'][i] != cell_label:
+        raise KeyError('No cell with label {label}'.format(label=cell_label))
+    return i
+
+
+def decode_cell(masks, cell_label):
+    """Decode the mask of a single cell. Returns (boolean mask the size of its bounding box, bounding box)."""
+    i = cell_index(masks, cell_label)
+    bbox = tuple(int(x) for x in masks['bboxes'][i])
+    runs = masks['runs'][masks['run_offsets'][i]:masks['run_offsets'][i+1]].astype(np.int64)
+    mask = np.zeros((bbox[2] - bbox[0], bbox[3] - bbox[1]), dtype=bool)
+    fill_runs(mask, runs, bbox[0], bbox[1], True)
+    return mask, bbox
+
+
+def fill_runs(img, runs, row_offset, col_offset, values):
+    """Set the px covered by runs (shifted by the offsets) in img to values (scalar or 1 per run)"""
+    lengths = runs[:, 2]
+    total = int(lengths.sum())
+    if total == 0:
+        return
+
+    # Expand runs into flat px indices w/o a Python loop: px j of a run is at its start + j
+    run_starts = (runs[:, 0] - row_offset) * img.shape[1] + runs[:, 1] - col_offset
+    firsts = np.cumsum(lengths) - lengths
+    within = np.arange(total) - np.repeat(firsts, lengths)
+    flat = np.repeat(run_starts, lengths) + within
+    if not np.isscalar(values):
+        values = np.repeat(values, lengths)
+    img.ravel()[flat] = values
+
+
+def decode_frame(masks):
+    """Rebuild the whole label image"""
+    labels = masks['labels']
+    max_label = int(labels[-1]) if len(labels) > 0 else 0
+    label_img = np.zeros(tuple(masks['shape']), dtype=smallest_label_dtype(max_label))
+    run_labels = np.repeat(labels, np.diff(masks['run_offsets']))
+    fill_runs(label_img, masks['runs'].astype(np.int64), 0, 0, run_labels)
+    return label_img
+
+
+def rle_stats(masks):
+    """Get the label, area, and centroid of every cell straight from its runs, in the same format as the cell stats
+    from segmentation"""
+    runs = masks['runs'].astype(np.float64)
+    if len(runs) == 0:
+        return []
+    firsts = masks['run_offsets'][:-1]
+    rows, starts, lengths = runs[:, 0], runs[:, 1], runs[:, 2]
+
+    # The px of a run have the same row and their cols average to the middle of the run
+    area = np.add.reduceat(lengths, firsts)
+    centroid_row = np.add.reduceat(rows * lengths, firsts) / area
+    centroid_col = np.add.reduceat((starts + (lengths - 1) / 2) * lengths, firsts) / area
+
+    cells = []
+    for cell_label, cell_area, row, col in zip(masks['labels'].tolist(), area.tolist(),
+                                               centroid_row.tolist(), centroid_col.tolist()):
+        cells.append({'label': cell_label,
+                      'centroid': (row, col),
+                      'area': cell_area})
+    return cells
+
+
+def save_masks(filename, masks):
+    np.savez_compressed(filename, **masks)
+
+
+def load_masks(filename):
+    with np.load(filename) as data:
+        return {key: data[key] for key in data.files}
+
+
+class MaskStore:
+    """Directory of per-frame RLE masks, 1 <name>.npz per frame
+
+    Usage:
+        store = MaskStore(joinpath(output_dir, 'masks'))
+        store.write(name, label_img)
+        mask, bbox = decode_cell(store.read(name), cell_label)
+    """
+
+    def __init__(self, mask_dir):
+        self.mask_dir = mask_dir
+        if not os.path.exists(mask_dir):
+            os.makedirs(mask_dir)
+
+    def filename(self, name):
+        return joinpath(self.mask_dir, name + '.npz')
+
+    def write(self, name, label_img):
+        save_masks(self.filename(name), encode_labels(label_img))
+
+    def read(self, name):
+        return load_masks(self.filename(name))
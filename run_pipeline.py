@@ -3,14 +3,250 @@
 import argparse
 import os
 from os.path import join as joinpath
-import re
+from concurrent.futures import ProcessPoolExecutor
 
 import json
 from NumpyJSONEncoder import NumpyJSONEncoder
 
-from segment_cells import segment_basic
-from track_cells import track_cells_basic
-from image_loader import image_loader
+from segment_cells import segment_basic, ADAPTIVE_THRESHOLD
+from segment_test import segment_test, segment_multiscale, segment_components, ARTIFACT_FILTER, ADAPTIVE_LO_THRESHOLD
+from guided_segmentation import GuidedSegmenter
+from track_cells import track_cells_basic, link_cells_basic, track_cells_gated, link_cells_gated
+from gap_closing import close_gaps
+from lineage import detect_divisions, build_lineage
+from frame_index import FrameIndex, read_frame
+from image_loader import prefetch
+from rle_masks import MaskStore, decode_frame
+from pyramid_writer import PyramidWriter
+from journal import Journal
+from ndjson import write_results, NDJSONWriter
+from query_index import QueryIndex
+from profiling import start_profiling, stop_profiling, checkpoint
+from param_sweep import parse_param, check_params
+from shared_frames import segment_shared
+
+# Segmentation methods that process each frame independently
+SEGMENT_METHODS = {'basic': segment_basic,
+                   'watershed': segment_test,
+                   'multiscale': segment_multiscale,
+                   'components': segment_components}
+
+
+def process_colony(frames, output_dir, args):
+    """Segment and track the frames (in time order) of 1 colony and write the results to output_dir. Gets the parsed
+    command line args. Colonies are independent, so this can run in a worker process."""
+    save_figs = args.save_figs
+    input_dir = args.input
+    temp_dir = args.temp
+    method = args.method
+    save_masks = args.save_masks
+    tracker = args.tracker
+    max_displacement = args.max_displacement
+    max_gap = args.max_gap
+    divisions = args.divisions
+    artifact_filter = ARTIFACT_FILTER if args.artifact_filter else None
+    resume = args.resume
+    results_extension = '.ndjson' if args.ndjson else '.txt'
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    if args.profile_memory:
+        start_profiling()
+
+    if method == 'guided':
+        segmenter = GuidedSegmenter(full_sweep_every=args.full_sweep_every, artifact_filter=artifact_filter,
+                                    output_dir=output_dir, temp_dir=temp_dir, save_figs=save_figs)
+        prev_cells = []
+
+    if save_masks:
+        mask_store = MaskStore(joinpath(output_dir, 'masks'))
+
+    # Label images (and overlays) of every frame streamed into tiled pyramidal stacks
+    #   Rewritten from the 1st frame on every run. Frames segmented elsewhere (journaled, or in frame workers) are
+    #   decoded from their saved masks.
+    pyramids = []
+    if args.pyramid or args.pyramid_overlays:
+        pyramids.append(PyramidWriter(joinpath(output_dir, 'labels_pyramid.tif')))
+    if args.pyramid_overlays:
+        pyramids.append(PyramidWriter(joinpath(output_dir, 'overlays_pyramid.tif'), overlay=True))
+
+    # Each segmented frame is journaled as soon as it's done, so a crashed run can pick up where it stopped
+    journal = Journal(joinpath(output_dir, 'segmented_results.journal'), resume=resume)
+    if resume:
+        print('Resuming: %d of %d frames already segmented' % (sum(frame['name'] in journal.done for frame in frames),
+                                                               len(frames)))
+
+    if method != 'guided':
+        segment = SEGMENT_METHODS[method]
+        # The basic method doesn't have a watershed to pre-filter for
+        kwargs = {} if method == 'basic' else {'artifact_filter': artifact_filter}
+        if method == 'components':
+            kwargs['workers'] = args.segment_workers
+        if args.adaptive_window > 0:
+            defaults = ADAPTIVE_THRESHOLD if method == 'basic' else ADAPTIVE_LO_THRESHOLD
+            kwargs['adaptive'] = dict(defaults, window=args.adaptive_window, workers=args.segment_workers)
+        kwargs.update(args.segment_params)
+
+    # Frames segmented ahead in worker processes, handed over in shared memory. Picked up below in order.
+    todo = [frame for frame in frames if frame['name'] not in journal.done]
+    shared = None
+    if method != 'guided' and args.frame_workers > 1:
+        print('Segmenting frames with %d workers' % (args.frame_workers,))
+        shared = segment_shared(todo, input_dir, segment, args.frame_workers,
+                                mask_dir=mask_store.mask_dir if save_masks else None,
+                                output_dir=output_dir, temp_dir=temp_dir, save_figs=save_figs, **kwargs)
+    else:
+        # The next frames are decoded on a background thread while this one is segmented
+        images = prefetch(todo, lambda frame: read_frame(input_dir, frame), args.prefetch)
+
+    # Segmented results streamed into the final results file 1 frame at a time (NDJSON only)
+    #   Rewritten from the 1st frame on every run, journaled frames included, so it takes the place of compacting the
+    #   journal at the end
+    results_file = joinpath(output_dir, 'segmented_results' + results_extension)
+    results_writer = NDJSONWriter(results_file) if args.ndjson else None
+
+    # (Re-) segment images into cells
+    segmented_results = []
+    for frame in frames:
+        name = frame['name']
+        if name in journal.done:
+            cells = journal.done[name]['cells']
+            if method == 'guided':
+                segmenter.skip(prev_cells)
+                prev_cells = cells
+            add_result(segmented_results, results_writer, {'time': frame['time'], 'cells': cells})
+            write_pyramids(pyramids, name, lambda: decode_frame(mask_store.read(name)))
+            continue
+
+        if shared is not None:
+            _, cells = next(shared)  # its masks are already saved
+            print('Segmented image %s' % (name,))
+            write_pyramids(pyramids, name, lambda: decode_frame(mask_store.read(name)))
+            add_result(segmented_results, results_writer, {'time': frame['time'], 'cells': cells})
+            journal.append({'time': frame['time'], 'cells': cells, 'name': name})
+            continue
+
+        print('Processing image %s' % (name,))
+        checkpoint(name, 'Reading frame')
+        img = next(images)
+        if method == 'guided':
+            # Needs each frame tracked as soon as it's segmented
+            cells, label_img = segmenter.segment(img, name, prev_cells, return_labels=True)
+            if tracker == 'gated':
+                link_cells_gated(cells, prev_cells, max_displacement)
+            else:
+                link_cells_basic(cells, prev_cells)
+            prev_cells = cells
+        else:
+            cells, label_img = segment(img, name, output_dir=output_dir, temp_dir=temp_dir, save_figs=save_figs,
+                                       return_labels=True, **kwargs)
+
+        if save_masks:
+            checkpoint(name, 'Saving masks')
+            mask_store.write(name, label_img)
+
+        write_pyramids(pyramids, name, label_img)
+
+        stats = {'time': frame['time'], 'cells': cells}
+
+        add_result(segmented_results, results_writer, stats)
+        journal.append(dict(stats, name=name))  # after the masks, so a journaled frame has everything written
+
+    for pyramid in pyramids:
+        pyramid.close()
+
+    # Output segmented results
+    #   Compacts the journal into the final results file, unless it was already streamed
+    if results_writer is not None:
+        results_writer.close()
+    else:
+        log_step('Outputting segmented results in JSON format')
+        write_results(results_file, segmented_results)
+
+    # Track cells
+    log_step('Tracking cells')
+    if tracker == 'gated':
+        tracked_results = track_cells_gated(segmented_results, max_displacement)
+    else:
+        tracked_results = track_cells_basic(segmented_results)
+
+    # Before gap closing so daughters aren't mistaken for tracks that restarted after a gap
+    if divisions:
+        log_step('Detecting cell divisions')
+        tracked_results = detect_divisions(tracked_results, max_displacement=max_displacement)
+
+    if max_gap > 0:
+        log_step('Closing gaps in tracks')
+        tracked_results = close_gaps(tracked_results, max_gap=max_gap, max_displacement=max_displacement)
+
+    # Also sets the track id of every cell, so do before outputting tracked results
+    if divisions:
+        log_step('Building lineage')
+        lineage = build_lineage(tracked_results)
+
+    # Output tracked results
+    log_step('Outputting tracked results in JSON format')
+    write_results(joinpath(output_dir, 'tracked_results' + results_extension), tracked_results)
+
+    if args.query_index:
+        log_step('Building query index')
+        QueryIndex.from_frames(tracked_results).save(joinpath(output_dir, 'tracked_results_index.npz'))
+
+    if divisions:
+        log_step('Outputting lineage in JSON format')
+        lineage_file = joinpath(output_dir, 'lineage.txt')
+        with open(lineage_file, 'w') as f:
+            json.dump(lineage, f, cls=NumpyJSONEncoder, indent=4, sort_keys=True)
+
+    # Only needed until everything's written. Resuming a crash during tracking skips straight to tracking.
+    journal.remove()
+
+    if args.profile_memory:
+        profiler = stop_profiling()
+        print('Time and memory by step:')
+        profiler.report()
+        profiler.save(joinpath(output_dir, 'memory_profile.txt'))
+
+    return output_dir
+
+
+def add_result(segmented_results, writer, stats):
+    """Add stats of a segmented frame to segmented_results and, if writer, append it to the results file"""
+    segmented_results.append(stats)
+    if writer is not None:
+        writer.write(stats)
+
+
+def write_pyramids(pyramids, name, label_img):
+    """Append a frame's label image to each of pyramids. label_img is either the image or a function with no args that
+    returns it, which is only called if there are pyramids."""
+    if len(pyramids) == 0:
+        return
+    checkpoint(name, 'Writing pyramids')
+    if callable(label_img):
+        label_img = label_img()
+    for pyramid in pyramids:
+        pyramid.write(label_img)
+
+
+def log_step(message):
+    """Print progress message and start a new step for profiling (if on)"""
+    print(message)
+    checkpoint(None, message)
+
+
+def colony_output_dir(output_dir, colony):
+    if colony is None:
+        return joinpath(output_dir, 'no_colony')
+    return joinpath(output_dir, 'colony_%d' % (colony,))
+
+
+def colony_output_dirs(output_dir, colonies):
+    """Get dict of colony -> its output dir. Outputs go in a subdirectory per colony if there's more than 1."""
+    if len(colonies) == 1:
+        return {colony: output_dir for colony in colonies}
+    return {colony: colony_output_dir(output_dir, colony) for colony in colonies}
 
 
 if __name__ == "__main__":
@@ -19,13 +255,83 @@ if __name__ == "__main__":
     parser.add_argument('-i', '--input', help='Input images directory', required=False, default='images')
     parser.add_argument('-o','--output',  help='Output directory', required=False, default='output')
     parser.add_argument('-t','--temp',  help='Temporary directory for intermediates', required=False, default='temp')
+    parser.add_argument('--start', help='Only process frames at or after this time', required=False, type=int, default=None)
+    parser.add_argument('--stop', help='Only process frames at or before this time', required=False, type=int, default=None)
+    parser.add_argument('-m', '--method', help='Segmentation method. guided only segments near the previous frame\'s tracked cells.',
+                        required=False, choices=sorted(SEGMENT_METHODS) + ['guided'], default='basic')
+    parser.add_argument('--adaptive-window', help='Basic and watershed methods only: threshold each px against the mean and std of a window this many px wide around it instead of a global threshold. 0 for the global threshold.',
+                        required=False, type=int, default=0)
+    parser.add_argument('--artifact-filter', help='Include this flag to remove obvious artifacts (small, marker-less, or ring-shaped regions) before the watershed. Faster, but changes the cells found.',
+                        action='store_true')
+    parser.add_argument('--save-masks', help='Include this flag to save run-length encoded masks of every cell to the masks/ subdirectory of the output directory',
+                        action='store_true')
+    parser.add_argument('--full-sweep-every', help='For guided segmentation, segment the whole frame every this many frames (at least 1) to find new cells',
+                        required=False, type=int, default=10)
+    parser.add_argument('--tracker', help='Cell tracking method. gated only links cells that moved at most --max-displacement px and starts new tracks for the rest.',
+                        required=False, choices=['basic', 'gated'], default='basic')
+    parser.add_argument('--max-displacement', help='Max distance in px a cell can move between frames for the gated tracker',
+                        required=False, type=float, default=50.0)
+    parser.add_argument('--divisions', help='Include this flag to detect cell divisions and output the lineage tree. Needs --tracker gated.',
+                        action='store_true')
+    parser.add_argument('--max-gap', help='Link tracks across up to this many frames where a cell was missed. 0 to turn off.',
+                        required=False, type=int, default=0)
+    parser.add_argument('--pyramid', help='Include this flag to stream the label image of every frame into labels_pyramid.tif in the output directory, a tiled BigTIFF stack w/ reduced resolution levels for viewers to zoom and scrub through. With --frame-workers or --resume, needs --save-masks.',
+                        action='store_true')
+    parser.add_argument('--pyramid-overlays', help='Include this flag to also stream colour overlays of the labels into overlays_pyramid.tif (implies --pyramid)',
+                        action='store_true')
+    parser.add_argument('--ndjson', help='Include this flag to write results as newline-delimited JSON (1 frame per line, .ndjson) instead of 1 big JSON document (.txt)',
+                        action='store_true')
+    parser.add_argument('--query-index', help='Include this flag to save an index of the tracked cells for fast region, time range, and nearest neighbour queries to tracked_results_index.npz in the output directory',
+                        action='store_true')
+    parser.add_argument('--resume', help='Include this flag to pick up a run that stopped part way. Frames already segmented (listed in segmented_results.journal in the output directory) are skipped.',
+                        action='store_true')
+    parser.add_argument('--profile-memory', help='Include this flag to record the time, peak traced (tracemalloc, including NumPy arrays) memory, and peak RSS of every step of every frame. Prints a summary that flags the step with the largest footprint and saves the details to memory_profile.txt in the output directory.',
+                        action='store_true')
+    parser.add_argument('--param', help='Set a segmentation parameter of the basic (threshold, region_area_cutoff) or watershed (lo_threshold, hi_threshold, object_size) method, like --param lo_threshold=60. Can be repeated. Use param_sweep.py to try a grid of values.',
+                        action='append', default=[])
+    parser.add_argument('-w', '--workers', help='Number of colonies to process in parallel', required=False, type=int, default=1)
+    parser.add_argument('--frame-workers', help='Number of frames of a colony segmented in parallel in separate processes. Frames are decoded into a fixed ring of shared memory slots (2 per worker) instead of being copied to the workers. Not for --method guided.',
+                        required=False, type=int, default=1)
+    parser.add_argument('--prefetch', help='Number of frames to decode ahead on a background thread while the current one is segmented. Each one holds another frame in memory. 0 to turn off.',
+                        required=False, type=int, default=0)
+    parser.add_argument('--segment-workers', help='Number of threads segmenting candidate regions of a frame in parallel for --method components, or computing adaptive thresholds',
+                        required=False, type=int, default=1)
 
     args = parser.parse_args()
+    if args.full_sweep_every < 1:
+        parser.error('--full-sweep-every must be at least 1')
+    # Divisions are only looked for among cells that started new tracks, which the basic tracker never makes
+    if args.divisions and args.tracker != 'gated':
+        parser.error('--divisions needs --tracker gated')
+    # Only the basic and watershed methods threshold the whole frame at once
+    if args.adaptive_window > 0 and args.method not in ('basic', 'watershed'):
+        parser.error('--adaptive-window only works with --method basic or watershed')
 
-    save_figs = args.save_figs
     input_dir = args.input
     output_dir = args.output
     temp_dir = args.temp
+    start = args.start
+    stop = args.stop
+    workers = args.workers
+
+    # Segmentation parameters, checked before anything runs
+    args.segment_params = {}
+    for text in args.param:
+        name, values = parse_param(text)
+        if len(values) != 1:
+            raise ValueError('--param takes 1 value, got %s. Use param_sweep.py to try several.' % (text,))
+        args.segment_params[name] = values[0]
+    if len(args.segment_params) > 0:
+        check_params(args.method, args.segment_params)
+    # The adaptive threshold map replaces the global threshold, so a value set for it would be silently dropped
+    overridden = sorted({'threshold', 'lo_threshold'} & set(args.segment_params))
+    if args.adaptive_window > 0 and len(overridden) > 0:
+        parser.error('--param %s is replaced by --adaptive-window. Set the adaptive map\'s bounds in %s instead.' % (
+            overridden[0], 'ADAPTIVE_THRESHOLD' if args.method == 'basic' else 'ADAPTIVE_LO_THRESHOLD'))
+
+    # Label images of frames not segmented in this process are read back from their masks
+    if (args.pyramid or args.pyramid_overlays) and (args.frame_workers > 1 or args.resume) and not args.save_masks:
+        raise ValueError('--pyramid with --frame-workers or --resume needs --save-masks')
 
     if os.path.exists(output_dir):
         print('Warning: Directory %s already exists. Outputs with the same name will overwrite existing files.'%(output_dir,))
@@ -37,33 +343,24 @@ if __name__ == "__main__":
     else:
         os.makedirs(temp_dir)
 
-    # (Re-) segment images into cells
-    segmented_results = []
-    for img, name in image_loader(input_dir):
-        print('Processing image %s' % (name,))
-        cells = segment_basic(img, name, output_dir=output_dir, temp_dir=temp_dir, save_figs=save_figs)
+    # Index frames so they're processed in time order
+    #   Only new/modified files are opened when the index already exists
+    index = FrameIndex(input_dir)
 
-        tokens = re.findall('.+Time(\d+)', name)
-        time = int(tokens[0])  # hopefully this works...
+    # Colonies are segmented and tracked independently, so cells are never linked across colonies
+    #   Outputs go in a subdirectory per colony if there's more than 1
+    colonies = index.frames_by_colony(start=start, stop=stop)
+    output_dirs = colony_output_dirs(output_dir, colonies)
 
-        stats = {'time': time, 'cells': cells}
-
-        segmented_results.append(stats)
-
-    # Output segmented results
-    print('Outputting segmented results in JSON format')
-    segmented_results_file = joinpath(output_dir, 'segmented_results.txt')
-    with open(segmented_results_file, 'w') as f:
-        json.dump(segmented_results, f, cls=NumpyJSONEncoder, indent=4, sort_keys=True)
-
-    # Track cells
-    print('Tracking cells')
-    tracked_results = track_cells_basic(segmented_results)
-
-    # Output tracked results
-    print('Outputting tracked results in JSON format')
-    tracked_results_file = joinpath(output_dir, 'tracked_results.txt')
-    with open(tracked_results_file, 'w') as f:
-        json.dump(tracked_results, f, cls=NumpyJSONEncoder, indent=4, sort_keys=True)
+    if workers > 1 and len(colonies) > 1:
+        print('Processing %d colonies with %d workers' % (len(colonies), workers))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(process_colony, frames, output_dirs[colony], args)
+                       for colony, frames in colonies.items()]
+            for future in futures:
+                print('Finished colony in %s' % (future.result(),))
+    else:
+        for colony, frames in colonies.items():
+            process_colony(frames, output_dirs[colony], args)
 
     print('done.')
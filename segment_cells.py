@@ -16,43 +16,58 @@ from skimage.color import label2rgb
 
 import matplotlib.pyplot as plt
 
-import tifffile as tiff
-
 import re
 import json
 from NumpyJSONEncoder import NumpyJSONEncoder
 
 from image_loader import image_loader
+from diagnostics import Diagnostics, imsave
+from labels import compact_labels
+from adaptive_threshold import threshold_map
+
+# Starting point for adaptive thresholding in segment_basic. Kept near the global threshold, which is known to keep
+#   cells connected, but follows the local contrast in between.
+ADAPTIVE_THRESHOLD = {'window': 201, 'method': 'niblack', 'k': 2.0, 'min_threshold': 15, 'max_threshold': 40}
+
+THRESHOLD = 20  # setting > 20 breaks connectivity
+REGION_AREA_CUTOFF = 10  # px
 
 
-def segment_basic(img, name, output_dir='output', temp_dir='temp', save_figs=False):
-    """Segment most preprocessed image and return basic stats for detected regions/cells"""
+def crop_frame(img):
+    """Crop the stitched frame to the region with cells"""
+    lx, ly, lz = img.shape
+    return img[900:lx-100, 900:ly-400, :]  # Debugging: replace this later with user-specified bounds
+
 
-    step = 1 # Counter variable for step to make sure all intermediate outputs are in order
+def segment_basic(img, name, output_dir='output', temp_dir='temp', save_figs=False, outputs=None, return_labels=False,
+                  adaptive=None, threshold=THRESHOLD, region_area_cutoff=REGION_AREA_CUTOFF):
+    """Segment most preprocessed image and return basic stats for detected regions/cells. If return_labels, returns
+    (cells, label image) instead. adaptive is a dict of args for adaptive_threshold.threshold_map (like
+    ADAPTIVE_THRESHOLD) to threshold each px against its neighbourhood instead of the global threshold. Regions of
+    area <= region_area_cutoff px are dropped as noise.
 
-    if save_figs:
-        tiff.imsave(joinpath(temp_dir, ''.join([name, '_', str(step),  '_orig.tif'])), img)
+    Intermediate images are only rendered if they'll be saved: all of them if save_figs, otherwise only the ones whose
+    suffixes are in outputs (e.g. ['labeled_overlay'])."""
+
+    # Keeps the step counter to make sure all intermediate outputs are in order
+    diag = Diagnostics(name, temp_dir, save_figs=save_figs, outputs=outputs, step=1, writer=imsave)
+
+    diag.save('orig', img)
 
     # Cropping image will make everything after this faster
     #   Make sure this is appropriate for every frame
-    print("Cropping...")
-    step += 1
-    lx, ly, lz = img.shape
-    mask = np.zeros((lx, ly))
-    img = img[900:lx-100, 900:ly-400, :] # Debugging: replace this later with user-specified bounds
+    diag.next_step("Cropping...")
+    img = crop_frame(img)
 
-    if save_figs:
-        # also save original image with box showing kept region
-        tiff.imsave(joinpath(temp_dir, ''.join([name, '_', str(step),  '_cropped.tif'])), img)
+    # also save original image with box showing kept region
+    diag.save('cropped', img)
 
     # Convert RGB image to greyscale and convert back to 8-bit uint
     # Ignore precision loss warning
-    print("Converting to greyscale...")
-    step += 1
+    diag.next_step("Converting to greyscale...")
     img = img_as_ubyte(rgb2gray(img))
 
-    if save_figs:
-        tiff.imsave(joinpath(temp_dir, ''.join([name, '_', str(step),  '_greyscale.tif'])), img)
+    diag.save('greyscale', img)
 
     # Threshold using custom threshold
     #   There's artifacts in the images (should fix the image segmentation output so this doesn't happen) which need to be fixed.
@@ -61,13 +76,16 @@ def segment_basic(img, name, output_dir='output', temp_dir='temp', save_figs=Fal
     #   Also need to be careful not to join together cells that are close together - such as right after division
     #       This seemed to do OK on the examples, though
     # Alternatively use adaptive thresholding
-    print('Thresholding...')
-    step += 1
-    THRESHOLD = 20  # setting > 20 breaks connectivity
-    img = img_as_ubyte(img > THRESHOLD)
+    diag.next_step('Thresholding...')
+    if adaptive is None:
+        img = img > threshold
+    else:
+        threshold = threshold_map(img, **adaptive)
+        diag.save('threshold_map', lambda: np.clip(threshold, 0, 255).astype(np.uint8))
+        img = img > threshold
+        del threshold
 
-    if save_figs:
-        tiff.imsave(joinpath(temp_dir, ''.join([name, '_', str(step),  '_thresholded.tif'])), img)
+    diag.save('thresholded', lambda: img_as_ubyte(img))
 
     # Label regions
     #   http://scikit-image.org/docs/dev/auto_examples/plot_label.html
@@ -77,40 +95,34 @@ def segment_basic(img, name, output_dir='output', temp_dir='temp', save_figs=Fal
     #   http://scikit-image.org/docs/dev/auto_examples/segmentation/plot_watershed.html#example-segmentation-plot-watershed-py
     # http://cmm.ensmp.fr/~beucher/wtshed.html
     # Note/TODO: Will probably need watershed and more fancy methods for the real segmentation
-    print("Labeling regions...")
-    step += 1
+    diag.next_step("Labeling regions...")
 
     label_img, n_labels = label(img, connectivity=2, return_num=True)
+    label_img = compact_labels(label_img, n_labels)
     regions = regionprops(label_img)
 
     # Keep the labeled regions bigger than some cutoff area
     #   The larger regions are cells, the smaller regions are noise
-    REGION_AREA_CUTOFF = 10  # px
     kept_regions = []
     kept_labels = []
     for region in regions:
-        if region.area > REGION_AREA_CUTOFF:
+        if region.area > region_area_cutoff:
             kept_regions.append(region)
             kept_labels.append(region.label)
 
     # label_img_cleaned = label_img
     label_img[np.in1d(label_img, kept_labels, invert=True).reshape(label_img.shape)] = 0  # Make a mask of all positions not in kept_labels
     label_img, _, _ = relabel_sequential(label_img)
+    label_img = compact_labels(label_img, len(kept_labels))
 
     regions = regionprops(label_img)
 
     # Get image with only the cells
-    img = img_as_ubyte(label_img > 0)
+    diag.save('labeled', lambda: img_as_ubyte(label_img > 0))
 
     # Display regions with unique colors
-    label_img_overlay = label2rgb(label_img, image=img)
-
-    if save_figs:
-        tiff.imsave(joinpath(temp_dir, ''.join([name, '_', str(step), '_labeled.tif'])),
-                    img_as_ubyte(img))
-        tiff.imsave(joinpath(temp_dir, ''.join([name, '_', str(step), '_labeled_overlay.tif'])),
-                    img_as_ubyte(label_img_overlay))
-        # TODO: output additional fig with number of region overlaid - use matplotlib or similar
+    diag.save('labeled_overlay', lambda: img_as_ubyte(label2rgb(label_img, image=img_as_ubyte(label_img > 0))))
+    # TODO: output additional fig with number of region overlaid - use matplotlib or similar
 
     # Return just the minimum stats needed for cell tracking
     cells = []
@@ -120,6 +132,8 @@ def segment_basic(img, name, output_dir='output', temp_dir='temp', save_figs=Fal
                 'area': region.area}
         cells.append(cell)
 
+    if return_labels:
+        return cells, label_img
     return cells
 
 
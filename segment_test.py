@@ -24,11 +24,10 @@
 
 import os
 from os.path import join as joinpath
-
-from save_tiff import save_tiff
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-from scipy.ndimage import binary_fill_holes
+from scipy.ndimage import binary_fill_holes, find_objects
 
 from skimage.util import img_as_ubyte
 from skimage.color import rgb2gray
@@ -48,33 +47,130 @@ import json
 from NumpyJSONEncoder import NumpyJSONEncoder
 
 from image_loader import image_loader
-
-
-def segment_test(img, name, output_dir='output', temp_dir='temp', save_figs=False):
-    """Test segmentation on harder images from earlier in the pipeline."""
-
-    step = 0 # Counter variable for step to make sure all intermediate outputs are in order
+from diagnostics import Diagnostics
+from labels import compact_labels, paste_labels, fill_label_holes
+from bounding_boxes import slices_box, box_slices, scale_box, pad_box, merge_boxes
+from region_features import region_features
+from adaptive_threshold import threshold_map
+
+
+# Segmentation parameters
+MARKER_LO_THRESHOLD = 65  # sensitive/fine-tuned
+# MARKER_LO_THRESHOLD = threshold_otsu(img)  # this may work but general sets the threshold too high
+MARKER_HI_THRESHOLD = 150  # sensitive/fine-tuned
+OBJECT_SIZE_THRESHOLD = 1000
+
+# Starting point for an adaptive MARKER_LO_THRESHOLD, for panels that differ in contrast. The window is a few cells wide.
+ADAPTIVE_LO_THRESHOLD = {'window': 401, 'method': 'niblack', 'k': 1.0,
+                         'min_threshold': MARKER_LO_THRESHOLD // 2, 'max_threshold': MARKER_HI_THRESHOLD}
+
+# Artifact pre-filter thresholds, applied to connected candidate regions before the watershed. Set any to None to skip
+#   that test. The pre-filter is off by default (artifact_filter=None) - pass artifact_filter=ARTIFACT_FILTER to turn it
+#   on. It changes the cells found: the ring test also drops real cells with a dim middle, and even removing regions
+#   that can't be cells changes which of the px at the same elevation the watershed floods first elsewhere in the frame.
+#   min_area: candidate regions smaller than this can't give a cell that survives remove_small_objects
+#   require_marker: candidate regions w/o any cell (> MARKER_HI_THRESHOLD) px get flooded from the background anyway
+#   min_mean_intensity: dim regions. Off by default.
+#   max_ring_fill_ratio, min_ring_circularity: the ring artifacts - round (4*pi*area/perimeter^2 of the region with its
+#       holes filled is high) and hollow (fraction of the filled region that's actually candidate px is low)
+ARTIFACT_FILTER = {'min_area': OBJECT_SIZE_THRESHOLD,
+                   'require_marker': True,
+                   'min_mean_intensity': None,
+                   'max_ring_fill_ratio': 0.8,
+                   'min_ring_circularity': 0.8}
+
+
+def preprocess(img, diag):
+    """Rescale intensity and convert to greyscale"""
 
     # PIL can't work with 16-bit TIFF images
     # if save_figs:
     #     tiff.imsave(joinpath(temp_dir, ''.join([name, '_', str(step),  '_orig.tif'])), img)
 
     # Everything appears as black in the initial image - it was just rescaled to
-    print("Rescaling intensity...")
-    step += 1
+    diag.next_step("Rescaling intensity...")
     img = img_as_ubyte(rescale_intensity(img))
 
-    if save_figs:
-        save_tiff(joinpath(temp_dir, ''.join([name, '_', str(step),  '_rescaled.tif'])), img)
+    diag.save('rescaled', img)
 
     # Convert RGB image to greyscale and convert back to 8-bit uint
     # Ignore precision loss warning
-    print("Converting to greyscale...")
-    step += 1
+    diag.next_step("Converting to greyscale...")
     img = rgb2gray(img)
 
-    if save_figs:
-        save_tiff(joinpath(temp_dir, ''.join([name, '_', str(step),  '_greyscale.tif'])), img)
+    diag.save('greyscale', img)
+
+    return img
+
+
+def filter_artifacts(img, candidate_regions, markers, artifact_filter):
+    """Score connected candidate regions on cheap features and remove the obvious artifacts (see ARTIFACT_FILTER) by
+    turning them into background in candidate_regions and markers, in place. Returns number of regions removed."""
+    region_labels, n_regions = label(candidate_regions > 0, connectivity=2, return_num=True)
+    if n_regions == 0:
+        return 0
+    area = np.bincount(region_labels.ravel(), minlength=n_regions + 1)[1:]
+
+    # Features of the regions with their holes filled. Labels are sequential, so feature i is region i + 1.
+    region_labels = fill_label_holes(region_labels)
+    features = region_features(region_labels, img, convex=False)
+    fill_ratio = area / features['area']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        circularity = np.where(features['perimeter'] > 0, 4 * np.pi * features['area'] / features['perimeter']**2, 0)
+
+    remove = np.zeros(n_regions, dtype=bool)
+    if artifact_filter.get('min_area') is not None:
+        remove |= area < artifact_filter['min_area']
+    if artifact_filter.get('require_marker'):
+        remove |= np.bincount(region_labels[markers == 2], minlength=n_regions + 1)[1:] == 0
+    if artifact_filter.get('min_mean_intensity') is not None:
+        remove |= features['mean_intensity'] < artifact_filter['min_mean_intensity']
+    if artifact_filter.get('max_ring_fill_ratio') is not None and artifact_filter.get('min_ring_circularity') is not None:
+        remove |= ((fill_ratio < artifact_filter['max_ring_fill_ratio']) &
+                   (circularity > artifact_filter['min_ring_circularity']))
+
+    removed = np.concatenate(([False], remove))[region_labels]
+    candidate_regions[removed] = 0
+    markers[removed] = 1
+    return int(remove.sum())
+
+
+def cap_min_area(artifact_filter, object_size):
+    """artifact_filter with min_area lowered to object_size if needed, so the pre-filter never removes a region that
+    could give a cell that survives remove_small_objects"""
+    if artifact_filter is None or artifact_filter.get('min_area') is None or artifact_filter['min_area'] <= object_size:
+        return artifact_filter
+    return dict(artifact_filter, min_area=object_size)
+
+
+def get_markers(img, lo_threshold=MARKER_LO_THRESHOLD, hi_threshold=MARKER_HI_THRESHOLD):
+    """Watershed markers: 1 (background) below lo_threshold, 2 (cell) above hi_threshold, 0 (unknown) in between"""
+    markers = np.zeros(img.shape, dtype=np.uint8)
+    markers[img < lo_threshold] = 1
+    markers[img > hi_threshold] = 2
+    return markers
+
+
+def get_candidate_regions(img, lo_threshold=MARKER_LO_THRESHOLD):
+    """uint8 image that's 255 in the regions that may be cells (above lo_threshold), 0 elsewhere"""
+    candidate_regions = np.zeros(img.shape, dtype=np.uint8)
+    candidate_regions[img > lo_threshold] = 255
+    return candidate_regions
+
+
+def segment_regions(img, diag, artifact_filter=None, lo_threshold=MARKER_LO_THRESHOLD,
+                    hi_threshold=MARKER_HI_THRESHOLD, object_size=OBJECT_SIZE_THRESHOLD):
+    """Watershed segmentation of preprocessed greyscale img. Returns boolean image of cells.
+    Works the same on a crop as long as it has some background around the cells in it.
+
+    Args:
+        artifact_filter (dict): Thresholds for removing obvious artifacts before the watershed, like ARTIFACT_FILTER.
+            None (default) for no pre-filter.
+        lo_threshold (float or array): Threshold between background and candidate regions. Either a number or an
+            image of thresholds the same size as img (e.g. from adaptive_threshold.threshold_map).
+        hi_threshold (float): Px above this are markers of cells
+        object_size (int): Cells smaller than this many px are removed
+    """
 
     # # Basic thresholding for segmentation
     # #   This probably doesn't work well enough because of:
@@ -99,22 +195,15 @@ def segment_test(img, name, output_dir='output', temp_dir='temp', save_figs=Fals
     #           may include a cell and apply Sobel to that. It's sharper but requires tuning.
     #   - Watershed starts from the markers and fills to the edges. This basically gives you a 2-step thresholding
     #       technique. It seems like it takes care of artifacts well. Some brighter artifacts may still remain, though.
-    print('Region-based segmenting')
-    step += 1
+    diag.next_step('Region-based segmenting')
 
     # Get centers
     #   Ideally, white regions are inside cells and no white regions are inside artifacts
     #   This should work well because the cells are "brighter" than the artifacts
-    print('Getting makers')
-    markers = np.zeros_like(img)
-    MARKER_LO_THRESHOLD = 65  # sensitive/fine-tuned
-    # MARKER_LO_THRESHOLD = threshold_otsu(img)  # this may work but general sets the threshold too high
-    MARKER_HI_THRESHOLD = 150  # sensitive/fine-tuned
-    markers[img < MARKER_LO_THRESHOLD] = 1
-    markers[img > MARKER_HI_THRESHOLD] = 2
+    diag.log('Getting makers')
+    markers = get_markers(img, lo_threshold, hi_threshold)
 
-    if save_figs:
-        save_tiff(joinpath(temp_dir, ''.join([name, '_', str(step), '_markers.tif'])), img_as_ubyte(rescale_intensity(markers)))
+    diag.save('markers', lambda: img_as_ubyte(rescale_intensity(markers)))
 
     # # Get edges
     # print('Getting edges using gradient methods')
@@ -126,25 +215,28 @@ def segment_test(img, name, output_dir='output', temp_dir='temp', save_figs=Fals
     #     tiff.imsave(joinpath(temp_dir, ''.join([name, '_', str(step), '_elevation_map.tif'])), img_as_ubyte(elevation_map))
 
     # Much more aggressive than direct gradient finding on image
-    print('Getting candidate regions (regions that may be cells)')
-    candidate_regions = np.zeros_like(img)
-    candidate_regions[img > MARKER_LO_THRESHOLD] = 1
-    candidate_regions = rescale_intensity(candidate_regions)
-    if save_figs:
-        save_tiff(joinpath(temp_dir, ''.join([name, '_', str(step), '_candidate_regions.tif'])), rescale_intensity(candidate_regions))
-
-    print('Getting edges of candidate regions')
+    diag.log('Getting candidate regions (regions that may be cells)')
+    candidate_regions = get_candidate_regions(img, lo_threshold)
+    diag.save('candidate_regions', candidate_regions)
+
+    # Cheap pre-filter so the watershed doesn't have to flood artifacts
+    if artifact_filter is not None:
+        n_removed = filter_artifacts(img, candidate_regions, markers, cap_min_area(artifact_filter, object_size))
+        diag.log('Removed %d artifact regions' % (n_removed,))
+        diag.save('artifacts_removed', candidate_regions)
+
+    diag.log('Getting edges of candidate regions')
     elevation_map = sobel(candidate_regions)
-    if save_figs:
-        save_tiff(joinpath(temp_dir, ''.join([name, '_', str(step), '_elevation_map.tif'])), img_as_ubyte(elevation_map))
+    diag.save('elevation_map', lambda: img_as_ubyte(elevation_map))
 
     # Do watershed transform
     #   Warning: expensive
-    print('Doing watershed')
-    img = rescale_intensity(watershed(elevation_map, markers))
+    #   Cells are the pixels flooded from the cell (2) markers. Compare directly instead of rescaling the labels so a
+    #   crop with only 1 kind of marker still works.
+    diag.log('Doing watershed')
+    img = watershed(elevation_map, markers) == 2
 
-    if save_figs:
-        save_tiff(joinpath(temp_dir, ''.join([name, '_', str(step), '_watershed.tif'])), img)
+    diag.save('watershed', lambda: img_as_ubyte(img))
 
     # Split close cells
     #   This step is sensitive/fine-tuned
@@ -161,61 +253,249 @@ def segment_test(img, name, output_dir='output', temp_dir='temp', save_figs=Fals
     #     tiff.imsave(joinpath(temp_dir, ''.join([name, '_', str(step), '_split.tif'])), img)
 
     # Remove small artifacts
-    print("Removing small objects...")
-    step += 1
-    OBJECT_SIZE_THRESHOLD = 1000
-    img = img_as_ubyte(remove_small_objects(img > 100, min_size=OBJECT_SIZE_THRESHOLD))  # run remove_small_objects on a boolean matrix
+    diag.next_step("Removing small objects...")
+    img = remove_small_objects(img, min_size=object_size)  # run remove_small_objects on a boolean matrix
 
-    if save_figs:
-        save_tiff(joinpath(temp_dir, ''.join([name, '_', str(step),  '_small_objects_removed.tif'])), img)
+    diag.save('small_objects_removed', lambda: img_as_ubyte(img))
 
     # Fill small holes
-    print("Filling small holes")
-    step += 1
-    img = img_as_ubyte(binary_fill_holes(img))
+    diag.next_step("Filling small holes")
+    img = binary_fill_holes(img)
 
-    if save_figs:
-        save_tiff(joinpath(temp_dir, ''.join([name, '_', str(step),  '_holes_filled.tif'])), img)
+    diag.save('holes_filled', lambda: img_as_ubyte(img))
 
-    # Label regions
-    print("Labeling regions...")
-    step += 1
+    return img
 
-    label_img, n_labels = label(img, connectivity=2, return_num=True)
-    regions = regionprops(label_img)
+
+def save_label_outputs(label_img, diag):
+    """Save (lazily rendered) images of the final labeled cells"""
 
     # Get image with only the cells
-    img = img_as_ubyte(label_img > 0)
+    diag.save('labeled', lambda: img_as_ubyte(label_img > 0))
 
     # Display regions with unique colors
-    label_img_overlay = label2rgb(label_img, image=img)
-    label_img_overlay = img_as_ubyte(label_img_overlay)
-    label_img_overlay[img < 1] = 0  # make background black
-
-    if save_figs:
-        save_tiff(joinpath(temp_dir, ''.join([name, '_', str(step), '_labeled.tif'])),
-                    img_as_ubyte(img))
-        save_tiff(joinpath(temp_dir, ''.join([name, '_', str(step), '_labeled_overlay.tif'])),
-                    label_img_overlay)
-
-    # DEBUG: still output final result when not saving figs
-    if not save_figs:
-        save_tiff(joinpath(temp_dir, ''.join([name, '_', str(step), '_segmented.tif'])),
-                    img_as_ubyte(label_img_overlay))
-
-    # Return just the minimum stats needed for cell tracking
+    def render_overlay():
+        cells_img = img_as_ubyte(label_img > 0)
+        label_img_overlay = img_as_ubyte(label2rgb(label_img, image=cells_img))
+        label_img_overlay[cells_img < 1] = 0  # make background black
+        return label_img_overlay
+
+    diag.save('labeled_overlay', render_overlay)
+
+    # DEBUG: output final result when not saving figs if asked for with outputs=['segmented']
+    if not diag.save_figs:
+        diag.save('segmented', render_overlay)
+
+
+def cell_stats(label_img):
+    """Return just the minimum stats needed for cell tracking"""
     cells = []
-    for region in regions:
+    for region in regionprops(label_img):
         cell = {'label': region.label,
                 'centroid': region.centroid,
                 'area': region.area}
         cells.append(cell)
-
     return cells
 
 
+def segment_test(img, name, output_dir='output', temp_dir='temp', save_figs=False, outputs=None, return_labels=False,
+                 artifact_filter=None, adaptive=None, lo_threshold=MARKER_LO_THRESHOLD,
+                 hi_threshold=MARKER_HI_THRESHOLD, object_size=OBJECT_SIZE_THRESHOLD):
+    """Test segmentation on harder images from earlier in the pipeline. If return_labels, returns (cells, label image)
+    instead of just the cells. artifact_filter, lo_threshold, hi_threshold, and object_size are passed to
+    segment_regions. adaptive is a dict of args for adaptive_threshold.threshold_map (like ADAPTIVE_LO_THRESHOLD) to use
+    a local threshold instead of lo_threshold.
+
+    Intermediate images are only rendered if they'll be saved: all of them if save_figs, otherwise only the ones whose
+    suffixes are in outputs (e.g. ['segmented'] for the final overlay)."""
+
+    # Keeps the step counter to make sure all intermediate outputs are in order
+    diag = Diagnostics(name, temp_dir, save_figs=save_figs, outputs=outputs)
+
+    img = preprocess(img, diag)
+
+    if adaptive is not None:
+        diag.next_step('Getting adaptive thresholds...')
+        lo_threshold = threshold_map(img, **adaptive)
+        diag.save('lo_threshold', lambda: np.clip(lo_threshold, 0, 255).astype(np.uint8))
+
+    img = segment_regions(img, diag, artifact_filter, lo_threshold, hi_threshold, object_size)
+    del lo_threshold
+
+    # Label regions
+    diag.next_step("Labeling regions...")
+
+    label_img, n_labels = label(img, connectivity=2, return_num=True)
+    label_img = compact_labels(label_img, n_labels)
+
+    save_label_outputs(label_img, diag)
+
+    if return_labels:
+        return cell_stats(label_img), label_img
+    return cell_stats(label_img)
+
+
+def downsample_max(img, factor):
+    """Downsample img by an integer factor, keeping the max of each factor x factor block. Keeps small bright features
+    that averaging would wash out. Edge blocks may be smaller - no padded copy of the image is made."""
+    rows = np.arange(0, img.shape[0], factor)
+    cols = np.arange(0, img.shape[1], factor)
+    return np.maximum.reduceat(np.maximum.reduceat(img, rows, axis=0), cols, axis=1)
+
+
+def find_candidate_boxes(img, downscale, pad):
+    """Find boxes in preprocessed greyscale img that may contain cells using a downsampled copy of it.
+    Returns non-overlapping full scale boxes padded by pad px."""
+    coarse = downsample_max(img, downscale)
+
+    # Every full scale candidate pixel (> MARKER_LO_THRESHOLD) is in a coarse candidate block, and connected pixels are
+    #   in connected blocks, so each full scale candidate region is entirely inside 1 coarse region
+    coarse_labels, n_coarse = label(coarse > MARKER_LO_THRESHOLD, connectivity=2, return_num=True)
+
+    # Regions w/o any cell markers get flooded from the background markers by the watershed, and regions smaller than
+    #   the object size cutoff (even counting every px of every block) get removed afterwards, so skip both
+    has_marker = np.zeros(n_coarse + 1, dtype=bool)
+    has_marker[coarse_labels[coarse > MARKER_HI_THRESHOLD]] = True
+    max_area = np.bincount(coarse_labels.ravel(), minlength=n_coarse + 1) * downscale**2
+    keep = has_marker & (max_area >= OBJECT_SIZE_THRESHOLD)
+    keep[0] = False
+
+    boxes = []
+    for i, slices in enumerate(find_objects(coarse_labels), 1):
+        if slices is None or not keep[i]:
+            continue
+        box = scale_box(slices_box(slices), downscale)
+        boxes.append(pad_box(box, pad, img.shape))
+
+    # Padding can make boxes overlap. Merge them so no cell gets segmented twice.
+    return merge_boxes(boxes)
+
+
+def segment_multiscale(img, name, output_dir='output', temp_dir='temp', save_figs=False, outputs=None,
+                       return_labels=False, downscale=8, pad=16, artifact_filter=None):
+    """Coarse-to-fine version of segment_test. Finds boxes that may contain cells on a downsampled image and only runs
+    the expensive watershed and cleanup at full resolution inside them. Gives the same cells as segment_test, but is
+    much faster on frames that are mostly background.
+
+    Args:
+        downscale (int): Downsampling factor for finding candidate regions
+        pad (int): px of background kept around each candidate region. Needs to be enough for the edge finding and
+            watershed to see the region's boundary.
+        artifact_filter (dict): Passed to segment_regions
+    """
+
+    # Keeps the step counter to make sure all intermediate outputs are in order
+    diag = Diagnostics(name, temp_dir, save_figs=save_figs, outputs=outputs)
+
+    img = preprocess(img, diag)
+
+    diag.next_step('Finding candidate regions at 1/%d scale...' % (downscale,))
+    boxes = find_candidate_boxes(img, downscale, pad)
+
+    def render_boxes():
+        boxes_img = np.zeros(img.shape, dtype=np.uint8)
+        for box in boxes:
+            boxes_img[box_slices(box)] = 255
+        return boxes_img
+
+    diag.save('candidate_boxes', render_boxes)
+
+    diag.next_step('Segmenting %d candidate regions at full scale...' % (len(boxes),))
+    crop_diag = Diagnostics(name, verbose=False)
+    label_img = np.zeros(img.shape, dtype=np.uint32)
+    n_labels = 0
+    for box in boxes:
+        slices = box_slices(box)
+        crop = segment_regions(img[slices], crop_diag, artifact_filter)
+        crop_labels = label(crop, connectivity=2)
+        n_labels = paste_labels(label_img, crop_labels, slices, n_labels)
+
+    label_img = compact_labels(label_img, n_labels)
+
+    save_label_outputs(label_img, diag)
+
+    if return_labels:
+        return cell_stats(label_img), label_img
+    return cell_stats(label_img)
+
+
+def segment_component(img, component):
+    """Watershed segmentation of 1 candidate region. img is a crop of the preprocessed greyscale image around it and
+    component is the boolean mask of the region in the crop. Everything outside the region is background, including
+    other candidate regions that overlap the crop. Returns label image of the crop."""
+    markers = np.ones(img.shape, dtype=np.uint8)
+    markers[component] = 0
+    markers[component & (img > MARKER_HI_THRESHOLD)] = 2
+
+    candidate_regions = np.zeros(img.shape, dtype=np.uint8)
+    candidate_regions[component] = 255
+
+    elevation_map = sobel(candidate_regions)
+    cells = watershed(elevation_map, markers) == 2
+    cells = remove_small_objects(cells, min_size=OBJECT_SIZE_THRESHOLD)
+    cells = binary_fill_holes(cells)
+    return label(cells, connectivity=2)
+
+
+def segment_components(img, name, output_dir='output', temp_dir='temp', save_figs=False, outputs=None,
+                       return_labels=False, pad=4, workers=1, artifact_filter=None):
+    """Per-region version of segment_test. Labels the candidate regions in the whole frame and runs the edge finding
+    and watershed separately on a padded box around each one, so the cost depends on the area the candidate regions
+    cover instead of the frame size. The regions are independent, so they're segmented in parallel.
+
+    Args:
+        pad (int): px of background kept around each candidate region. Only needs to cover the edge filter.
+        workers (int): Number of threads to segment regions with. The filters and watershed release the GIL.
+        artifact_filter (dict): Passed to filter_artifacts. None (default) for no pre-filter.
+    """
+
+    # Keeps the step counter to make sure all intermediate outputs are in order
+    diag = Diagnostics(name, temp_dir, save_figs=save_figs, outputs=outputs)
+
+    img = preprocess(img, diag)
+
+    diag.next_step('Finding candidate regions...')
+    candidate_regions = np.zeros(img.shape, dtype=np.uint8)
+    candidate_regions[img > MARKER_LO_THRESHOLD] = 255
+    if artifact_filter is not None:
+        markers = np.zeros(img.shape, dtype=np.uint8)
+        markers[img < MARKER_LO_THRESHOLD] = 1
+        markers[img > MARKER_HI_THRESHOLD] = 2
+        n_removed = filter_artifacts(img, candidate_regions, markers, artifact_filter)
+        diag.log('Removed %d artifact regions' % (n_removed,))
+        del markers
+    diag.save('candidate_regions', candidate_regions)
+
+    component_labels = label(candidate_regions > 0, connectivity=2)
+    del candidate_regions
+    boxes = [pad_box(slices_box(slices), pad, img.shape) for slices in find_objects(component_labels)]
+
+    diag.next_step('Segmenting %d candidate regions separately...' % (len(boxes),))
+
+    def segment_box(i):
+        slices = box_slices(boxes[i])
+        return segment_component(img[slices], component_labels[slices] == i + 1)
+
+    label_img = np.zeros(img.shape, dtype=np.uint32)
+    n_labels = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # executor.map returns results in the order the regions were submitted, not the order they finish, so labels
+        #   are numbered in region order and are the same for any number of workers
+        for box, crop_labels in zip(boxes, executor.map(segment_box, range(len(boxes)))):
+            n_labels = paste_labels(label_img, crop_labels, box_slices(box), n_labels)
+
+    label_img = compact_labels(label_img, n_labels)
+
+    save_label_outputs(label_img, diag)
+
+    if return_labels:
+        return cell_stats(label_img), label_img
+    return cell_stats(label_img)
+
+
 if __name__ == "__main__":
     save_figs = True  # True when developing the pipeline
+    multiscale = False  # Only run the full resolution segmentation near candidate cells. Faster on sparse frames.
     input_dir = 'images'
     output_dir = 'output'
     temp_dir = 'temp'
@@ -230,7 +510,8 @@ if __name__ == "__main__":
     segmented_results = []
     for img, name in image_loader(input_dir):
         print('Processing image %s' % (name,))
-        cells = segment_test(img, name, output_dir=output_dir, temp_dir=temp_dir, save_figs=save_figs)
+        segment = segment_multiscale if multiscale else segment_test
+        cells = segment(img, name, output_dir=output_dir, temp_dir=temp_dir, save_figs=save_figs)
 
         tokens = re.findall('.+Time(\d+)', name)
         time = int(tokens[0])  # hopefully this works...
@@ -0,0 +1,123 @@
+# Hand frames to worker processes through shared memory instead of pickling them
+#   A ring of frame slots lives in 1 multiprocessing.shared_memory block, each slot big enough for the largest frame in
+#   the frame index. The main process decodes each frame straight into a free slot (read_frame(..., out=slot)), and a
+#   worker attaches to the block by name and segments the slot in place. Only the cell stats come back; masks are
+#   written by the worker. A slot is reused as soon as its worker is done with it, so memory is fixed at n_slots frames
+#   however long the movie is, and decoding the next frames overlaps segmenting the earlier ones.
+#
+#   Needs Python 3.8+ (multiprocessing.shared_memory).
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+from frame_index import read_frame
+from rle_masks import MaskStore
+
+# Rings attached to in this (worker) process, by shared memory name
+attached = {}
+
+
+def frame_bytes(frame):
+    """Bytes of the decoded image of a frame index entry"""
+    return int(np.prod(frame['shape'])) * np.dtype(frame['dtype']).itemsize
+
+
+class FrameRing:
+    """n_slots frame slots of slot_bytes each in shared memory. Created in the main process and attached to by name in
+    workers.
+
+    Usage:
+        ring = FrameRing(max(frame_bytes(frame) for frame in frames), n_slots=4)
+        img = ring.slot(0, frame['shape'], frame['dtype'])  # view of slot 0, valid until the ring is closed
+        ...
+        ring.close()
+        ring.unlink()  # in the process that created it, once every worker is done
+    """
+
+    def __init__(self, slot_bytes, n_slots, name=None):
+        if shared_memory is None:
+            raise ValueError('Shared memory frames need Python 3.8+')
+        self.slot_bytes = slot_bytes
+        self.n_slots = n_slots
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(slot_bytes * n_slots, 1))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+    def slot(self, i, shape, dtype):
+        """Array of shape and dtype in slot i"""
+        dtype = np.dtype(dtype)
+        n_bytes = int(np.prod(shape)) * dtype.itemsize
+        if n_bytes > self.slot_bytes:
+            raise ValueError('Frame of %d bytes is too big for slots of %d bytes' % (n_bytes, self.slot_bytes))
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=i * self.slot_bytes)
+
+    def close(self):
+        self.shm.close()
+
+    def unlink(self):
+        self.shm.unlink()
+
+
+def attach_ring(name, slot_bytes, n_slots):
+    """Get the ring called name, attaching to it once per process"""
+    ring = attached.get(name)
+    if ring is None:
+        ring = attached[name] = FrameRing(slot_bytes, n_slots, name=name)
+    return ring
+
+
+def segment_slot(ring_name, slot_bytes, n_slots, slot, frame, segment, mask_dir, kwargs):
+    """Worker: segment the frame in slot of the ring in place with segment (e.g. segment_test) and return its cells.
+    Saves its masks to mask_dir, if given."""
+    ring = attach_ring(ring_name, slot_bytes, n_slots)
+    img = ring.slot(slot, frame['shape'], frame['dtype'])
+    cells, label_img = segment(img, frame['name'], return_labels=True, **kwargs)
+    if mask_dir is not None:
+        MaskStore(mask_dir).write(frame['name'], label_img)
+    return cells
+
+
+def segment_shared(frames, input_dir, segment, workers, n_slots=None, mask_dir=None, **kwargs):
+    """Generator that segments frames (frame index entries) in worker processes, handing them over in a FrameRing of
+    n_slots (default: 2 per worker) slots. Yields (frame, cells) in the order of frames. kwargs are passed to segment,
+    which must not modify the image in place. Masks are saved to mask_dir, if given.
+
+    Usage:
+        for frame, cells in segment_shared(frames, input_dir, segment_test, workers=4, artifact_filter=None):
+            <do something with frame and cells>
+    """
+    frames = list(frames)
+    if len(frames) == 0:
+        return
+    if n_slots is None:
+        n_slots = 2 * workers
+    ring = FrameRing(max(frame_bytes(frame) for frame in frames), n_slots)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            free = deque(range(n_slots))
+            pending = deque()  # (frame, slot, future) in frame order
+            for frame in frames:
+                if len(free) == 0:
+                    done_frame, slot, future = pending.popleft()
+                    cells = future.result()
+                    free.append(slot)
+                    yield done_frame, cells
+                slot = free.popleft()
+                read_frame(input_dir, frame, out=ring.slot(slot, frame['shape'], frame['dtype']))
+                pending.append((frame, slot, executor.submit(segment_slot, ring.name, ring.slot_bytes, n_slots, slot,
+                                                             frame, segment, mask_dir, kwargs)))
+            while len(pending) > 0:
+                done_frame, slot, future = pending.popleft()
+                yield done_frame, future.result()
+    finally:
+        ring.close()
+        ring.unlink()
@@ -0,0 +1,64 @@
+# Uniform grid spatial hash for finding points near other points
+#   Points are bucketed by which grid square they fall in. With squares at least as big as the search radius, every
+#   neighbour of a point is in the 3x3 squares around it, so a lookup costs O(1) for evenly spread points instead of
+#   O(n) for comparing against every point.
+
+from math import floor, ceil, sqrt
+
+
+class SpatialHash:
+    """Grid of (y, x) points, each with an item (e.g. its index in a list) attached
+
+    Usage:
+        grid = SpatialHash(cell_size=radius)
+        for i, cell in enumerate(cells):
+            grid.insert(cell['centroid'], i)
+        for dist, i in grid.neighbours(point, radius):
+            <do something with cells[i]>
+    """
+
+    def __init__(self, cell_size, points=None):
+        """Make grid with squares of side cell_size. Optionally insert points, using their index as the item."""
+        if cell_size <= 0:
+            raise ValueError('Cell size must be positive')
+        self.cell_size = cell_size
+        self.buckets = {}  # (row, col) of grid square -> list of (point, item)
+        self.size = 0
+
+        if points is not None:
+            for i, point in enumerate(points):
+                self.insert(point, i)
+
+    def __len__(self):
+        return self.size
+
+    def key(self, point):
+        """Get (row, col) of the grid square containing point"""
+        return (int(floor(point[0] / self.cell_size)), int(floor(point[1] / self.cell_size)))
+
+    def insert(self, point, item):
+        self.buckets.setdefault(self.key(point), []).append((point, item))
+        self.size += 1
+
+    def neighbours(self, point, radius):
+        """Get list of (distance, item) of points within radius of point, unsorted"""
+        reach = int(ceil(radius / self.cell_size))  # squares to check in each direction
+        row, col = self.key(point)
+        found = []
+        for i in range(row - reach, row + reach + 1):
+            for j in range(col - reach, col + reach + 1):
+                bucket = self.buckets.get((i, j))
+                if bucket is None:
+                    continue
+                for other, item in bucket:
+                    dist = sqrt((point[0] - other[0])**2 + (point[1] - other[1])**2)
+                    if dist <= radius:
+                        found.append((dist, item))
+        return found
+
+    def nearest(self, point, radius):
+        """Get (distance, item) of the nearest point within radius of point, or None if there isn't one"""
+        found = self.neighbours(point, radius)
+        if len(found) == 0:
+            return None
+        return min(found, key=lambda x: x[0])
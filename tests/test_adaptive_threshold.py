@@ -0,0 +1,49 @@
+import unittest
+
+import numpy as np
+
+from adaptive_threshold import window_sums, local_mean_std, threshold_map
+
+
+class TestAdaptiveThreshold(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.img = rng.randint(0, 256, size=(37, 50)).astype(np.uint8)
+
+    def test_window_sums(self):
+        top = np.array([0, 0, 5])
+        bottom = np.array([3, 37, 6])
+        sums = window_sums(self.img, top, bottom, 2)
+        self.assertEqual(sums.shape, (3, 50))
+        self.assertEqual(sums[0, 0], self.img[0:3, 0:3].astype(np.int64).sum())
+        self.assertEqual(sums[1, 10], self.img[:, 8:13].astype(np.int64).sum())
+        self.assertEqual(sums[2, 49], self.img[5, 47:].astype(np.int64).sum())
+
+    def test_local_mean_std(self):
+        window = 7
+        mean, std = local_mean_std(self.img, window, tile_rows=5)
+        for r, c in ((0, 0), (3, 3), (20, 30), (36, 49), (36, 0)):
+            patch = self.img[max(r - 3, 0):r + 4, max(c - 3, 0):c + 4].astype(np.float64)
+            self.assertAlmostEqual(mean[r, c], patch.mean())
+            self.assertAlmostEqual(std[r, c], patch.std())
+
+    def test_tiles_and_workers(self):
+        expected = threshold_map(self.img, window=9, tile_rows=1000)
+        np.testing.assert_allclose(threshold_map(self.img, window=9, tile_rows=4, workers=3), expected)
+
+    def test_threshold_map(self):
+        mean, std = local_mean_std(self.img, 9)
+        np.testing.assert_allclose(threshold_map(self.img, 9, 'niblack', k=0.5, offset=2), mean + 0.5 * std + 2,
+                                   rtol=1e-6)
+        r = 0.5 * 255
+        np.testing.assert_allclose(threshold_map(self.img, 9, 'sauvola', k=0.2, r=r), mean * (1 + 0.2 * (std / r - 1)),
+                                   rtol=1e-6)
+        clipped = threshold_map(self.img, 9, min_threshold=120, max_threshold=130)
+        self.assertTrue(clipped.min() >= 120 and clipped.max() <= 130)
+        self.assertRaises(ValueError, threshold_map, self.img, 9, 'otsu')
+        self.assertRaises(ValueError, threshold_map, np.zeros((4, 4, 3)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
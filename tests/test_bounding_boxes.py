@@ -0,0 +1,27 @@
+import unittest
+
+from bounding_boxes import slices_box, box_slices, scale_box, pad_box, merge_boxes
+
+
+class TestBoundingBoxes(unittest.TestCase):
+
+    def test_slices_roundtrip(self):
+        box = (1, 2, 5, 7)
+        self.assertEqual(slices_box(box_slices(box)), box)
+
+    def test_scale_and_pad(self):
+        self.assertEqual(scale_box((1, 2, 3, 4), 8), (8, 16, 24, 32))
+        self.assertEqual(pad_box((8, 16, 24, 32), 10, (30, 100)), (0, 6, 30, 42))
+
+    def test_merge_boxes(self):
+        boxes = [(0, 0, 10, 10), (5, 5, 15, 15), (20, 20, 30, 30)]
+        self.assertEqual(merge_boxes(boxes), [(0, 0, 15, 15), (20, 20, 30, 30)])
+
+    def test_merge_boxes_chain(self):
+        # Merging the first 2 boxes makes the result overlap the 3rd
+        boxes = [(0, 0, 4, 4), (3, 3, 6, 20), (0, 15, 2, 25)]
+        self.assertEqual(merge_boxes(boxes), [(0, 0, 6, 25)])
+
+
+if __name__ == '__main__':
+    unittest.main()
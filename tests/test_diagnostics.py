@@ -0,0 +1,46 @@
+import unittest
+import shutil
+import tempfile
+
+from diagnostics import Diagnostics
+
+
+class TestDiagnostics(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.saved = []
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def writer(self, filename, img):
+        self.saved.append((filename, img))
+
+    def render(self):
+        self.fail('Output rendered even though nothing asked for it')
+
+    def test_lazy_render(self):
+        diag = Diagnostics('frame', self.temp_dir, save_figs=False, writer=self.writer)
+        diag.next_step()
+        diag.save('overlay', self.render)
+        self.assertEqual(self.saved, [])
+
+    def test_requested_outputs(self):
+        diag = Diagnostics('frame', self.temp_dir, save_figs=False, outputs=['segmented'], writer=self.writer)
+        diag.next_step()
+        diag.save('overlay', self.render)
+        diag.save('segmented', lambda: 'img')
+        self.assertEqual(len(self.saved), 1)
+        filename, img = self.saved[0]
+        self.assertTrue(filename.endswith('frame_1_segmented.tif'))
+        self.assertEqual(img, 'img')
+
+    def test_save_figs(self):
+        diag = Diagnostics('frame', self.temp_dir, save_figs=True, writer=self.writer)
+        diag.save('orig', 'img')
+        self.assertTrue(self.saved[0][0].endswith('frame_0_orig.tif'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import unittest
+import os
+import shutil
+import tempfile
+from os.path import join as joinpath
+
+import numpy as np
+import tifffile as tiff
+
+from frame_index import FrameIndex, parse_frame_name, INDEX_FILENAME
+from image_loader import image_loader, indexed_image_loader, load_frame_at, load_page, prefetch, prefetch_loader, stack_loader
+
+
+class TestFrameIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+        # Write out of order so os.listdir order doesn't happen to be time order
+        for time in [3, 1, 2]:
+            self.write_frame('Colony_54_Time%04d_3x3a.tif' % (time,), time)
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir)
+
+    def write_frame(self, file, value):
+        tiff.imwrite(joinpath(self.input_dir, file), np.full((8, 10), value, dtype=np.uint8))
+
+    def test_parse_frame_name(self):
+        self.assertEqual(parse_frame_name('Colony_54_3x3a_Time0070'), {'colony': 54, 'time': 70, 'size': 3})
+        self.assertEqual(parse_frame_name('Colony_54_Time0070_3x3a'), {'colony': 54, 'time': 70, 'size': 3})
+        self.assertEqual(parse_frame_name('stack'), {'colony': None, 'time': None, 'size': None})
+
+    def test_time_order(self):
+        index = FrameIndex(self.input_dir)
+        self.assertEqual([frame['time'] for frame in index.frames()], [1, 2, 3])
+        frame = index.frames()[0]
+        self.assertEqual(frame['shape'], [8, 10])
+        self.assertEqual(frame['dtype'], 'uint8')
+        self.assertEqual(frame['colony'], 54)
+        self.assertTrue(os.path.exists(joinpath(self.input_dir, INDEX_FILENAME)))
+
+    def test_loaders(self):
+        values = [img[0, 0] for img, name in indexed_image_loader(self.input_dir)]
+        self.assertEqual(values, [1, 2, 3])
+
+        values = [img[0, 0] for img, name in indexed_image_loader(self.input_dir, start=2, stop=3)]
+        self.assertEqual(values, [2, 3])
+
+        img, name = load_frame_at(self.input_dir, 2)
+        self.assertEqual(img[0, 0], 2)
+        self.assertEqual(name, 'Colony_54_Time0002_3x3a')
+
+        # The index file in the input dir isn't treated as an image
+        self.assertEqual(len(list(image_loader(self.input_dir))), 3)
+
+    def test_frames_by_colony(self):
+        for time in [1, 2, 3]:
+            self.write_frame('Colony_7_Time%04d_3x3a.tif' % (time,), 10 + time)
+        self.write_frame('Time0002_3x3a.tif', 20)  # no colony in the name
+        index = FrameIndex(self.input_dir)
+        self.assertEqual(index.colonies(), [7, 54])
+
+        groups = index.frames_by_colony()
+        self.assertEqual(set(groups), {7, 54, None})
+        self.assertEqual([frame['time'] for frame in groups[54]], [1, 2, 3])
+        self.assertEqual([frame['name'] for frame in groups[7]],
+                         ['Colony_7_Time%04d_3x3a' % (time,) for time in [1, 2, 3]])
+        self.assertEqual([frame['name'] for frame in groups[None]], ['Time0002_3x3a'])
+
+        # Times are filtered within each colony, and colonies w/o frames in range are left out
+        groups = index.frames_by_colony(start=3, stop=3)
+        self.assertEqual({colony: [frame['time'] for frame in frames] for colony, frames in groups.items()},
+                         {7: [3], 54: [3]})
+
+    def test_incremental_update(self):
+        index = FrameIndex(self.input_dir)
+        self.assertFalse(index.update())
+
+        self.write_frame('Colony_54_Time0004_3x3a.tif', 4)
+        os.remove(joinpath(self.input_dir, 'Colony_54_Time0001_3x3a.tif'))
+        self.assertTrue(index.update())
+        self.assertEqual(index.times(), [2, 3, 4])
+
+        # Saved index is picked up w/o reopening unchanged files
+        index.save()
+        index = FrameIndex(self.input_dir, update=False)
+        self.assertEqual(index.times(), [2, 3, 4])
+
+    def test_multipage_stack(self):
+        with tiff.TiffWriter(joinpath(self.input_dir, 'stack.tif')) as tif:
+            for i in range(3):
+                tif.write(np.full((8, 10), 10 + i, dtype=np.uint8))
+        index = FrameIndex(self.input_dir)
+        frames = [frame for frame in index.frames() if frame['file'] == 'stack.tif']
+        self.assertEqual([frame['name'] for frame in frames], ['stack_page_1', 'stack_page_2', 'stack_page_3'])
+        self.assertEqual(index.read(frames[2])[0, 0], 12)
+
+    def test_prefetch(self):
+        loaded = []
+
+        def load(item):
+            loaded.append(item)
+            return item * 10
+
+        items = prefetch(range(6), load, depth=2)
+        self.assertEqual(next(items), 0)
+        # Never more than depth items loaded ahead of the one handed out
+        self.assertLessEqual(len(loaded), 3)
+        self.assertEqual(list(items), [10, 20, 30, 40, 50])
+        self.assertEqual(list(prefetch(range(3), load, depth=0)), [0, 10, 20])
+
+    def test_prefetch_loader(self):
+        with tiff.TiffWriter(joinpath(self.input_dir, 'stack.tif')) as tif:
+            for i in range(3):
+                tif.write(np.full((8, 10), 10 + i, dtype=np.uint8))
+        expected = [(img[0, 0], name) for img, name in image_loader(self.input_dir)]
+        for depth in (0, 1, 3):
+            self.assertEqual([(img[0, 0], name) for img, name in prefetch_loader(self.input_dir, depth=depth, workers=2)],
+                             expected)
+
+    def test_stack_random_access(self):
+        with tiff.TiffWriter(joinpath(self.input_dir, 'stack.tif')) as tif:
+            for i in range(20):
+                tif.write(np.full((8, 10), i, dtype=np.uint8), compression='zlib')
+        index = FrameIndex(self.input_dir)
+        img, name = load_page(self.input_dir, 'stack.tif', 17, index=index)
+        self.assertEqual((img[0, 0], name), (17, 'stack_page_18'))
+        with self.assertRaises(KeyError):
+            index.page('stack.tif', 20)
+
+        loaded = [(img[0, 0], name) for img, name in stack_loader(self.input_dir, 'stack.tif', workers=3, index=index)]
+        self.assertEqual(loaded, [(i, 'stack_page_%d' % (i + 1,)) for i in range(20)])
+        loaded = [img[0, 0] for img, name in stack_loader(self.input_dir, 'stack.tif', pages=[15, 3, 9], index=index)]
+        self.assertEqual(loaded, [15, 3, 9])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+
+from track_cells import track_cells_gated
+from gap_closing import get_segments, close_gaps
+
+
+def make_frame(time, centroids):
+    cells = [{'label': i + 1, 'centroid': centroid, 'area': 100} for i, centroid in enumerate(centroids)]
+    return {'time': time, 'cells': cells}
+
+
+class TestGapClosing(unittest.TestCase):
+
+    def setUp(self):
+        # 2 cells moving right. The 1st is missed in frame 3 and the 2nd in frames 2 and 3.
+        self.frames = [make_frame(1, [(0, 0), (100, 0)]),
+                       make_frame(2, [(0, 5)]),
+                       make_frame(3, []),
+                       make_frame(4, [(0, 15), (100, 15)]),
+                       make_frame(5, [(0, 20), (100, 20)])]
+        track_cells_gated(self.frames, max_displacement=10)
+
+    def test_segments(self):
+        segments = get_segments(self.frames)
+        spans = sorted((start[0], end[0]) for start, end in segments)
+        self.assertEqual(spans, [(0, 0), (0, 1), (3, 4), (3, 4)])
+
+    def test_close_gaps(self):
+        close_gaps(self.frames, max_gap=2, max_displacement=10)
+        first, second = self.frames[3]['cells']
+        self.assertEqual((first['prev_label'], first['prev_time']), (1, 2))
+        self.assertEqual((second['prev_label'], second['prev_time']), (2, 1))
+        # Cells that were already linked are unchanged
+        self.assertEqual(self.frames[4]['cells'][0]['prev_label'], 1)
+        self.assertNotIn('prev_time', self.frames[4]['cells'][0])
+
+    def test_max_gap(self):
+        # The 2nd cell's gap is too long
+        close_gaps(self.frames, max_gap=1, max_displacement=10)
+        first, second = self.frames[3]['cells']
+        self.assertEqual((first['prev_label'], first['prev_time']), (1, 2))
+        self.assertEqual(second['prev_label'], 0)
+
+    def test_max_displacement(self):
+        close_gaps(self.frames, max_gap=2, max_displacement=2)
+        self.assertEqual([cell['prev_label'] for cell in self.frames[3]['cells']], [0, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
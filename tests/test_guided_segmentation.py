@@ -0,0 +1,114 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import guided_segmentation
+from guided_segmentation import GuidedSegmenter, predict_positions, cell_windows, touches_edge, segment_windows
+from segment_test import segment_test
+from track_cells import link_cells_basic
+from tests.test_segment_test import disc_frame, greyscale, quietly, BRIGHT
+
+
+class TestGuidedSegmentation(unittest.TestCase):
+
+    def test_predict_positions(self):
+        prev_prev_cells = [{'label': 1, 'centroid': (10, 20)}, {'label': 2, 'centroid': (50, 50)}]
+        prev_cells = [{'label': 1, 'centroid': (14, 17), 'prev_label': 1},
+                      {'label': 2, 'centroid': (80, 80), 'prev_label': 0},  # new cell, nothing at label 0
+                      {'label': 3, 'centroid': (30, 30)}]  # never tracked
+        self.assertEqual(predict_positions(prev_cells, prev_prev_cells), [(18, 14), (80, 80), (30, 30)])
+        self.assertEqual(predict_positions(prev_cells[:1], []), [(14, 17)])
+
+    def test_windows_at_edge(self):
+        # 2 cells in the corner: their windows are clipped to the image and merged
+        prev_cells = [{'label': 1, 'centroid': (5, 5), 'area': 100}, {'label': 2, 'centroid': (20, 30), 'area': 100}]
+        boxes = cell_windows(prev_cells, [(5, 5), (20, 30)], (200, 300), window_scale=2.0, window_pad=4)
+        self.assertEqual(boxes, [(0, 0, 36, 46)])
+
+        # Predicted position past the edge stretches the window up to the edge only
+        boxes = cell_windows(prev_cells[:1], [(-20, 5)], (200, 300), window_scale=2.0, window_pad=4)
+        self.assertEqual(boxes, [(0, 0, 21, 21)])
+
+    def test_touches_edge(self):
+        crop = np.zeros((10, 10), dtype=bool)
+        crop[0, 5] = True
+        self.assertTrue(touches_edge(crop, (20, 20, 30, 30), (100, 100)))
+        # The top of the window is the top of the image, so nothing is cut off
+        self.assertFalse(touches_edge(crop, (0, 20, 10, 30), (100, 100)))
+
+    def test_window_grows(self):
+        img = disc_frame((300, 300), [(150, 150, 30, BRIGHT)])
+        expected, expected_labels = quietly(segment_test, img)
+
+        # Window that cuts off the bottom 20 px of the cell. It takes 3 grows of 8 px for the cell to fit.
+        label_img = segment_windows(greyscale(img), [(100, 100, 160, 200)], grow=8, max_grow=5)
+        np.testing.assert_array_equal(label_img > 0, expected_labels > 0)
+
+        # Not allowed to grow enough: the cell stays cut off
+        label_img = segment_windows(greyscale(img), [(100, 100, 160, 200)], grow=8, max_grow=2)
+        self.assertLess(np.count_nonzero(label_img), expected[0]['area'])
+
+    def test_full_sweep_cadence(self):
+        img = disc_frame((200, 200), [(100, 100, 25, BRIGHT)])
+        prev_cells = [{'label': 1, 'centroid': (100, 100), 'area': 1963, 'prev_label': 1}]
+        segmenter = GuidedSegmenter(full_sweep_every=3)
+
+        def full_sweeps(frames):
+            """Which of frames ('segment' or 'skip') were full sweeps"""
+            sweeps = []
+            with mock.patch.object(guided_segmentation, 'segment_multiscale',
+                                   wraps=guided_segmentation.segment_multiscale) as multiscale:
+                for frame in frames:
+                    calls = multiscale.call_count
+                    if frame == 'skip':
+                        segmenter.skip(prev_cells)
+                    else:
+                        quietly(segmenter.segment, img, prev_cells=prev_cells)
+                    sweeps.append(multiscale.call_count > calls)
+            return sweeps
+
+        self.assertEqual(full_sweeps(['segment'] * 7), [True, False, False, True, False, False, True])
+        self.assertEqual(segmenter.n_frames, 7)
+
+        # Skipped (e.g. resumed) frames count, so sweeps stay on the same frames
+        segmenter = GuidedSegmenter(full_sweep_every=3)
+        self.assertEqual(full_sweeps(['skip', 'segment', 'segment', 'segment', 'skip', 'segment']),
+                         [False, False, False, True, False, False])
+
+        # No tracked cells to guide by: always a full sweep
+        segmenter = GuidedSegmenter(full_sweep_every=3)
+        segmenter.skip([])
+        with mock.patch.object(guided_segmentation, 'segment_multiscale',
+                               wraps=guided_segmentation.segment_multiscale) as multiscale:
+            quietly(segmenter.segment, img, prev_cells=[])
+        self.assertEqual(multiscale.call_count, 1)
+
+        for full_sweep_every in (0, -1):
+            with self.assertRaises(ValueError):
+                GuidedSegmenter(full_sweep_every=full_sweep_every)
+
+    def test_movie(self):
+        # 3 cells drifting a few px per frame
+        starts = [(60, 60, 2, 3), (150, 200, -3, 1), (250, 100, 1, -2)]
+        frames = [disc_frame((320, 320), [(y + t * dy, x + t * dx, 22, BRIGHT) for y, x, dy, dx in starts])
+                  for t in range(5)]
+        segmenter = GuidedSegmenter(full_sweep_every=3)
+        prev_cells = []
+        for t, img in enumerate(frames):
+            cells = quietly(segmenter.segment, img, prev_cells=prev_cells)[0]
+            expected = quietly(segment_test, img)[0]
+            # Full sweeps find the same cells as segment_test. So do the windows here, since no cell leaves its window.
+            self.assertEqual(len(cells), 3)
+            cells_by_position = sorted(cells, key=lambda cell: tuple(cell['centroid']))
+            expected = sorted(expected, key=lambda cell: tuple(cell['centroid']))
+            np.testing.assert_array_equal([cell['area'] for cell in cells_by_position],
+                                          [cell['area'] for cell in expected])
+            np.testing.assert_allclose([cell['centroid'] for cell in cells_by_position],
+                                       [cell['centroid'] for cell in expected])
+            link_cells_basic(cells, prev_cells)
+            prev_cells = cells
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import os
+import shutil
+import tempfile
+from os.path import join as joinpath
+
+import numpy as np
+
+from journal import Journal, read_journal
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = joinpath(self.dir, 'results.journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_resume(self):
+        journal = Journal(self.filename)
+        journal.append({'name': 'a', 'time': 1, 'cells': [{'label': np.int32(1), 'area': np.float64(3.0)}]})
+        journal.append({'name': 'b', 'time': 2, 'cells': []})
+        journal.close()
+
+        journal = Journal(self.filename, resume=True)
+        self.assertEqual(sorted(journal.done), ['a', 'b'])
+        self.assertEqual(journal.done['a']['cells'][0]['label'], 1)
+        journal.append({'name': 'c', 'time': 3, 'cells': []})
+        journal.close()
+        entries, end = read_journal(self.filename)
+        self.assertEqual([entry['name'] for entry in entries], ['a', 'b', 'c'])
+
+        # Not resuming starts over
+        journal = Journal(self.filename)
+        journal.close()
+        self.assertEqual(read_journal(self.filename), ([], 0))
+
+    def test_partial_last_entry(self):
+        journal = Journal(self.filename)
+        journal.append({'name': 'a', 'time': 1, 'cells': []})
+        journal.close()
+        size = os.path.getsize(self.filename)
+        with open(self.filename, 'ab') as f:
+            f.write(b'{"name": "b", "ti')  # crashed while writing
+
+        journal = Journal(self.filename, resume=True)
+        self.assertEqual(list(journal.done), ['a'])
+        self.assertEqual(os.path.getsize(self.filename), size)
+        journal.append({'name': 'b', 'time': 2, 'cells': []})
+        journal.remove()
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_resume_without_journal(self):
+        journal = Journal(self.filename, resume=True)
+        self.assertEqual(journal.done, {})
+        journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import numpy as np
+
+from scipy.ndimage import binary_fill_holes
+from skimage.measure import label
+
+from labels import smallest_label_dtype, compact_labels, paste_labels, fill_label_holes
+
+
+class TestLabels(unittest.TestCase):
+
+    def test_smallest_label_dtype(self):
+        self.assertEqual(smallest_label_dtype(0), np.uint8)
+        self.assertEqual(smallest_label_dtype(255), np.uint8)
+        self.assertEqual(smallest_label_dtype(256), np.uint16)
+        self.assertEqual(smallest_label_dtype(70000), np.uint32)
+
+    def test_compact_labels(self):
+        label_img = np.zeros((4, 4), dtype=np.int64)
+        label_img[0, 0] = 300
+        compacted = compact_labels(label_img)
+        self.assertEqual(compacted.dtype, np.uint16)
+        self.assertEqual(compacted[0, 0], 300)
+
+    def test_paste_labels(self):
+        label_img = np.zeros((4, 6), dtype=np.uint16)
+        label_img[0, 0] = 1
+        crop_labels = np.array([[0, 1], [2, 0]])
+        n_labels = paste_labels(label_img, crop_labels, (slice(2, 4), slice(3, 5)), 1)
+        self.assertEqual(n_labels, 3)
+        self.assertEqual(label_img[2, 4], 2)
+        self.assertEqual(label_img[3, 3], 3)
+        self.assertEqual(label_img[2, 3], 0)
+        self.assertEqual(label_img[0, 0], 1)
+
+    def test_fill_label_holes(self):
+        label_img = np.zeros((7, 9), dtype=np.uint8)
+        label_img[1:6, 1:6] = 1
+        label_img[2:4, 2:4] = 0  # hole
+        label_img[0:3, 7] = 2  # touches edge
+        label_img[4:6, 4] = 0  # notch open to the outside isn't a hole
+        filled = fill_label_holes(label_img)
+        self.assertTrue((filled[2:4, 2:4] == 1).all())
+        self.assertTrue((filled[4:6, 4] == 0).all())
+        filled[2:4, 2:4] = 0
+        np.testing.assert_array_equal(filled, label_img)
+
+    def test_fill_label_holes_matches_binary_fill_holes(self):
+        rng = np.random.RandomState(0)
+        label_img = label(rng.rand(50, 60) > 0.45, connectivity=2)
+        filled = fill_label_holes(label_img)
+        np.testing.assert_array_equal(filled > 0, binary_fill_holes(label_img > 0))
+        # Labels are only added to holes
+        np.testing.assert_array_equal(filled[label_img > 0], label_img[label_img > 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import unittest
+
+from track_cells import track_cells_gated
+from gap_closing import close_gaps
+from lineage import detect_divisions, build_lineage
+
+
+def make_frame(time, cells):
+    return {'time': time, 'cells': [{'label': i + 1, 'centroid': centroid, 'area': area}
+                                    for i, (centroid, area) in enumerate(cells)]}
+
+
+class TestLineage(unittest.TestCase):
+
+    def setUp(self):
+        # Cell 1 divides between frames 2 and 3. Cell 2 just moves, and another cell appears far away in frame 3.
+        self.frames = [make_frame(1, [((0, 0), 200), ((100, 100), 200)]),
+                       make_frame(2, [((0, 1), 200), ((100, 101), 200)]),
+                       make_frame(3, [((0, -4), 100), ((0, 8), 100), ((100, 102), 200), ((300, 300), 100)]),
+                       make_frame(4, [((0, -5), 100), ((0, 9), 100), ((100, 103), 200), ((300, 300), 100)])]
+        track_cells_gated(self.frames, max_displacement=10)
+
+    def test_detect_divisions(self):
+        detect_divisions(self.frames, max_displacement=10)
+        daughters = self.frames[2]['cells'][:2]
+        self.assertEqual([cell['prev_label'] for cell in daughters], [1, 1])
+        self.assertTrue(all(cell['division'] for cell in daughters))
+        # Other cells are unchanged
+        self.assertEqual(self.frames[2]['cells'][2]['prev_label'], 2)
+        self.assertEqual(self.frames[2]['cells'][3]['prev_label'], 0)
+        self.assertNotIn('division', self.frames[2]['cells'][3])
+
+    def test_area_mismatch(self):
+        self.frames[2]['cells'][1]['area'] = 20
+        detect_divisions(self.frames, max_displacement=10)
+        self.assertEqual(self.frames[2]['cells'][1]['prev_label'], 0)
+
+    def test_lineage(self):
+        detect_divisions(self.frames, max_displacement=10)
+        roots = build_lineage(self.frames)
+        self.assertEqual(len(roots), 3)
+        dividing = roots[0]
+        self.assertEqual((dividing['start_time'], dividing['end_time']), (1, 2))
+        self.assertEqual([(child['start_label'], child['end_time']) for child in dividing['children']], [(1, 4), (2, 4)])
+        self.assertEqual((roots[1]['start_time'], roots[1]['end_time'], roots[1]['children']), (1, 4, []))
+        self.assertEqual(roots[2]['start_time'], 3)
+        self.assertEqual(self.frames[3]['cells'][0]['track'], dividing['children'][0]['track'])
+
+    def test_lineage_across_gap(self):
+        frames = [make_frame(1, [((0, 0), 100)]),
+                  make_frame(2, []),
+                  make_frame(3, [((0, 2), 100)])]
+        track_cells_gated(frames, max_displacement=5)
+        close_gaps(frames, max_gap=1, max_displacement=5)
+        roots = build_lineage(frames)
+        self.assertEqual(len(roots), 1)
+        self.assertEqual(roots[0]['end_time'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
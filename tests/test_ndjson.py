@@ -0,0 +1,80 @@
+import unittest
+import json
+import shutil
+import tempfile
+from os.path import join as joinpath
+
+import numpy as np
+
+from NumpyJSONEncoder import NumpyJSONEncoder
+from ndjson import column_to_builtin, records_to_builtin, frame_to_builtin, dumps_frame, NDJSONWriter, read_ndjson, write_results, \
+    read_results
+
+
+class TestNDJSON(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.frames = [{'time': np.int64(t),
+                        'cells': [{'label': np.int32(i + 1),
+                                   'centroid': (np.float64(i * 1.5), np.float32(t)),
+                                   'area': np.uint16(100 + i),
+                                   'prev_label': i}
+                                  for i in range(3)]}
+                       for t in range(1, 4)]
+        self.frames[1]['cells'][2]['division'] = np.bool_(True)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_records_to_builtin(self):
+        cells = records_to_builtin(self.frames[1]['cells'])
+        self.assertEqual(cells[2], {'label': 3, 'centroid': [3.0, 2.0], 'area': 102, 'prev_label': 2, 'division': True})
+        self.assertNotIn('division', cells[0])
+        for cell in cells:
+            for value in cell.values():
+                self.assertIn(type(value), (int, float, bool, list))
+        self.assertEqual(records_to_builtin([]), [])
+
+    def test_mixed_columns(self):
+        # Each value keeps its type when a column mixes kinds of numbers, and big ints aren't rounded
+        column = column_to_builtin([1, 2.5, np.int64(3)])
+        self.assertEqual([type(value) for value in column], [int, float, int])
+        self.assertEqual(column_to_builtin([2 ** 53 + 1, 0.5]), [2 ** 53 + 1, 0.5])
+        self.assertEqual(column_to_builtin([2 ** 63, 1]), [2 ** 63, 1])
+        self.assertEqual(column_to_builtin([(1, 2.5), (3, 4.5)]), [[1, 2.5], [3, 4.5]])
+        self.assertEqual([type(value) for value in column_to_builtin([(1, 2.5), (3, 4.5)])[1]], [int, float])
+        # Same kind: still converted in bulk
+        self.assertEqual(column_to_builtin([np.uint16(1), np.uint16(2)]), [1, 2])
+        self.assertEqual(column_to_builtin([(np.float64(1.5), np.float32(2))] * 2), [[1.5, 2.0]] * 2)
+
+    def test_matches_encoder(self):
+        for frame in self.frames:
+            self.assertEqual(json.loads(dumps_frame(frame)),
+                             json.loads(json.dumps(frame, cls=NumpyJSONEncoder)))
+
+    def test_encoder_types(self):
+        values = [np.int8(1), np.uint64(2), np.float16(0.5), np.bool_(False), np.zeros((2, 2), dtype=np.int16)]
+        self.assertEqual(json.loads(json.dumps(values, cls=NumpyJSONEncoder)), [1, 2, 0.5, False, [[0, 0], [0, 0]]])
+
+    def test_write_read(self):
+        filename = joinpath(self.dir, 'results.ndjson')
+        with NDJSONWriter(filename) as writer:
+            for frame in self.frames:
+                writer.write(frame)
+        with open(filename) as f:
+            self.assertEqual(len(f.readlines()), 3)
+        frames = read_ndjson(filename)
+        self.assertEqual(next(frames)['time'], 1)  # incremental
+        self.assertEqual(len(list(frames)), 2)
+
+    def test_write_results(self):
+        expected = [frame_to_builtin(frame) for frame in self.frames]
+        for file in ('results.ndjson', 'results.txt'):
+            filename = joinpath(self.dir, file)
+            write_results(filename, self.frames)
+            self.assertEqual(list(read_results(filename)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+
+import numpy as np
+
+from panel_normalize import panel_view, panel_histograms, histogram_percentiles, normalize_panels
+
+
+class TestPanelNormalize(unittest.TestCase):
+
+    def setUp(self):
+        # 2x3 panels of 10x8 px with different backgrounds and contrast
+        rng = np.random.RandomState(0)
+        self.img = np.zeros((20, 24), dtype=np.uint16)
+        self.levels = [[(100, 1000), (200, 2000), (100, 1000)], [(150, 1500), (100, 1000), (0, 0)]]
+        for i in range(2):
+            for j in range(3):
+                lo, hi = self.levels[i][j]
+                panel = np.full((10, 8), lo, dtype=np.uint16)
+                panel[2:5, 2:5] = hi  # a "cell"
+                self.img[i*10:(i+1)*10, j*8:(j+1)*8] = panel
+
+    def test_panel_view(self):
+        view = panel_view(self.img, 10, 8)
+        self.assertEqual(view.shape, (2, 10, 3, 8))
+        self.assertTrue(np.shares_memory(view, self.img))
+        np.testing.assert_array_equal(view[1, :, 2, :], self.img[10:20, 16:24])
+
+    def test_panel_histograms(self):
+        hists = panel_histograms(self.img, 10, 8)
+        self.assertEqual(hists.shape, (2, 3, 65536))
+        self.assertEqual(hists[0, 1, 200], 71)
+        self.assertEqual(hists[0, 1, 2000], 9)
+        self.assertEqual(hists[1, 2, 0], 80)
+        self.assertRaises(ValueError, panel_histograms, self.img.astype(np.float32), 10, 8)
+
+    def test_histogram_percentiles(self):
+        hists = np.array([[0, 5, 5, 0], [0, 0, 0, 0]])
+        np.testing.assert_array_equal(histogram_percentiles(hists, (0, 50, 100)), [[1, 1, 2], [0, 0, 0]])
+
+    def test_normalize_panels(self):
+        img = normalize_panels(self.img, 10, 8, lo_percentile=50, hi_percentile=99)
+        view = panel_view(img, 10, 8)
+        for i in range(2):
+            for j in range(3):
+                if self.levels[i][j] == (0, 0):  # blank panels are left alone
+                    self.assertTrue((view[i, :, j, :] == 0).all())
+                else:
+                    self.assertEqual(view[i, 0, j, 0], 100)
+                    self.assertEqual(view[i, 3, j, 3], 1000)
+
+    def test_max_gain(self):
+        img = self.img.copy()
+        img[0:10, 0:8] = 100
+        img[3, 3] = 110  # nearly empty panel
+        normalize_panels(img, 10, 8, lo_percentile=50, hi_percentile=99.9, max_gain=2)
+        self.assertEqual(img[3, 3], 120)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+import unittest
+import io
+import itertools
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from param_sweep import ArrayCache, StageGraph, build_stages, derived_params, grid_points, parse_param, check_params, sweep
+from segment_test import segment_test, ARTIFACT_FILTER
+
+
+def blobs_frame():
+    """uint16 image of bright and faint blobs of a few sizes on a dark background"""
+    yy, xx = np.mgrid[:200, :300]
+    img = np.full((200, 300), 100, dtype=np.uint16)
+    for y, x, radius, intensity in [(50, 50, 25, 3000), (50, 150, 18, 3000), (140, 80, 30, 1200), (140, 220, 12, 3000),
+                                    (60, 250, 20, 800)]:
+        img[np.hypot(yy - y, xx - x) < radius] = intensity
+    return img
+
+
+class TestParamSweep(unittest.TestCase):
+
+    def test_cache(self):
+        cache = ArrayCache(max_bytes=250)
+        cache.put('a', np.zeros(100, dtype=np.uint8))
+        cache.put('b', (np.zeros(50, dtype=np.uint8), np.zeros(50, dtype=np.uint8)))
+        self.assertIsNotNone(cache.get('a'))  # now b is the least recently used
+        cache.put('c', np.zeros(100, dtype=np.uint8))
+        self.assertEqual(sorted(cache.items), ['a', 'c'])
+        self.assertEqual(cache.bytes, 200)
+        cache.put('d', np.zeros(300, dtype=np.uint8))  # bigger than the whole cache
+        self.assertNotIn('d', cache)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_parse(self):
+        self.assertEqual(parse_param('lo_threshold=55,65.5'), ('lo_threshold', [55, 65.5]))
+        with self.assertRaises(ValueError):
+            parse_param('lo_threshold')
+        with self.assertRaises(ValueError):
+            check_params('watershed', ['threshold'])
+        with self.assertRaises(ValueError):
+            check_params('guided', ['lo_threshold'])
+
+    def test_grid_order(self):
+        points = grid_points({'object_size': [1, 2], 'lo_threshold': [3, 4]}, ['lo_threshold', 'object_size'])
+        self.assertEqual([(point['lo_threshold'], point['object_size']) for point in points],
+                         [(3, 1), (3, 2), (4, 1), (4, 2)])
+
+    def assert_same_cells(self, cells, expected):
+        self.assertEqual([cell['label'] for cell in cells], [cell['label'] for cell in expected])
+        np.testing.assert_array_equal([cell['area'] for cell in cells], [cell['area'] for cell in expected])
+        np.testing.assert_allclose([cell['centroid'] for cell in cells], [cell['centroid'] for cell in expected])
+
+    def test_same_as_segment_test(self):
+        img = blobs_frame()
+        img[45:55, 45:55] = 100  # hole in a cell
+        img[120:160, 60:100] = 3000  # cell with a hole w/ a small object in it
+        img[135:145, 75:85] = 100
+        img[139:141, 79:81] = 3000
+        frame = {'name': 'frame', 'time': 1}
+        for artifact_filter in (ARTIFACT_FILTER, None):
+            graph = StageGraph(build_stages('watershed', artifact_filter), ArrayCache(), lambda frame: img,
+                               derived_params('watershed', artifact_filter))
+            for lo, hi, size in itertools.product([50, 65], [120, 150], [3, 1000, 1500]):
+                params = {'lo_threshold': lo, 'hi_threshold': hi, 'object_size': size}
+                with redirect_stdout(io.StringIO()):
+                    expected = segment_test(img, 'frame', artifact_filter=artifact_filter, **params)
+                self.assert_same_cells(graph.run(frame, params), expected)
+
+            # Shared stages only run once per value of the parameters they depend on
+            self.assertEqual(graph.computed['frame'], 1)
+            self.assertEqual(graph.computed['greyscale'], 1)
+            self.assertEqual(graph.computed['candidate_regions'], 2)
+            self.assertEqual(graph.computed['markers'], 4)
+            # The filter only changes for object sizes below its min_area
+            self.assertEqual(graph.computed['elevation_map'], 8 if artifact_filter is not None else 2)
+            self.assertEqual(graph.computed['watershed'], 8 if artifact_filter is not None else 4)
+
+    def test_sweep(self):
+        img = blobs_frame()
+        frames = [{'name': 'frame1', 'time': 1}, {'name': 'frame2', 'time': 2}]
+        with redirect_stdout(io.StringIO()):
+            results, graph = sweep(frames, lambda frame: img, 'watershed', {'object_size': [100, 1500]},
+                                   artifact_filter=None)
+        self.assertEqual([result['params']['object_size'] for result in results], [100, 1500])
+        self.assertEqual(results[0]['params']['lo_threshold'], 65)  # default
+        self.assertEqual(results[0]['n_cells'], [3, 3])  # the faint blobs aren't cells
+        self.assertEqual(results[1]['n_cells'], [1, 1])
+        self.assertEqual(graph.computed['watershed'], 2)  # once per frame
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+import io
+import json
+import shutil
+import tempfile
+from os.path import join as joinpath
+from contextlib import redirect_stdout
+
+import numpy as np
+
+import profiling
+from profiling import MemoryProfiler, start_profiling, stop_profiling, checkpoint, step_key, MB
+from diagnostics import Diagnostics
+
+
+class TestProfiling(unittest.TestCase):
+
+    def tearDown(self):
+        stop_profiling()
+
+    def test_step_peaks(self):
+        profiler = MemoryProfiler()
+        profiler.checkpoint('frame1', 'Small step')
+        small = np.ones(1000)
+        profiler.checkpoint('frame1', 'Big step')
+        big = np.ones(4 * MB)  # 32 MB, freed before the step ends
+        del big
+        profiler.checkpoint('frame2', 'Small step')
+        profiler.stop()
+        del small
+
+        small_step, big_step, small_step2 = profiler.records
+        self.assertEqual((big_step['frame'], big_step['step']), ('frame1', 'Big step'))
+        self.assertGreater(big_step['traced_peak'], 32 * MB)
+        self.assertLess(big_step['traced_end'], 32 * MB)
+        self.assertLess(small_step2['traced_peak'], 32 * MB)  # peak is reset for each step
+
+        summary = profiler.summary()
+        self.assertEqual([step['step'] for step in summary], ['Small step', 'Big step'])
+        self.assertEqual(summary[0]['count'], 2)
+        self.assertEqual(summary[1]['frame'], 'frame1')
+        self.assertEqual(sorted(profiler.frame_summary()), ['frame1', 'frame2'])
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            profiler.report()
+        flagged = [line for line in out.getvalue().splitlines() if line.endswith('<-- largest')]
+        self.assertEqual(len(flagged), 1)
+        self.assertTrue(flagged[0].startswith('Big step'))
+
+    def test_step_key(self):
+        self.assertEqual(step_key('Segmenting 12 candidate regions separately...'),
+                         'Segmenting N candidate regions separately')
+
+    def test_diagnostics_checkpoints(self):
+        # Nothing recorded (and nothing fails) when not profiling
+        Diagnostics('frame', verbose=False).next_step('Thresholding...')
+        self.assertIsNone(profiling.profiler)
+        checkpoint('frame', 'Thresholding...')
+
+        profiler = start_profiling()
+        with redirect_stdout(io.StringIO()):
+            diag = Diagnostics('frame')
+            diag.next_step('Thresholding...')
+            diag.log('Doing watershed')
+            diag.next_step()
+            Diagnostics('crop', verbose=False).next_step('Not profiled')
+        self.assertIs(stop_profiling(), profiler)
+        self.assertEqual([(record['frame'], record['step']) for record in profiler.records],
+                         [('frame', 'Thresholding...'), ('frame', 'Doing watershed'), ('frame', 'Step 2')])
+
+        temp_dir = tempfile.mkdtemp()
+        try:
+            profiler.save(joinpath(temp_dir, 'memory_profile.txt'))
+            with open(joinpath(temp_dir, 'memory_profile.txt')) as f:
+                saved = json.load(f)
+        finally:
+            shutil.rmtree(temp_dir)
+        self.assertEqual(len(saved['records']), 3)
+        self.assertEqual(saved['summary'][0]['step'], 'Thresholding')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import shutil
+import tempfile
+from os.path import join as joinpath
+
+import numpy as np
+import tifffile as tiff
+
+from pyramid_writer import PyramidWriter, pyramid_levels, OVERLAY_COLORS
+
+
+def label_frame(offset):
+    """Label image w/ a few rectangular cells, shifted down by offset"""
+    label_img = np.zeros((600, 700), dtype=np.int64)
+    label_img[offset + 10:offset + 100, 20:300] = 1
+    label_img[offset + 200:offset + 260, 500:690] = 2
+    label_img[590:, 600:] = 70000  # bigger than uint16
+    return label_img
+
+
+class TestPyramidWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_levels(self):
+        img = np.zeros((600, 700))
+        self.assertEqual([level.shape for level in pyramid_levels(img, tile=256)], [(600, 700), (300, 350), (150, 175)])
+        self.assertEqual(len(pyramid_levels(np.zeros((100, 200)), tile=256)), 1)
+
+    def test_labels(self):
+        filename = joinpath(self.output_dir, 'labels_pyramid.tif')
+        frames = [label_frame(offset) for offset in (0, 5, 10)]
+        with PyramidWriter(filename, tile=256) as writer:
+            for label_img in frames:
+                writer.write(label_img)
+        self.assertEqual(writer.n_frames, 3)
+
+        with tiff.TiffFile(filename) as tif:
+            self.assertTrue(tif.is_bigtiff)
+            self.assertEqual(len(tif.pages), 3)
+            page = tif.pages[1]
+            self.assertTrue(page.is_tiled)
+            np.testing.assert_array_equal(page.asarray(), frames[1])
+            # Reduced levels are in the page's SubIFDs and keep valid labels
+            self.assertEqual([level.shape for level in page.pages], [(300, 350), (150, 175)])
+            np.testing.assert_array_equal(page.pages[1].asarray(), frames[1][::4, ::4])
+
+    def test_overlay(self):
+        filename = joinpath(self.output_dir, 'overlays_pyramid.tif')
+        label_img = label_frame(0)
+        with PyramidWriter(filename, overlay=True, tile=256) as writer:
+            writer.write(label_img)
+
+        with tiff.TiffFile(filename) as tif:
+            overlay = tif.pages[0].asarray()
+            self.assertEqual(overlay.shape, (600, 700, 3))
+            np.testing.assert_array_equal(overlay[50, 100], OVERLAY_COLORS[0])
+            np.testing.assert_array_equal(overlay[230, 600], OVERLAY_COLORS[1])
+            np.testing.assert_array_equal(overlay[400, 100], [0, 0, 0])
+            self.assertEqual(tif.pages[0].pages[0].asarray().shape, (300, 350, 3))
+
+    def test_tile_size(self):
+        with self.assertRaises(ValueError):
+            PyramidWriter(joinpath(self.output_dir, 'bad.tif'), tile=100)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import shutil
+import tempfile
+from os.path import join as joinpath
+
+import numpy as np
+
+from query_index import QueryIndex, ranges_to_indices
+from ndjson import write_results
+
+
+def random_frames(n_frames=6, n_cells=300, size=1000.0, seed=0):
+    rng = np.random.RandomState(seed)
+    frames = []
+    for t in range(n_frames):
+        centroids = rng.uniform(0, size, (n_cells, 2))
+        cells = [{'label': i + 1, 'centroid': (y, x), 'area': 50.0 + i, 'prev_label': i + 1, 'track': i}
+                 for i, (y, x) in enumerate(centroids)]
+        frames.append({'time': 2 * t, 'cells': cells})
+    return frames
+
+
+def brute_force(frames):
+    """Rows of (time, label, y, x)"""
+    return [(frame['time'], cell['label'], cell['centroid'][0], cell['centroid'][1])
+            for frame in frames for cell in frame['cells']]
+
+
+class TestQueryIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.frames = random_frames()
+        self.all = brute_force(self.frames)
+        self.index = QueryIndex.from_frames(self.frames, cell_size=50.0)
+
+    def found(self, rows):
+        return sorted((cell['time'], cell['label']) for cell in self.index.cells(rows))
+
+    def test_ranges_to_indices(self):
+        starts = np.array([5, 0, 3, 9])
+        stops = np.array([7, 0, 6, 10])
+        np.testing.assert_array_equal(ranges_to_indices(starts, stops), [5, 6, 3, 4, 5, 9])
+
+    def test_time_range(self):
+        self.assertEqual(len(self.index), len(self.all))
+        expected = sorted((t, label) for t, label, y, x in self.all if 3 <= t <= 8)
+        self.assertEqual(self.found(self.index.in_time_range(3, 8)), expected)
+        self.assertEqual(len(self.index.in_time_range(100, 200)), 0)
+
+    def test_region(self):
+        for y0, x0, y1, x1, t0, t1 in [(100, 200, 400, 550, 2, 6), (-50, -50, 80, 2000, None, None),
+                                       (333.3, 0, 333.4, 1000, 0, 0), (2000, 2000, 3000, 3000, None, None)]:
+            expected = sorted((t, label) for t, label, y, x in self.all
+                              if y0 <= y < y1 and x0 <= x < x1 and (t0 is None or t0 <= t <= t1))
+            self.assertEqual(self.found(self.index.in_region(y0, x0, y1, x1, t0, t1)), expected)
+
+    def test_nearest(self):
+        for y, x, t, k in [(500, 500, 4, 10), (-300, 1200, 0, 3), (10, 990, 10, 1)]:
+            dists = sorted((np.hypot(cy - y, cx - x), label) for ct, label, cy, cx in self.all if ct == t)
+            rows, found_dists = self.index.nearest(y, x, t, k)
+            self.assertEqual([cell['label'] for cell in self.index.cells(rows)], [label for _, label in dists[:k]])
+            np.testing.assert_allclose(found_dists, [d for d, _ in dists[:k]])
+
+        # More than there are
+        rows, _ = self.index.nearest(500, 500, 4, k=1000)
+        self.assertEqual(len(rows), 300)
+        rows, _ = self.index.nearest(500, 500, 5, k=3)
+        self.assertEqual(len(rows), 0)
+
+    def test_save_load(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            results_file = joinpath(tmp_dir, 'tracked_results.ndjson')
+            write_results(results_file, self.frames)
+            index = QueryIndex.from_results(results_file, cell_size=50.0)
+            index_file = joinpath(tmp_dir, 'tracked_results_index.npz')
+            index.save(index_file)
+            loaded = QueryIndex.load(index_file)
+        finally:
+            shutil.rmtree(tmp_dir)
+        rows = loaded.in_region(100, 100, 600, 600, 2, 8)
+        self.assertEqual(loaded.cells(rows), self.index.cells(self.index.in_region(100, 100, 600, 600, 2, 8)))
+        self.assertEqual(loaded.cells(rows)[0]['track'], loaded.cells(rows)[0]['label'] - 1)
+
+    def test_empty(self):
+        index = QueryIndex.from_frames([{'time': 0, 'cells': []}])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(len(index.in_region(0, 0, 10, 10)), 0)
+        self.assertEqual(len(index.nearest(0, 0, 0, 2)[0]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
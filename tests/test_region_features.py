@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+from skimage.measure import label, regionprops
+
+from region_features import region_features
+
+
+class TestRegionFeatures(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.label_img = label(rng.rand(60, 80) > 0.5, connectivity=2)
+        self.intensity_img = rng.randint(0, 1000, size=self.label_img.shape).astype(np.uint16)
+
+    def test_matches_regionprops(self):
+        features = region_features(self.label_img, self.intensity_img)
+        regions = regionprops(self.label_img, intensity_image=self.intensity_img)
+        self.assertEqual(len(features['label']), len(regions))
+        for i, region in enumerate(regions):
+            self.assertEqual(features['label'][i], region.label)
+            self.assertEqual(features['area'][i], region.area)
+            np.testing.assert_allclose((features['centroid_row'][i], features['centroid_col'][i]), region.centroid)
+            np.testing.assert_allclose(features['mu20'][i], region.moments_central[2, 0], atol=1e-6)
+            np.testing.assert_allclose(features['mu11'][i], region.moments_central[1, 1], atol=1e-6)
+            np.testing.assert_allclose(features['mu02'][i], region.moments_central[0, 2], atol=1e-6)
+            np.testing.assert_allclose(features['major_axis_length'][i], region.major_axis_length, atol=1e-6)
+            np.testing.assert_allclose(features['minor_axis_length'][i], region.minor_axis_length, atol=1e-6)
+            np.testing.assert_allclose(features['eccentricity'][i], region.eccentricity, atol=1e-6)
+            np.testing.assert_allclose(features['perimeter'][i], region.perimeter, atol=1e-6)
+            np.testing.assert_allclose(features['mean_intensity'][i], region.mean_intensity)
+            if region.area > 1 and region.minor_axis_length > 0:
+                np.testing.assert_allclose(np.cos(2 * features['orientation'][i]), np.cos(2 * region.orientation),
+                                           atol=1e-6)
+
+    def test_convex_area(self):
+        # Rectangle's hull is itself. Disc is within a few % of regionprops, which counts px inside the hull.
+        label_img = np.zeros((100, 100), dtype=np.int32)
+        label_img[10:20, 10:40] = 1
+        rr, cc = np.mgrid[:100, :100]
+        label_img[(rr - 60)**2 + (cc - 60)**2 < 25**2] = 3
+        features = region_features(label_img)
+        np.testing.assert_array_equal(features['label'], [1, 3])
+        np.testing.assert_allclose(features['convex_area'][0], 300, rtol=1e-9)
+        self.assertAlmostEqual(features['solidity'][0], 1.0)
+        disc = regionprops(label_img)[1]
+        np.testing.assert_allclose(features['convex_area'][1], disc.convex_area, rtol=0.05)
+
+    def test_empty(self):
+        features = region_features(np.zeros((5, 5), dtype=np.uint8))
+        self.assertEqual(len(features['label']), 0)
+        self.assertEqual(len(features['solidity']), 0)
@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+
+from motion_model.render_movie import walk_cells, blob_templates, panel_variation, render_frame, frame_shape
+from motion_model.benchmark_tracking import match_cells, score_tracking, benchmark_tracker
+
+
+class TestRenderMovie(unittest.TestCase):
+
+    def test_walk_cells(self):
+        shape = (600, 800)
+        positions, modes = walk_cells(50, 40, shape, speed=20.0, margin=30, seed=1)
+        self.assertEqual(positions.shape, (40, 50, 2))
+        self.assertTrue((positions >= 30).all() and (positions[..., 0] <= 570).all() and (positions[..., 1] <= 770).all())
+        # Cells only move in the constant velocity mode
+        moved = np.hypot(*np.diff(positions, axis=0).transpose(2, 0, 1)) > 0
+        self.assertFalse(moved[modes[1:] != 1].any())
+        self.assertTrue(moved.any())
+        self.assertEqual(set(np.unique(modes[1:]).tolist()) - {1, 2}, set())
+
+    def test_render_frame(self):
+        templates = blob_templates(4)
+        gain, offset = panel_variation(seed=2)
+        shape = frame_shape(4)
+        positions = np.array([[100.3, 100.7], [100.0, 300.0], [300.0, 100.0], [300.5, 300.5]])
+        img, centroids = render_frame(shape, positions, np.arange(4), templates, gain, offset, np.random.RandomState(0))
+        self.assertEqual(img.dtype, np.uint16)
+        self.assertTrue((np.abs(centroids - positions) <= 0.5).all())
+
+        # Centroid of each bright blob is where it was rendered
+        for centroid in centroids:
+            y0, x0 = (centroid - 45).astype(int)
+            crop = img[y0:y0 + 90, x0:x0 + 90] > 1000
+            ys, xs = np.nonzero(crop)
+            np.testing.assert_allclose([ys.mean() + y0, xs.mean() + x0], centroid, atol=1.0)
+
+    def test_match_cells(self):
+        truth = np.array([[0, 0], [100, 100], [200, 200]], dtype=float)
+        found = np.array([[101, 100], [2, 1], [1, 0], [500, 500]], dtype=float)
+        np.testing.assert_array_equal(match_cells(found, truth, max_dist=10), [1, -1, 0, -1])
+
+    def test_score_tracking(self):
+        # 2 true cells. Cell 0 is missed in frame 2, and the tracker then links it to cell 1.
+        frames = [{'time': 1, 'cells': [{'label': 1, 'prev_label': 0}, {'label': 2, 'prev_label': 0}]},
+                  {'time': 2, 'cells': [{'label': 1, 'prev_label': 2}]},
+                  {'time': 3, 'cells': [{'label': 1, 'prev_label': 1}, {'label': 2, 'prev_label': 0}]}]
+        true_ids = [np.array([0, 1]), np.array([1]), np.array([0, 1])]
+        scores = score_tracking(frames, true_ids, 2)
+        self.assertAlmostEqual(scores['detection_recall'], 5 / 6)
+        self.assertAlmostEqual(scores['link_recall'], 1 / 2)
+        self.assertAlmostEqual(scores['link_precision'], 1 / 2)
+
+    def test_benchmark_tracker(self):
+        positions, _ = walk_cells(200, 5, frame_shape(200), speed=5.0)
+        scores = benchmark_tracker(positions, max_displacement=30)
+        self.assertEqual(scores['detection_recall'], 1)
+        self.assertGreater(scores['link_precision'], 0.95)
+
+
+if __name__ == '__main__':
+    unittest.main()
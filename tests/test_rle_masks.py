@@ -0,0 +1,54 @@
+import unittest
+import shutil
+import tempfile
+
+import numpy as np
+from skimage.measure import label, regionprops
+
+from rle_masks import encode_labels, decode_cell, decode_frame, rle_stats, MaskStore
+
+
+class TestRLEMasks(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.label_img = label(rng.rand(60, 80) > 0.6, connectivity=2)
+
+    def test_decode_frame(self):
+        masks = encode_labels(self.label_img)
+        np.testing.assert_array_equal(decode_frame(masks), self.label_img)
+
+    def test_decode_cell(self):
+        masks = encode_labels(self.label_img)
+        for region in regionprops(self.label_img):
+            mask, bbox = decode_cell(masks, region.label)
+            self.assertEqual(bbox, tuple(region.bbox))
+            np.testing.assert_array_equal(mask, region.image)
+        self.assertRaises(KeyError, decode_cell, masks, self.label_img.max() + 1)
+
+    def test_rle_stats(self):
+        cells = rle_stats(encode_labels(self.label_img))
+        regions = regionprops(self.label_img)
+        self.assertEqual(len(cells), len(regions))
+        for cell, region in zip(cells, regions):
+            self.assertEqual(cell['label'], region.label)
+            self.assertEqual(cell['area'], region.area)
+            np.testing.assert_allclose(cell['centroid'], region.centroid)
+
+    def test_empty(self):
+        masks = encode_labels(np.zeros((5, 5), dtype=np.uint8))
+        self.assertEqual(rle_stats(masks), [])
+        np.testing.assert_array_equal(decode_frame(masks), np.zeros((5, 5)))
+
+    def test_store(self):
+        mask_dir = tempfile.mkdtemp()
+        try:
+            store = MaskStore(mask_dir)
+            store.write('frame', self.label_img)
+            np.testing.assert_array_equal(decode_frame(store.read('frame')), self.label_img)
+        finally:
+            shutil.rmtree(mask_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+import os
+import sys
+import json
+import shutil
+import subprocess
+import tempfile
+from os.path import join as joinpath
+
+import tifffile as tiff
+
+from run_pipeline import colony_output_dir, colony_output_dirs
+from journal import Journal
+from ndjson import read_ndjson
+from tests.test_segment_test import disc_frame, BRIGHT
+
+PIPELINE = joinpath(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'run_pipeline.py')
+
+
+class TestRunPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.input_dir = joinpath(self.dir, 'images')
+        self.output_dir = joinpath(self.dir, 'output')
+        os.makedirs(self.input_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_colony_output_dirs(self):
+        self.assertEqual(colony_output_dir('out', 3), joinpath('out', 'colony_3'))
+        self.assertEqual(colony_output_dir('out', None), joinpath('out', 'no_colony'))
+        # A single colony (or frames w/o any) write straight to the output dir
+        self.assertEqual(colony_output_dirs('out', {3: []}), {3: 'out'})
+        self.assertEqual(colony_output_dirs('out', {None: []}), {None: 'out'})
+        self.assertEqual(colony_output_dirs('out', {3: [], None: []}),
+                         {3: joinpath('out', 'colony_3'), None: joinpath('out', 'no_colony')})
+
+    def write_frame(self, name, n_cells):
+        """Frame w/ n_cells cells in a row"""
+        img = disc_frame((120, 80 * n_cells), [(60, 40 + 80 * i, 25, BRIGHT) for i in range(n_cells)])
+        tiff.imwrite(joinpath(self.input_dir, name + '.tif'), img)
+
+    def run_pipeline(self, *args):
+        subprocess.run([sys.executable, PIPELINE, '-m', 'watershed', '-i', self.input_dir, '-o', self.output_dir,
+                        '-t', joinpath(self.dir, 'temp')] + list(args),
+                       check=True, stdout=subprocess.DEVNULL, cwd=self.dir)
+
+    def assert_usage_error(self, *args):
+        """run_pipeline.py rejects args before reading any frames"""
+        result = subprocess.run([sys.executable, PIPELINE, '-i', self.input_dir, '-o', self.output_dir] + list(args),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, cwd=self.dir)
+        self.assertEqual(result.returncode, 2, result.stderr)
+        self.assertFalse(os.path.exists(self.output_dir))
+
+    def test_usage_errors(self):
+        self.assert_usage_error('--divisions')  # basic tracker
+        self.assert_usage_error('--divisions', '--tracker', 'basic')
+        for method in ('multiscale', 'components', 'guided'):
+            self.assert_usage_error('-m', method, '--adaptive-window', '201')
+        # The adaptive map would overwrite the threshold
+        self.assert_usage_error('--adaptive-window', '201', '--param', 'threshold=25')
+        self.assert_usage_error('-m', 'watershed', '--adaptive-window', '401', '--param', 'lo_threshold=60')
+
+    def read_results(self, output_dir):
+        with open(joinpath(output_dir, 'segmented_results.txt')) as f:
+            return [(frame['time'], len(frame['cells'])) for frame in json.load(f)]
+
+    def test_colony_layout(self):
+        for time in [1, 2, 3]:
+            self.write_frame('Colony_1_Time%04d_3x3a' % (time,), 1)
+            self.write_frame('Colony_2_Time%04d_3x3a' % (time,), 2)
+        self.write_frame('Time0002_3x3a', 3)
+
+        self.run_pipeline('--start', '2', '--stop', '3')
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ['colony_1', 'colony_2', 'no_colony'])
+        # Each colony only has its own frames in the time range
+        self.assertEqual(self.read_results(joinpath(self.output_dir, 'colony_1')), [(2, 1), (3, 1)])
+        self.assertEqual(self.read_results(joinpath(self.output_dir, 'colony_2')), [(2, 2), (3, 2)])
+        self.assertEqual(self.read_results(joinpath(self.output_dir, 'no_colony')), [(2, 3)])
+
+    def test_single_colony_layout(self):
+        for time in [1, 2]:
+            self.write_frame('Colony_1_Time%04d_3x3a' % (time,), 1)
+
+        self.run_pipeline()
+        self.assertFalse(os.path.exists(joinpath(self.output_dir, 'colony_1')))
+        self.assertEqual(self.read_results(self.output_dir), [(1, 1), (2, 1)])
+
+    def test_ndjson_results(self):
+        for time in [1, 2, 3]:
+            self.write_frame('Time%04d_3x3a' % (time,), time)
+        self.run_pipeline()
+        with open(joinpath(self.output_dir, 'segmented_results.txt')) as f:
+            expected = json.load(f)
+
+        # Streamed a frame at a time, w/ the same results
+        self.run_pipeline('--ndjson')
+        self.assertEqual(list(read_ndjson(joinpath(self.output_dir, 'segmented_results.ndjson'))), expected)
+
+        # Resumed: frames from the journal are streamed in their place, then the journal is removed
+        journal = Journal(joinpath(self.output_dir, 'segmented_results.journal'))
+        journal.append({'time': 1, 'cells': [{'label': 1, 'centroid': [5.0, 6.0], 'area': 7}], 'name': 'Time0001_3x3a'})
+        journal.close()
+        self.run_pipeline('--ndjson', '--resume')
+        results = list(read_ndjson(joinpath(self.output_dir, 'segmented_results.ndjson')))
+        self.assertEqual(results[0], {'time': 1, 'cells': [{'label': 1, 'centroid': [5.0, 6.0], 'area': 7}]})
+        self.assertEqual(results[1:], expected[1:])
+        self.assertFalse(os.path.exists(joinpath(self.output_dir, 'segmented_results.journal')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import unittest
+import io
+from contextlib import redirect_stdout
+
+import numpy as np
+
+from diagnostics import Diagnostics
+from segment_test import preprocess, segment_test, segment_multiscale, segment_components, find_candidate_boxes, filter_artifacts, \
+    get_markers, get_candidate_regions, ARTIFACT_FILTER
+
+BACKGROUND = 100
+BRIGHT = 3000  # cell markers after rescaling
+
+
+def disc_frame(shape, discs):
+    """uint16 frame of (y, x, radius, intensity) discs on a dark background"""
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    img = np.full(shape, BACKGROUND, dtype=np.uint16)
+    for y, x, radius, intensity in discs:
+        img[np.hypot(yy - y, xx - x) < radius] = intensity
+    return img
+
+
+def greyscale(img):
+    """Preprocessed greyscale image, as the segmentation functions see it"""
+    return preprocess(img, Diagnostics('frame', verbose=False))
+
+
+def quietly(segment, img, **kwargs):
+    """Run a segmentation function w/o its progress messages. Returns (cells, label image)."""
+    with redirect_stdout(io.StringIO()):
+        return segment(img, 'frame', return_labels=True, **kwargs)
+
+
+def ring(shape, y, x, outer, inner):
+    """Mask of a ring around (y, x). A disc if inner is 0."""
+    yy, xx = np.mgrid[:shape[0], :shape[1]]
+    dist = np.hypot(yy - y, xx - x)
+    return (dist < outer) & (dist >= inner)
+
+
+def artifacts_frame():
+    """uint8 greyscale frame (as after preprocess) w/ 1 region for each artifact rule and 2 real cells. Returns the
+    frame and a dict of name -> a px in each region."""
+    shape = (200, 400)
+    img = np.zeros(shape, dtype=np.uint8)
+    img[ring(shape, 50, 50, 40, 30)] = 200  # hollow ring, w/ markers and big enough
+    img[ring(shape, 50, 150, 25, 0)] = 100  # no marker px
+    img[ring(shape, 50, 250, 10, 0)] = 200  # too small
+    img[ring(shape, 150, 100, 25, 0)] = 200  # cell
+    img[ring(shape, 150, 250, 25, 3)] = 200  # cell w/ a small hole
+    points = {'ring': (50, 11), 'no_marker': (50, 150), 'small': (50, 250), 'cell': (150, 100),
+              'cell_with_hole': (150, 270)}
+    return img, points
+
+
+class TestSegmentTest(unittest.TestCase):
+
+    def test_components(self):
+        # Cells of a few sizes, 1 cut off by the image edge, 2 close enough for their padded boxes to overlap, a faint
+        #   blob, and a hollow ring for the artifact filter
+        img = disc_frame((300, 400), [(60, 60, 25, BRIGHT), (60, 160, 30, BRIGHT), (63, 213, 20, BRIGHT),
+                                      (5, 320, 28, BRIGHT), (200, 80, 20, 800), (220, 300, 24, BRIGHT)])
+        img[ring(img.shape, 220, 180, 40, 30)] = BRIGHT
+        for artifact_filter in (ARTIFACT_FILTER, None):
+            expected, expected_labels = quietly(segment_test, img, artifact_filter=artifact_filter)
+            cells, label_img = quietly(segment_components, img, artifact_filter=artifact_filter)
+            self.assert_same_cells(cells, expected)
+            np.testing.assert_array_equal(label_img > 0, expected_labels > 0)
+
+            # Labels don't depend on the number of threads
+            for workers in (2, 4):
+                threaded_cells, threaded_labels = quietly(segment_components, img, artifact_filter=artifact_filter,
+                                                          workers=workers)
+                np.testing.assert_array_equal(threaded_labels, label_img)
+                self.assertEqual([cell['label'] for cell in threaded_cells], [cell['label'] for cell in cells])
+
+    def filter_frame(self, artifact_filter):
+        """Names of the regions of artifacts_frame left after filter_artifacts"""
+        img, points = artifacts_frame()
+        candidate_regions = get_candidate_regions(img)
+        markers = get_markers(img)
+        n_removed = filter_artifacts(img, candidate_regions, markers, artifact_filter)
+        kept = sorted(name for name, point in points.items() if candidate_regions[point] > 0)
+        # Removed regions become background markers
+        for name, point in points.items():
+            if name not in kept:
+                self.assertEqual(markers[point], 1)
+        self.assertEqual(n_removed, len(points) - len(kept))
+        return kept
+
+    def test_filter_artifacts(self):
+        self.assertEqual(self.filter_frame(ARTIFACT_FILTER), ['cell', 'cell_with_hole'])
+
+    def test_filter_rules_off(self):
+        # Each rule set to None only keeps the regions it would have removed
+        self.assertEqual(self.filter_frame(dict(ARTIFACT_FILTER, min_area=None)), ['cell', 'cell_with_hole', 'small'])
+        self.assertEqual(self.filter_frame(dict(ARTIFACT_FILTER, require_marker=None)),
+                         ['cell', 'cell_with_hole', 'no_marker'])
+        self.assertEqual(self.filter_frame(dict(ARTIFACT_FILTER, max_ring_fill_ratio=None)),
+                         ['cell', 'cell_with_hole', 'ring'])
+        self.assertEqual(self.filter_frame(dict(ARTIFACT_FILTER, min_ring_circularity=None)),
+                         ['cell', 'cell_with_hole', 'ring'])
+        # Off by default. The marker-less region is also dim.
+        self.assertEqual(self.filter_frame(dict(ARTIFACT_FILTER, require_marker=None, min_mean_intensity=150)),
+                         ['cell', 'cell_with_hole'])
+
+    def test_default_keeps_hollow_cells(self):
+        # A hollow but real cell (round w/ a dim middle), a plain cell, a cell w/ a small hole, and regions the filter
+        #   would also remove: a small one and 1 w/o markers
+        img = np.full((250, 300), BACKGROUND, dtype=np.uint16)
+        img[ring(img.shape, 60, 60, 45, 35)] = BRIGHT
+        img[ring(img.shape, 60, 200, 25, 0)] = BRIGHT
+        img[ring(img.shape, 150, 200, 25, 3)] = BRIGHT
+        img[ring(img.shape, 200, 60, 8, 0)] = BRIGHT
+        img[ring(img.shape, 200, 130, 20, 0)] = 800
+        unfiltered, unfiltered_labels = quietly(segment_test, img, artifact_filter=None)
+        self.assertEqual(len(unfiltered), 3)
+
+        # The filter is off by default, so the hollow cell is kept
+        cells, label_img = quietly(segment_test, img)
+        self.assertEqual(cells, unfiltered)
+        np.testing.assert_array_equal(label_img, unfiltered_labels)
+
+        # Only asking for the filter drops it
+        filtered = quietly(segment_test, img, artifact_filter=ARTIFACT_FILTER)[0]
+        self.assertEqual(len(filtered), 2)
+        self.assertEqual(sorted(cell['area'] for cell in filtered), sorted(cell['area'] for cell in unfiltered)[:2])
+
+    def assert_same_cells(self, cells, expected):
+        self.assertEqual(len(cells), len(expected))
+        # Labels are numbered in a different order, so compare by position
+        cells = sorted(cells, key=lambda cell: tuple(cell['centroid']))
+        expected = sorted(expected, key=lambda cell: tuple(cell['centroid']))
+        np.testing.assert_array_equal([cell['area'] for cell in cells], [cell['area'] for cell in expected])
+        np.testing.assert_allclose([cell['centroid'] for cell in cells], [cell['centroid'] for cell in expected])
+
+    def test_multiscale(self):
+        # Sparse frame: an isolated cell, 2 cells close enough for their padded boxes to merge, a cell cut off by the
+        #   image edge, and a faint blob that isn't a cell
+        img = disc_frame((400, 500), [(100, 100, 25, BRIGHT), (300, 200, 22, BRIGHT), (300, 252, 24, BRIGHT),
+                                      (8, 400, 30, BRIGHT), (200, 420, 20, 800)])
+        expected, expected_labels = quietly(segment_test, img)
+        self.assertEqual(len(expected), 4)
+        for downscale in (4, 8):
+            cells, label_img = quietly(segment_multiscale, img, downscale=downscale)
+            self.assert_same_cells(cells, expected)
+            np.testing.assert_array_equal(label_img > 0, expected_labels > 0)
+
+    def test_multiscale_no_candidates(self):
+        # Only specks too small to be cells
+        img = disc_frame((200, 300), [(50, 50, 3, BRIGHT), (150, 250, 2, BRIGHT)])
+        self.assertEqual(find_candidate_boxes(greyscale(img), 8, 16), [])
+        cells, label_img = quietly(segment_multiscale, img)
+        self.assertEqual(cells, [])
+        self.assertFalse(label_img.any())
+        self.assertEqual(quietly(segment_test, img)[0], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import shutil
+import tempfile
+from os.path import join as joinpath
+
+import numpy as np
+import tifffile as tiff
+
+from frame_index import FrameIndex, read_frame
+from shared_frames import FrameRing, frame_bytes, segment_shared
+from rle_masks import MaskStore, decode_frame
+
+
+def threshold_segment(img, name, return_labels=False, threshold=0):
+    """Stand-in segmentation: 1 cell of all px > threshold"""
+    label_img = (img > threshold).astype(np.uint8)
+    cells = [{'label': 1, 'area': int(label_img.sum())}]
+    return (cells, label_img) if return_labels else cells
+
+
+class TestSharedFrames(unittest.TestCase):
+
+    def setUp(self):
+        self.input_dir = tempfile.mkdtemp()
+        for time in range(1, 6):
+            img = np.zeros((20, 30), dtype=np.uint16)
+            img[:time, :] = 1000 * time
+            tiff.imwrite(joinpath(self.input_dir, 'Colony_1_Time%04d_3x3a.tif' % (time,)), img)
+        self.index = FrameIndex(self.input_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir)
+
+    def test_ring(self):
+        frame = self.index.frames()[2]
+        self.assertEqual(frame_bytes(frame), 20 * 30 * 2)
+        ring = FrameRing(frame_bytes(frame), n_slots=2)
+        try:
+            slot = ring.slot(1, frame['shape'], frame['dtype'])
+            read_frame(self.input_dir, frame, out=slot)
+            np.testing.assert_array_equal(slot, read_frame(self.input_dir, frame))
+
+            # Another process would attach by name and see the same px
+            attached = FrameRing(ring.slot_bytes, ring.n_slots, name=ring.name)
+            np.testing.assert_array_equal(attached.slot(1, frame['shape'], frame['dtype']), slot)
+            del slot
+            with self.assertRaises(ValueError):
+                ring.slot(0, (21, 30), 'uint16')
+            attached.shm.close()
+        finally:
+            ring.close()
+            ring.unlink()
+
+    def test_segment_shared(self):
+        frames = self.index.frames()
+        mask_dir = joinpath(self.input_dir, 'masks')
+        MaskStore(mask_dir)
+        results = list(segment_shared(frames, self.input_dir, threshold_segment, workers=2, n_slots=3,
+                                      mask_dir=mask_dir, threshold=2500))
+        self.assertEqual([frame['name'] for frame, _ in results], [frame['name'] for frame in frames])
+        # Frames 1 and 2 are all below the threshold
+        self.assertEqual([cells[0]['area'] for _, cells in results], [0, 0, 90, 120, 150])
+        label_img = decode_frame(MaskStore(mask_dir).read(frames[3]['name']))
+        self.assertEqual(int(label_img.sum()), 120)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import unittest
+import random
+from math import sqrt
+
+from spatial_hash import SpatialHash
+
+
+class TestSpatialHash(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+        self.points = [(random.uniform(-50, 50), random.uniform(-50, 50)) for i in range(500)]
+
+    def brute_force(self, point, radius):
+        found = []
+        for i, other in enumerate(self.points):
+            dist = sqrt((point[0] - other[0])**2 + (point[1] - other[1])**2)
+            if dist <= radius:
+                found.append((dist, i))
+        return sorted(found)
+
+    def test_neighbours(self):
+        for cell_size, radius in [(5, 5), (2, 7), (10, 3)]:
+            grid = SpatialHash(cell_size, self.points)
+            self.assertEqual(len(grid), len(self.points))
+            for point in [(0, 0), (-49, 12.5), (33, -7)]:
+                self.assertEqual(sorted(grid.neighbours(point, radius)), self.brute_force(point, radius))
+
+    def test_nearest(self):
+        grid = SpatialHash(5, self.points)
+        self.assertEqual(grid.nearest((0, 0), 10), self.brute_force((0, 0), 10)[0])
+        self.assertIsNone(SpatialHash(5).nearest((0, 0), 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
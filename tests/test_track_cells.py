@@ -0,0 +1,60 @@
+import unittest
+import random
+from math import hypot
+
+from track_cells import track_cells_basic, track_cells_gated
+
+
+def make_frame(time, centroids):
+    cells = [{'label': i + 1, 'centroid': centroid, 'area': 100} for i, centroid in enumerate(centroids)]
+    return {'time': time, 'cells': cells}
+
+
+class TestTrackCells(unittest.TestCase):
+
+    def test_basic(self):
+        frames = [make_frame(1, [(0, 0), (100, 100)]),
+                  make_frame(2, [(98, 101), (1, 2)])]
+        tracked = track_cells_basic(frames)
+        self.assertEqual([cell['prev_label'] for cell in tracked[0]['cells']], [0, 0])
+        self.assertEqual([cell['prev_label'] for cell in tracked[1]['cells']], [2, 1])
+
+    def test_gated(self):
+        frames = [make_frame(1, [(0, 0), (100, 100)]),
+                  make_frame(2, [(98, 101), (1, 2), (500, 500)])]
+        tracked = track_cells_gated(frames, max_displacement=10)
+        self.assertEqual([cell['prev_label'] for cell in tracked[0]['cells']], [0, 0])
+        # Far away cell starts a new track instead of being linked to the closest cell
+        self.assertEqual([cell['prev_label'] for cell in tracked[1]['cells']], [2, 1, 0])
+
+    def test_gated_one_to_one(self):
+        # 2 cells both closest to the same previous cell: only the closer one continues its track
+        frames = [make_frame(1, [(0, 0)]),
+                  make_frame(2, [(0, 5), (0, 2)])]
+        tracked = track_cells_gated(frames, max_displacement=10)
+        self.assertEqual([cell['prev_label'] for cell in tracked[1]['cells']], [0, 1])
+
+    def test_gated_matches_brute_force(self):
+        # Spatial hash lookups give the same links as comparing every pair. Cells are dense enough that many have more
+        #   than 1 previous cell in range.
+        random.seed(0)
+        max_displacement = 5
+        prev = [(random.uniform(0, 200), random.uniform(0, 200)) for i in range(300)]
+        moved = [(y + random.uniform(-3, 3), x + random.uniform(-3, 3)) for y, x in prev]
+        tracked = track_cells_gated([make_frame(1, prev), make_frame(2, moved)], max_displacement=max_displacement)
+
+        # Every pair in range, closest first, each cell and previous cell linked at most once
+        pairs = sorted((hypot(y - prev_y, x - prev_x), i, j) for i, (y, x) in enumerate(moved)
+                       for j, (prev_y, prev_x) in enumerate(prev) if hypot(y - prev_y, x - prev_x) <= max_displacement)
+        expected = [0] * len(moved)
+        linked_prev = set()
+        for dist, i, j in pairs:
+            if expected[i] == 0 and j not in linked_prev:
+                expected[i] = j + 1
+                linked_prev.add(j)
+
+        self.assertGreater(sum(1 for dist, i, j in pairs if i != j), 100)  # the test isn't trivial
+        self.assertEqual([cell['prev_label'] for cell in tracked[1]['cells']], expected)
+
+if __name__ == '__main__':
+    unittest.main()
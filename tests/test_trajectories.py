@@ -0,0 +1,130 @@
+import unittest
+
+import numpy as np
+
+from track_cells import track_cells_gated
+from gap_closing import close_gaps
+from lineage import detect_divisions, build_lineage
+from query_index import frames_to_columns
+from trajectories import link_tracks, track_columns, ragged_tracks, padded_tracks, velocities, speeds, \
+    turning_angles, msd, track_msd, ensemble_msd, fit_msd, motion_modes, STATIONARY, CONSTANT_VELOCITY, TURNING
+
+
+def brute_force_msd(positions):
+    n_frames = positions.shape[1]
+    result = np.full(positions.shape[:2], np.nan)
+    counts = np.zeros(positions.shape[:2])
+    for i, track in enumerate(positions):
+        for lag in range(n_frames):
+            d2 = ((track[lag:] - track[:n_frames - lag])**2).sum(axis=1)
+            d2 = d2[~np.isnan(d2)]
+            counts[i, lag] = len(d2)
+            if len(d2) > 0:
+                result[i, lag] = d2.mean()
+    return result, counts
+
+
+def random_walk_frames(n_frames=30, n_cells=40, step=2.0, seed=0):
+    """Frames of cells taking random steps, far enough apart that the gated tracker links them right. Cells are
+    sometimes missed."""
+    rng = np.random.RandomState(seed)
+    start = np.stack(np.meshgrid(np.arange(8), np.arange(5)), axis=-1).reshape(-1, 2)[:n_cells] * 200.0 + 1000
+    paths = start + np.cumsum(rng.normal(0, step, (n_frames, n_cells, 2)), axis=0)
+    frames = []
+    for t in range(n_frames):
+        seen = rng.uniform(size=n_cells) > 0.05
+        cells = [{'label': i + 1, 'centroid': tuple(paths[t, j]), 'area': 100.0}
+                 for i, j in enumerate(np.flatnonzero(seen))]
+        frames.append({'time': 10 + t, 'cells': cells})
+    return frames
+
+
+class TestTrajectories(unittest.TestCase):
+
+    def test_link_tracks_like_lineage(self):
+        frames = random_walk_frames()
+        # Make a division: the 1st cell of frame 15 gets 2 daughters
+        y, x = frames[15]['cells'][0]['centroid']
+        frames[16]['cells'][0].update({'centroid': (y + 5, x), 'area': 50.0})
+        frames[16]['cells'].append({'label': len(frames[16]['cells']) + 1, 'centroid': (y - 5, x), 'area': 50.0})
+        track_cells_gated(frames, max_displacement=30)
+        detect_divisions(frames, max_displacement=30)
+        close_gaps(frames, max_gap=2, max_displacement=30)
+        build_lineage(frames)
+        self.assertTrue(any('prev_time' in cell for frame in frames for cell in frame['cells']))
+
+        columns = frames_to_columns(frames)
+        tracks = link_tracks(columns)
+        # Same partition of cells into tracks as build_lineage
+        pairs = set(zip(columns['track'].tolist(), tracks.tolist()))
+        self.assertEqual(len(pairs), len(set(columns['track'].tolist())))
+        self.assertEqual(len(pairs), len(set(tracks.tolist())))
+
+    def test_padded_tracks(self):
+        frames = [{'time': 0, 'cells': [{'label': 1, 'centroid': (0, 0), 'area': 1}]},
+                  {'time': 2, 'cells': [{'label': 1, 'centroid': (0, 2), 'area': 1, 'prev_label': 1},
+                                        {'label': 2, 'centroid': (50, 50), 'area': 1, 'prev_label': 0}]},
+                  {'time': 4, 'cells': [{'label': 1, 'centroid': (50, 52), 'area': 1, 'prev_label': 2}]},
+                  {'time': 6, 'cells': [{'label': 1, 'centroid': (2, 4), 'area': 1, 'prev_label': 1,
+                                         'prev_time': 2}]}]
+        columns = track_columns(frames)
+        order, offsets = ragged_tracks(columns)
+        np.testing.assert_array_equal(offsets, [0, 3, 5])
+        positions, times = padded_tracks(columns, order, offsets)
+        np.testing.assert_array_equal(times, [[0, 2, np.nan, 6], [2, 4, np.nan, np.nan]])
+        np.testing.assert_array_equal(positions[0, 3], [2, 4])
+
+        velocity = velocities(positions, times)
+        np.testing.assert_allclose(velocity[0, 0], [0, 1])
+        self.assertTrue(np.isnan(velocity[0, 1:]).all())
+        np.testing.assert_allclose(speeds(velocity)[1, 0], 1)
+
+    def test_turning_angles(self):
+        velocity = np.array([[[0, 1], [1, 0], [1, 0], [0, 0], [0, 1]]], dtype=float)  # (y, x): along x, then y
+        angles = turning_angles(velocity)
+        np.testing.assert_allclose(angles[0, :2], [np.pi / 2, 0])
+        self.assertTrue(np.isnan(angles[0, 2:]).all())
+
+    def test_msd(self):
+        rng = np.random.RandomState(1)
+        positions = np.cumsum(rng.normal(0, 1, (5, 40, 2)), axis=1) + 3000
+        positions[rng.uniform(size=(5, 40)) < 0.2] = np.nan
+        positions[2, 30:] = np.nan
+        result, counts = msd(positions)
+        expected, expected_counts = brute_force_msd(positions)
+        np.testing.assert_array_equal(counts, expected_counts)
+        np.testing.assert_allclose(result, expected, rtol=1e-6, atol=1e-6)
+
+    def test_track_msd_chunks(self):
+        columns = track_columns(track_cells_gated(random_walk_frames(), max_displacement=30))
+        result, counts = track_msd(columns, max_lag=10)
+        chunked, chunked_counts = track_msd(columns, max_lag=10, chunk_tracks=7)
+        self.assertEqual(result.shape[1], 11)
+        np.testing.assert_allclose(chunked, result)
+        np.testing.assert_array_equal(chunked_counts, counts)
+        # Random walk w/ steps of std 2 per axis
+        np.testing.assert_allclose(ensemble_msd(result, counts)[1:4], [8, 16, 24], rtol=0.2)
+
+    def test_fit_msd(self):
+        rng = np.random.RandomState(2)
+        n = 200
+        t = np.arange(n)
+        still = np.zeros((n, 2)) + rng.normal(0, 0.1, (n, 2))
+        moving = np.outer(t, [0.6, 0.8]) + rng.normal(0, 0.1, (n, 2))
+        walking = np.cumsum(rng.normal(0, 1, (n, 2)), axis=0)
+        result, counts = msd(np.stack([still, moving, walking]))
+        fit = fit_msd(result, counts, max_lag=20)
+        np.testing.assert_allclose(fit['speed'][1], 1, rtol=0.05)
+        np.testing.assert_allclose(fit['noise'][0], 0.1, rtol=0.3)
+        np.testing.assert_allclose(fit['diffusion'][2], 0.5, rtol=0.5)
+        self.assertEqual(motion_modes(fit['alpha']).tolist(), [STATIONARY, CONSTANT_VELOCITY, TURNING])
+
+        # Too short to fit
+        result, counts = msd(np.zeros((1, 2, 2)))
+        fit = fit_msd(result, counts)
+        self.assertTrue(np.isnan(fit['alpha'][0]) and np.isnan(fit['speed'][0]))
+        self.assertEqual(motion_modes(fit['alpha'])[0], -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
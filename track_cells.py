@@ -1,8 +1,12 @@
 # Simple cell tracking
+import os
 from os.path import join as joinpath
 import json
 from math import sqrt
 
+from spatial_hash import SpatialHash
+from ndjson import read_results, NDJSONWriter
+
 
 def get_dist(point1, point2):
     """Get Euclidean distance between two points, each a tuple/list of the form (x,y)"""
@@ -24,44 +28,111 @@ def get_shortest_dist(this_point, other_points):
     return min_dist, other_point_ind
 
 
+# Dummy previous frame for the 1st frame. Every cell in the 1st frame points to label 0.
+FIRST_FRAME_PREV_CELLS = [{'label': 0, 'centroid': [-1, -1]}]
+
+
+def link_cells_basic(cells, prev_cells):
+    """Set the prev_label of each cell in cells to the label of the closest cell in prev_cells. Used to track 1 frame
+    at a time, e.g., when segmentation needs the tracked cells of the previous frame."""
+    if len(prev_cells) == 0:
+        prev_cells = FIRST_FRAME_PREV_CELLS
+
+    prev_labels = [prev_cell['label'] for prev_cell in prev_cells]
+    prev_centroids = [prev_cell['centroid'] for prev_cell in prev_cells]  # same order as prev_labels
+
+    for cell in cells:
+        min_dist, prev_label_ind = get_shortest_dist(cell['centroid'], prev_centroids)
+        cell['prev_label'] = prev_labels[prev_label_ind]
+
+
 def track_cells_basic(segmented_stats):
     """Build cell trajectories. Basically add a field to each cell inside segmented_stats that says what its previous
     label was. Cells in the first frame have dummy pre_label's that point to label 0."""
 
-    # Make dummy previous components for 1st frame
-    # These get updated at the end of each iteration
-    prev_labels = [0]
-    prev_centroids = [[-1, -1]]  # same order as prev_labels
+    for frame in iter_track_cells_basic(segmented_stats):
+        pass
 
-    for frame in segmented_stats:
+    return segmented_stats
 
-        for cell in frame['cells']:
-            min_dist, prev_label_ind = get_shortest_dist(cell['centroid'], prev_centroids)
-            cell['prev_label'] = prev_labels[prev_label_ind]
 
-        prev_labels = []
-        prev_centroids = []
-        for cell in frame['cells']:
-            prev_labels.append(cell['label'])
-            prev_centroids.append(cell['centroid'])
+def iter_track_cells_basic(frames):
+    """Generator version of track_cells_basic. Tracks and yields each frame as it comes, so frames can be streamed from
+    and to disk w/o keeping them all in memory."""
+
+    # Make dummy previous components for 1st frame
+    # These get updated at the end of each iteration
+    prev_cells = FIRST_FRAME_PREV_CELLS
+
+    for frame in frames:
+        link_cells_basic(frame['cells'], prev_cells)
+        yield frame
+        prev_cells = frame['cells']
+
+
+def link_cells_gated(cells, prev_cells, max_displacement):
+    """Set the prev_label of each cell in cells to the label of a cell in prev_cells at most max_displacement away.
+    Each previous cell continues at most 1 track: the closest (cell, previous cell) pairs are linked first. Cells w/o
+    a previous cell in range start new tracks, with a prev_label of 0.
+
+    Neighbours are found with a spatial hash, so this takes linear time in the number of cells (plus sorting the
+    candidate pairs, of which there are only a few per cell)."""
+    grid = SpatialHash(max_displacement, [prev_cell['centroid'] for prev_cell in prev_cells])
+
+    candidates = []  # (distance, index of cell, index of previous cell)
+    for i, cell in enumerate(cells):
+        for dist, j in grid.neighbours(cell['centroid'], max_displacement):
+            candidates.append((dist, i, j))
+    candidates.sort()
+
+    prev_labels = [0] * len(cells)
+    linked_cells = set()
+    linked_prev_cells = set()
+    for dist, i, j in candidates:
+        if i in linked_cells or j in linked_prev_cells:
+            continue
+        prev_labels[i] = prev_cells[j]['label']
+        linked_cells.add(i)
+        linked_prev_cells.add(j)
+
+    for cell, prev_label in zip(cells, prev_labels):
+        cell['prev_label'] = prev_label
+
+
+def track_cells_gated(segmented_stats, max_displacement):
+    """Build cell trajectories like track_cells_basic, but only link cells that moved at most max_displacement px
+    between frames, and only 1 cell to each previous cell. Cells that appear (including every cell in the 1st frame)
+    start new tracks with a prev_label of 0, and tracks of cells that vanish just end."""
+    prev_cells = []
+    for frame in segmented_stats:
+        link_cells_gated(frame['cells'], prev_cells, max_displacement)
+        prev_cells = frame['cells']
 
     return segmented_stats
 
 
 if __name__ == "__main__":
     output_dir = 'output'
-    segmented_results_file = joinpath(output_dir, 'segmented_results.txt')
-
-    with open(segmented_results_file) as f:
-        segmented_results = json.load(f)
-
-    print('Tracking cells')
-    tracked_results = track_cells_basic(segmented_results)
 
-    # Output results
-    print('Outputting tracked results in JSON format')
-    tracked_results_file = joinpath(output_dir, 'tracked_results.txt')
-    with open(tracked_results_file, 'w') as f:
-        json.dump(tracked_results, f, cls=json.JSONEncoder, indent=4, sort_keys=True)
+    # Stream NDJSON results frame by frame if there are any, otherwise load the whole JSON document
+    segmented_results_file = joinpath(output_dir, 'segmented_results.ndjson')
+    if os.path.exists(segmented_results_file):
+        tracked_results_file = joinpath(output_dir, 'tracked_results.ndjson')
+        print('Tracking cells')
+        with NDJSONWriter(tracked_results_file) as writer:
+            for frame in iter_track_cells_basic(read_results(segmented_results_file)):
+                writer.write(frame)
+    else:
+        segmented_results_file = joinpath(output_dir, 'segmented_results.txt')
+        segmented_results = read_results(segmented_results_file)
+
+        print('Tracking cells')
+        tracked_results = track_cells_basic(segmented_results)
+
+        # Output results
+        print('Outputting tracked results in JSON format')
+        tracked_results_file = joinpath(output_dir, 'tracked_results.txt')
+        with open(tracked_results_file, 'w') as f:
+            json.dump(tracked_results, f, cls=json.JSONEncoder, indent=4, sort_keys=True)
 
     print('done.')
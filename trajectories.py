@@ -0,0 +1,292 @@
+# Motility statistics of tracked cells: velocities, speeds, turning angles, and mean squared displacement (MSD)
+#   Tracks are kept as arrays instead of following prev_label chains cell by cell:
+#   - ragged: rows of the cell columns (query_index.frames_to_columns) sorted by (track, frame), plus the offset where
+#     each track starts
+#   - padded: (tracks, frames, 2) array of (y, x) positions per track from its 1st frame, NaN where the track has no cell
+#     (after it ends, or frames it skipped via gap closing)
+#   Padded arrays are built a chunk of tracks at a time, so memory stays bounded on big experiments.
+#
+#   MSD for every lag uses FFTs: the sum over i of |r[i+m] - r[i]|^2 expands into |r[i+m]|^2 + |r[i]|^2 - 2 r[i].r[i+m],
+#   and each of those, weighted by which frames are present, is a cross-correlation. That's O(n log n) per track instead
+#   of O(n^2), for all tracks of a chunk at once, and handles gaps exactly.
+#
+#   Fits are for the modes of motion_model.CellWalker: stationary (MSD flat at the measurement noise), constant velocity
+#   (ballistic, MSD ~ lag^2), and stopping to turn (a random walk, MSD ~ lag at long lags).
+
+import os
+from os.path import join as joinpath
+
+import numpy as np
+
+from query_index import frames_to_columns
+from ndjson import read_results
+
+CHUNK_TRACKS = 4096
+
+# CellWalker modes, and the MSD exponent alpha separating them
+STATIONARY, CONSTANT_VELOCITY, TURNING = 0, 1, 2
+MOTION_MODE_ALPHAS = (0.5, 1.5)
+
+
+def link_tracks(columns):
+    """Get the track id of each row of cell columns (from query_index.frames_to_columns). Same rules as
+    lineage.build_lineage: a cell continues the track of its previous cell if it's the only cell pointing to it, and
+    starts a new track otherwise. Follows prev_time links across gaps. Tracks are numbered by where they start."""
+    frame, label = columns['frame'], columns['label']
+    prev_label, prev_time = columns['prev_label'], columns['prev_time']
+    n = len(frame)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Rows sorted by (frame, label), to look up the previous cells
+    n_labels = int(max(label.max(), prev_label.max())) + 1
+    keys = frame * n_labels + label
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+
+    # Frame of each previous cell. prev_time is looked up among the times of the frames w/ cells.
+    frame_times, first_rows = np.unique(columns['time'], return_index=True)
+    frames_of_times = frame[first_rows]
+    time_pos = np.searchsorted(frame_times, prev_time).clip(max=len(frame_times) - 1)
+    prev_frame = np.where(prev_time >= 0, frames_of_times[time_pos], frame - 1)
+    valid = (prev_label > 0) & (prev_frame >= 0) & ((prev_time < 0) | (frame_times[time_pos] == prev_time))
+
+    parent_keys = prev_frame * n_labels + prev_label
+    pos = np.searchsorted(sorted_keys, parent_keys).clip(max=n - 1)
+    parent = order[pos]
+    has_parent = valid & (sorted_keys[pos] == parent_keys)
+
+    # Continue the parent's track if it's an only child
+    n_children = np.bincount(parent[has_parent], minlength=n)
+    link = np.where(has_parent & (n_children[parent] == 1), parent, np.arange(n))
+
+    # Follow links to the 1st cell of each track by pointer jumping: log2(track length) passes
+    root = link
+    while True:
+        next_root = root[root]
+        if np.array_equal(next_root, root):
+            break
+        root = next_root
+
+    # Number tracks in (frame, label) order of their 1st cells
+    rank = np.empty(n, dtype=np.int64)
+    rank[order] = np.arange(n)
+    _, track = np.unique(rank[root], return_inverse=True)
+    return track.reshape(-1)
+
+
+def track_columns(frames):
+    """Get cell columns of tracked frames with a 'track' column from link_tracks"""
+    columns = frames_to_columns(frames)
+    columns['track'] = link_tracks(columns)
+    return columns
+
+
+def ragged_tracks(columns):
+    """Get (order, offsets): rows of columns sorted by (track, frame), and the index into order where each track
+    starts (plus 1 past the end), so track i is columns[...][order[offsets[i]:offsets[i + 1]]]"""
+    track = columns['track']
+    order = np.lexsort((columns['frame'], track))
+    n_tracks = int(track.max()) + 1 if len(track) > 0 else 0
+    offsets = np.searchsorted(track[order], np.arange(n_tracks + 1))
+    return order, offsets
+
+
+def padded_tracks(columns, order, offsets, first=0, last=None):
+    """Get (positions, times) of tracks first:last as padded arrays
+
+    Returns:
+        positions: (tracks, frames, 2) array of the (y, x) centroid in each frame from the track's 1st frame on. NaN if
+            the track has no cell in that frame.
+        times: (tracks, frames) array of the frame times, NaN where positions are
+    """
+    if last is None:
+        last = len(offsets) - 1
+    rows = order[offsets[first]:offsets[last]]
+    n_tracks = last - first
+    if len(rows) == 0:
+        return np.full((n_tracks, 0, 2), np.nan), np.full((n_tracks, 0), np.nan)
+
+    track = columns['track'][rows] - first
+    frame = columns['frame'][rows]
+    start_frame = columns['frame'][order[offsets[first:last]]]
+    step = frame - start_frame[track]
+    n_frames = int(step.max()) + 1
+
+    positions = np.full((n_tracks, n_frames, 2), np.nan)
+    positions[track, step, 0] = columns['y'][rows]
+    positions[track, step, 1] = columns['x'][rows]
+    times = np.full((n_tracks, n_frames), np.nan)
+    times[track, step] = columns['time'][rows]
+    return positions, times
+
+
+def velocities(positions, times):
+    """Get (tracks, frames - 1, 2) array of the (y, x) velocity between consecutive frames of padded tracks. NaN across
+    gaps."""
+    return np.diff(positions, axis=1) / np.diff(times, axis=1)[..., np.newaxis]
+
+
+def speeds(velocity):
+    return np.hypot(velocity[..., 0], velocity[..., 1])
+
+
+def turning_angles(velocity):
+    """Get (tracks, frames - 2) array of the angle in radians (-pi..pi) each track turned by between consecutive
+    velocities. Positive is counterclockwise in (x, y) coordinates. NaN if the cell stood still on either side."""
+    v1 = velocity[:, :-1]
+    v2 = velocity[:, 1:]
+    cross = v1[..., 1] * v2[..., 0] - v1[..., 0] * v2[..., 1]
+    dot = v1[..., 0] * v2[..., 0] + v1[..., 1] * v2[..., 1]
+    angles = np.arctan2(cross, dot)
+    angles[(speeds(v1) == 0) | (speeds(v2) == 0)] = np.nan
+    return angles
+
+
+def correlate(a, b, n_fft, n_lags):
+    """Sum over i of a[..., i] * b[..., i + m] for lags m = 0..n_lags - 1 along the last axis"""
+    return np.fft.irfft(np.conj(np.fft.rfft(a, n_fft)) * np.fft.rfft(b, n_fft), n_fft)[..., :n_lags]
+
+
+def msd(positions):
+    """Get (msd, counts) of padded tracks (from padded_tracks) for every lag in frames 0..frames - 1: the mean squared
+    displacement over all pairs of frames that far apart where the track has a cell in both, and the number of those
+    pairs. msd is NaN where counts is 0."""
+    n_tracks, n_frames = positions.shape[:2]
+    present = ~np.isnan(positions).any(axis=2)
+    weight = present.astype(np.float64)
+    # Relative to each track's mean position, which doesn't change the MSD but keeps FFT rounding errors small
+    n_present = np.maximum(present.sum(axis=1), 1)[:, np.newaxis]
+    center = np.where(present[..., np.newaxis], positions, 0).sum(axis=1) / n_present
+    r = np.where(present[..., np.newaxis], positions - center[:, np.newaxis], 0)
+    r2 = (r**2).sum(axis=2)
+    n_fft = 1 << max(2*n_frames - 1, 1).bit_length()  # long enough that lags don't wrap around
+
+    counts = np.rint(correlate(weight, weight, n_fft, n_frames))
+    sums = correlate(weight, r2, n_fft, n_frames) + correlate(r2, weight, n_fft, n_frames)
+    for dim in range(positions.shape[2]):
+        sums -= 2 * correlate(r[..., dim], r[..., dim], n_fft, n_frames)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result = np.where(counts > 0, np.maximum(sums, 0) / counts, np.nan)
+    result[:, 0] = np.where(counts[:, 0] > 0, 0, np.nan)
+    return result, counts
+
+
+def track_msd(columns, max_lag=None, chunk_tracks=CHUNK_TRACKS):
+    """Get (msd, counts) of every track in cell columns (from track_columns) for lags 0..max_lag frames, computed
+    chunk_tracks tracks at a time. Defaults to every lag of the longest track."""
+    order, offsets = ragged_tracks(columns)
+    n_tracks = len(offsets) - 1
+    if max_lag is None:
+        first_frame = columns['frame'][order[offsets[:-1]]]
+        last_frame = columns['frame'][order[offsets[1:] - 1]]
+        max_lag = int((last_frame - first_frame).max()) if n_tracks > 0 else 0
+
+    result = np.full((n_tracks, max_lag + 1), np.nan)
+    counts = np.zeros((n_tracks, max_lag + 1))
+    for first in range(0, n_tracks, chunk_tracks):
+        last = min(first + chunk_tracks, n_tracks)
+        positions, _ = padded_tracks(columns, order, offsets, first, last)
+        chunk_msd, chunk_counts = msd(positions)
+        n_lags = min(max_lag + 1, chunk_msd.shape[1])
+        result[first:last, :n_lags] = chunk_msd[:, :n_lags]
+        counts[first:last, :n_lags] = chunk_counts[:, :n_lags]
+    return result, counts
+
+
+def ensemble_msd(msd, counts):
+    """MSD over all tracks for each lag, weighting each track by its number of pairs"""
+    with np.errstate(invalid='ignore'):
+        return np.nansum(msd * counts, axis=0) / counts.sum(axis=0)
+
+
+def fit_msd(msd, counts, dt=1.0, max_lag=None):
+    """Fit the MSD of each track for lags 1..max_lag (weighted by counts) by noise + diffusion + drift, i.e.
+    msd = 4 sigma^2 + 4 D tau + v^2 tau^2 in 2-D at lag time tau, and by a power law msd ~ tau^alpha.
+
+    Args:
+        msd, counts: From msd or track_msd
+        dt (float): Time between frames
+        max_lag (int): Last lag to fit. Long lags have few pairs and are noisy, so fitting the 1st quarter or so of the
+            track is typical. Defaults to all.
+
+    Returns:
+        dict of arrays with 1 value per track: noise (sigma), diffusion (D), speed (v), and alpha. NaN if the track has
+        too few lags to fit.
+    """
+    if max_lag is None:
+        max_lag = msd.shape[1] - 1
+    y = msd[:, 1:max_lag + 1]
+    w = np.where(np.isnan(y), 0, counts[:, 1:max_lag + 1])
+    y = np.where(w > 0, y, 0)
+    tau = dt * np.arange(1, y.shape[1] + 1)
+    n_tracks = len(msd)
+
+    # Weighted least squares of msd = a + b tau + c tau^2 for all tracks at once
+    basis = np.stack([np.ones_like(tau), tau, tau**2])
+    lhs = np.einsum('nl,il,jl->nij', w, basis, basis)
+    rhs = np.einsum('nl,il,nl->ni', w, basis, y)
+    coefs = np.full((n_tracks, 3), np.nan)
+    fittable = (w > 0).sum(axis=1) >= 3
+    if fittable.any():
+        coefs[fittable] = np.linalg.solve(lhs[fittable], rhs[fittable][..., np.newaxis])[..., 0]
+
+    # Weighted least squares of log msd = log K + alpha log tau over lags w/ msd > 0
+    log_w = np.where(y > 0, w, 0)
+    log_y = np.log(np.where(y > 0, y, 1))
+    log_tau = np.log(tau)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        sum_w = log_w.sum(axis=1)
+        mean_x = (log_w * log_tau).sum(axis=1) / sum_w
+        mean_y = (log_w * log_y).sum(axis=1) / sum_w
+        dx = log_tau - mean_x[:, np.newaxis]
+        alpha = (log_w * dx * (log_y - mean_y[:, np.newaxis])).sum(axis=1) / (log_w * dx**2).sum(axis=1)
+    alpha[(log_w > 0).sum(axis=1) < 2] = np.nan
+
+    return {'noise': np.sqrt(np.maximum(coefs[:, 0], 0) / 4),
+            'diffusion': coefs[:, 1] / 4,
+            'speed': np.sqrt(np.maximum(coefs[:, 2], 0)),
+            'alpha': alpha}
+
+
+def motion_modes(alpha, alphas=MOTION_MODE_ALPHAS):
+    """Get the CellWalker mode that best describes each track from its MSD exponent alpha: STATIONARY if alpha is below
+    alphas[0] (MSD flat), CONSTANT_VELOCITY if above alphas[1] (MSD ~ lag^2), otherwise TURNING (MSD ~ lag like a
+    random walk). -1 for NaN alpha."""
+    modes = np.full(alpha.shape, TURNING, dtype=np.int64)
+    modes[alpha < alphas[0]] = STATIONARY
+    modes[alpha > alphas[1]] = CONSTANT_VELOCITY
+    modes[np.isnan(alpha)] = -1
+    return modes
+
+
+if __name__ == "__main__":
+    output_dir = 'output'
+    tracked_results_file = joinpath(output_dir, 'tracked_results.ndjson')
+    if not os.path.exists(tracked_results_file):
+        tracked_results_file = joinpath(output_dir, 'tracked_results.txt')
+
+    print('Reading tracked results from %s' % (tracked_results_file,))
+    columns = track_columns(read_results(tracked_results_file))
+    order, offsets = ragged_tracks(columns)
+    n_tracks = len(offsets) - 1
+    print('%d cells in %d tracks' % (len(order), n_tracks))
+
+    track_speeds = []
+    for first in range(0, n_tracks, CHUNK_TRACKS):
+        positions, times = padded_tracks(columns, order, offsets, first, min(first + CHUNK_TRACKS, n_tracks))
+        chunk_speeds = speeds(velocities(positions, times))
+        n_steps = np.sum(~np.isnan(chunk_speeds), axis=1)
+        with np.errstate(invalid='ignore'):
+            track_speeds.append(np.nansum(chunk_speeds, axis=1) / n_steps)  # NaN for tracks w/ only 1 cell
+    print('Median track speed: %g px per time unit' % (np.nanmedian(np.concatenate(track_speeds)),))
+
+    track_msds, counts = track_msd(columns)
+    print('Ensemble MSD (px^2) by lag:', ensemble_msd(track_msds, counts)[:11])
+    fit = fit_msd(track_msds, counts, max_lag=10)
+    modes = motion_modes(fit['alpha'])
+    for mode, name in [(STATIONARY, 'stationary'), (CONSTANT_VELOCITY, 'constant velocity'), (TURNING, 'turning')]:
+        print('%d tracks %s' % (np.sum(modes == mode), name))
+
+    print('done.')